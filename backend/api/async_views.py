@@ -0,0 +1,42 @@
+import time
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+from .middleware import check_connections, start_profiler
+
+
+def run_view(view, request, *args, **kwargs):
+    close_old_connections()
+    if settings.DB_CONN_HEALTH_CHECKS:
+        check_connections()
+    profiler = start_profiler()
+    # The replica flag set by DatabaseMiddleware is inherited from the
+    # context sync_to_async copies into this thread.
+    response = view(request, *args, **kwargs)
+    if callable(getattr(response, 'render', None)):
+        # Render here rather than on the event loop thread.
+        started = time.perf_counter()
+        response.render()
+        request._render_time = getattr(request, '_render_time', 0.0) + (
+            time.perf_counter() - started)
+    if profiler is not None:
+        # Handed to InstrumentationMiddleware, which decides whether the
+        # request was slow enough to keep the profile.
+        profiler.disable()
+        request._profiler = profiler
+    close_old_connections()
+    return response
+
+
+def async_view(view):
+    # Django 3.2 has no async ORM, so the whole DRF view runs in a pool
+    # thread; the event loop stays free to serve other clients meanwhile.
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        return await sync_to_async(run_view, thread_sensitive=False)(
+            view, request, *args, **kwargs)
+
+    return wrapper
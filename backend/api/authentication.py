@@ -0,0 +1,32 @@
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+from users.tokens import (cache_token, get_token_user_id, get_user,
+                          read_signed_token)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+
+    def authenticate_credentials(self, key):
+        # Signed tokens carry a ':' separator, DRF token keys are hex.
+        if ':' in key:
+            user = read_signed_token(key)
+            if user is None:
+                raise AuthenticationFailed('Недействительный токен.')
+            return self.check_active(user), key
+        user_id = get_token_user_id(key)
+        if user_id is None:
+            user, token = super().authenticate_credentials(key)
+            cache_token(key, user)
+            return user, token
+        user = get_user(user_id)
+        if user is None:
+            raise AuthenticationFailed('Недействительный токен.')
+        return self.check_active(user), self.get_model()(key=key, user=user)
+
+    @staticmethod
+    def check_active(user):
+        if not user.is_active:
+            raise AuthenticationFailed(
+                'Пользователь неактивен или удалён.')
+        return user
@@ -0,0 +1,249 @@
+from collections import defaultdict
+from itertools import islice
+
+import orjson
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, connections, transaction
+from django.db.models import F
+from rest_framework.settings import api_settings
+
+from recipes.cache import get_tag_ids
+from recipes.images import schedule_thumbnails
+from recipes.models import Ingredient, Recipe, RecipeIngredient, RecipeTag
+from users.timelines import fan_out_recipes
+
+from .serializers import RecipeImportSerializer
+
+User = get_user_model()
+
+NDJSON = 'application/x-ndjson'
+EXPORT_VALUES = ('id', 'name', 'text', 'cooking_time', 'image', 'pub_date',
+                 'author__username')
+
+
+def read_lines(stream, limit):
+    # The body is read line by line and never held in memory as a whole;
+    # a line longer than limit is skipped and reported.
+    number = 0
+    while stream is not None:
+        line = stream.readline(limit + 1)
+        if not line:
+            return
+        number += 1
+        if len(line) > limit:
+            while line and not line.endswith(b'\n'):
+                line = stream.readline(limit + 1)
+            yield number, None
+        elif line.strip():
+            yield number, line
+
+
+def line_error(message):
+    return {api_settings.NON_FIELD_ERRORS_KEY: [message]}
+
+
+def parse_line(line):
+    if line is None:
+        return None, line_error('Строка слишком длинная.')
+    try:
+        data = orjson.loads(line)
+    except orjson.JSONDecodeError:
+        data = None
+    if not isinstance(data, dict):
+        return None, line_error('Строка должна содержать JSON-объект.')
+    serializer = RecipeImportSerializer(data=data)
+    if not serializer.is_valid():
+        return None, serializer.errors
+    return serializer.validated_data, None
+
+
+def get_ingredient_ids(items):
+    names = {ingredient['name']
+             for data in items for ingredient in data['ingredients']}
+    return {
+        (name, unit): pk
+        for pk, name, unit in Ingredient.objects.filter(
+            name__in=names).values_list('pk', 'name', 'measurement_unit')
+    }
+
+
+def get_author_ids(items):
+    return dict(User.objects.filter(
+        username__in={data['author'] for data in items if 'author' in data}
+    ).values_list('username', 'pk'))
+
+
+def resolve(data, taken, author_ids, tag_ids, ingredient_ids):
+    errors = {}
+    if data['name'] in taken:
+        errors['name'] = ['Рецепт с таким названием уже существует']
+    if data['author'] not in author_ids:
+        errors['author'] = [f'Пользователь {data["author"]} не найден!']
+    missing = [slug for slug in data['tags'] if slug not in tag_ids]
+    if missing:
+        errors['tags'] = [f'Теги не найдены: {", ".join(missing)}!']
+    keys = [(ingredient['name'], ingredient['measurement_unit'])
+            for ingredient in data['ingredients']]
+    missing = [f'{name} ({unit})' for name, unit in keys
+               if (name, unit) not in ingredient_ids]
+    if missing:
+        errors['ingredients'] = [
+            f'Ингредиенты не найдены: {", ".join(missing)}!']
+    if errors:
+        return errors
+    data['author'] = author_ids[data['author']]
+    data['tags'] = [tag_ids[slug] for slug in data['tags']]
+    data['ingredients'] = [
+        (ingredient_ids[key], ingredient['amount'])
+        for key, ingredient in zip(keys, data['ingredients'])]
+    return None
+
+
+def validate_chunk(lines, author):
+    parsed, errors = [], []
+    for number, line in lines:
+        data, line_errors = parse_line(line)
+        if line_errors is None:
+            parsed.append((number, data))
+        else:
+            errors.append({'line': number, 'errors': line_errors})
+    # Names, authors, tags and ingredients of the whole chunk are looked up
+    # with one query each.
+    taken = set(Recipe.objects.filter(
+        name__in=[data['name'] for _, data in parsed]
+    ).values_list('name', flat=True))
+    author_ids = get_author_ids(data for _, data in parsed)
+    author_ids[None] = author.pk
+    tag_ids = get_tag_ids()
+    ingredient_ids = get_ingredient_ids(data for _, data in parsed)
+    valid = []
+    for number, data in parsed:
+        data.setdefault('author', None)
+        line_errors = resolve(data, taken, author_ids, tag_ids,
+                              ingredient_ids)
+        if line_errors is None:
+            taken.add(data['name'])
+            valid.append((number, data))
+        else:
+            errors.append({'line': number, 'errors': line_errors})
+    return valid, errors
+
+
+@transaction.atomic
+def create_recipes(items):
+    recipes = Recipe.objects.bulk_create(
+        Recipe(author_id=data['author'], name=data['name'],
+               text=data['text'], cooking_time=data['cooking_time'],
+               image=data['image'])
+        for data in items)
+    if recipes and recipes[0].pk is None:
+        # Backends without RETURNING leave the primary keys unset.
+        pks = dict(Recipe.objects.filter(
+            name__in=[recipe.name for recipe in recipes]
+        ).values_list('name', 'pk'))
+        for recipe in recipes:
+            recipe.pk = pks[recipe.name]
+    RecipeTag.objects.bulk_create(
+        RecipeTag(recipe_id=recipe.pk, tag_id=tag_id)
+        for recipe, data in zip(recipes, items) for tag_id in data['tags'])
+    RecipeIngredient.objects.bulk_create(
+        RecipeIngredient(recipe_id=recipe.pk, ingredient_id=pk,
+                         amount=amount)
+        for recipe, data in zip(recipes, items)
+        for pk, amount in data['ingredients'])
+    # bulk_create sends no signals, so the authors' counters, the
+    # followers' timelines and the thumbnails are handled here.
+    by_author = defaultdict(list)
+    for recipe in recipes:
+        by_author[recipe.author_id].append(recipe.pk)
+    for author_id, recipe_ids in by_author.items():
+        User.objects.filter(pk=author_id).update(
+            recipes_count=F('recipes_count') + len(recipe_ids))
+        fan_out_recipes(author_id, recipe_ids)
+    for recipe in recipes:
+        schedule_thumbnails(recipe)
+    return recipes
+
+
+def import_chunk(chunk, author, retry=True):
+    valid, errors = validate_chunk(chunk, author)
+    if not valid:
+        return 0, errors
+    try:
+        return len(create_recipes([data for _, data in valid])), errors
+    except IntegrityError:
+        # A name taken by a concurrent writer after validation rolls the
+        # chunk back; validating it again reports that line and writes
+        # the others.
+        if retry:
+            return import_chunk(chunk, author, retry=False)
+        errors.extend({'line': number, 'errors': line_error(
+            'Рецепт не сохранён, повторите загрузку.')}
+            for number, _ in valid)
+        return 0, errors
+
+
+def import_recipes(stream, author):
+    # Every chunk is validated and written in its own transaction, so a
+    # failing line only drops itself and earlier chunks stay committed.
+    lines = read_lines(stream, settings.DATA_UPLOAD_MAX_MEMORY_SIZE)
+    created = 0
+    errors = []
+    while True:
+        chunk = list(islice(lines, settings.RECIPE_BULK_CHUNK_SIZE))
+        if not chunk:
+            return created, errors
+        chunk_created, chunk_errors = import_chunk(chunk, author)
+        created += chunk_created
+        errors.extend(sorted(chunk_errors, key=lambda error: error['line']))
+
+
+def get_parts(recipe_ids):
+    tags = defaultdict(list)
+    for recipe_id, slug in RecipeTag.objects.filter(
+            recipe_id__in=recipe_ids).values_list('recipe_id', 'tag__slug'):
+        tags[recipe_id].append(slug)
+    ingredients = defaultdict(list)
+    for recipe_id, name, unit, amount in RecipeIngredient.objects.filter(
+            recipe_id__in=recipe_ids).values_list(
+            'recipe_id', 'ingredient__name', 'ingredient__measurement_unit',
+            'amount'):
+        ingredients[recipe_id].append(
+            {'name': name, 'measurement_unit': unit, 'amount': amount})
+    return tags, ingredients
+
+
+def iter_rows(chunk_size):
+    recipes = Recipe.objects.order_by('pk').values(*EXPORT_VALUES)
+    if not connections[recipes.db].settings_dict.get(
+            'DISABLE_SERVER_SIDE_CURSORS'):
+        yield from recipes.iterator(chunk_size=chunk_size)
+        return
+    # Behind pgbouncer iterator() would fetch the whole result at once,
+    # so the catalogue is read in primary key ranges instead.
+    last = 0
+    while True:
+        rows = list(recipes.filter(pk__gt=last)[:chunk_size])
+        yield from rows
+        if len(rows) < chunk_size:
+            return
+        last = rows[-1]['id']
+
+
+def export_recipes():
+    # Lines have the import format, so an export can be imported into
+    # another instance that shares the media storage.
+    chunk_size = settings.RECIPE_BULK_CHUNK_SIZE
+    rows = iter_rows(chunk_size)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        tags, ingredients = get_parts([row['id'] for row in chunk])
+        for row in chunk:
+            row['author'] = row.pop('author__username')
+        yield b''.join(
+            orjson.dumps(dict(row, tags=tags[row['id']],
+                              ingredients=ingredients[row['id']])) + b'\n'
+            for row in chunk)
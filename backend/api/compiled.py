@@ -0,0 +1,73 @@
+from collections import defaultdict
+
+from recipes.images import image_url
+from recipes.models import RecipeIngredient, Tag
+
+from .middleware import serialization
+from .utils import get_membership
+
+# Plain values() rows rendered in the field order of RecipeListSerializer
+# (and the nested Tag, RecipeIngredient and CustomUser serializers), so
+# list pages skip building DRF fields for every recipe. Keep the field
+# tuples in sync with the serializers; the parity tests in api.tests and
+# benchmark_serializers check that both paths return the same bytes.
+AUTHOR_FIELDS = ('email', 'id', 'username', 'first_name', 'last_name')
+RECIPE_VALUES = (
+    'id', 'name', 'text', 'image', 'thumbnails_ready', 'cooking_time',
+    'pub_date', 'author_id',
+    *(f'author__{field}' for field in AUTHOR_FIELDS),
+)
+TAG_FIELDS = ('id', 'name', 'color', 'slug')
+INGREDIENT_VALUES = ('ingredient_id', 'ingredient__name', 'amount',
+                     'ingredient__measurement_unit')
+INGREDIENT_FIELDS = ('id', 'name', 'amount', 'measurement_unit')
+
+
+def get_tags(recipe_ids):
+    # Same join as prefetching Recipe.tags, so tags come in the same order.
+    tags = defaultdict(list)
+    for recipe_id, *values in Tag.objects.filter(
+            recipe__in=recipe_ids).values_list('recipe', *TAG_FIELDS):
+        tags[recipe_id].append(dict(zip(TAG_FIELDS, values)))
+    return tags
+
+
+def get_ingredients(recipe_ids):
+    ingredients = defaultdict(list)
+    for recipe_id, *values in RecipeIngredient.objects.filter(
+            recipe__in=recipe_ids
+    ).values_list('recipe_id', *INGREDIENT_VALUES):
+        ingredients[recipe_id].append(dict(zip(INGREDIENT_FIELDS, values)))
+    return ingredients
+
+
+def serialize_recipes(rows, request, size='medium'):
+    with serialization(request):
+        return build_recipes(rows, request, size)
+
+
+def build_recipes(rows, request, size):
+    recipe_ids = [row['id'] for row in rows]
+    tags = get_tags(recipe_ids)
+    ingredients = get_ingredients(recipe_ids)
+    membership = get_membership(request)
+    author_values = [f'author__{field}' for field in AUTHOR_FIELDS]
+    data = []
+    for row in rows:
+        pk = row['id']
+        author = dict(zip(AUTHOR_FIELDS, map(row.__getitem__, author_values)))
+        author['is_subscribed'] = row['author_id'] in membership.subscriptions
+        url = image_url(row['image'], row['thumbnails_ready'], size)
+        data.append({
+            'id': pk,
+            'tags': tags[pk],
+            'author': author,
+            'ingredients': ingredients[pk],
+            'is_favorited': pk in membership.favorites,
+            'is_in_shopping_cart': pk in membership.shopping_cart,
+            'name': row['name'],
+            'text': row['text'],
+            'image': url if url is None else request.build_absolute_uri(url),
+            'cooking_time': row['cooking_time'],
+        })
+    return data
@@ -0,0 +1,38 @@
+from django.conf import settings
+
+from recipes.models import Recipe
+from users.models import Subscribe, TimelineEntry
+
+from .compiled import RECIPE_VALUES
+from .pagination import RecipePagination
+
+
+def get_fan_in_authors(user):
+    # Recipes of these authors are not copied into timelines, see
+    # users.timelines.
+    return list(Subscribe.objects.filter(
+        user=user, author__followers_count__gt=settings.FEED_FANOUT_LIMIT
+    ).order_by().values_list('author_id', flat=True))
+
+
+def get_positions(user, cursor, limit):
+    order = RecipePagination.order_position
+    positions = set(order(
+        TimelineEntry.objects.filter(user=user), cursor, pk='recipe_id'
+    ).values_list('pub_date', 'recipe_id')[:limit])
+    authors = get_fan_in_authors(user)
+    if authors:
+        # Entries copied before an author passed the fan-out limit come
+        # back from both queries and are merged by the set.
+        positions.update(order(
+            Recipe.objects.filter(author__in=authors), cursor
+        ).values_list('pub_date', 'id')[:limit])
+    reverse = cursor is None or cursor[0] == 'n'
+    return sorted(positions, reverse=reverse)[:limit]
+
+
+def get_feed(user, cursor, limit):
+    positions = get_positions(user, cursor, limit)
+    rows = {row['id']: row for row in Recipe.objects.values(
+        *RECIPE_VALUES).filter(pk__in=[pk for _, pk in positions])}
+    return [rows[pk] for _, pk in positions if pk in rows]
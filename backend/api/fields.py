@@ -1,4 +1,13 @@
-from rest_framework.serializers import IntegerField
+import posixpath
+
+from django.core.files.storage import default_storage
+from drf_extra_fields.fields import Base64ImageField
+from rest_framework.relations import (MANY_RELATION_KWARGS, ManyRelatedField,
+                                      PrimaryKeyRelatedField)
+from rest_framework.serializers import IntegerField, ReadOnlyField
+
+from recipes.images import thumbnail_url
+from recipes.models import Recipe
 
 
 class CustomIntegerField(IntegerField):
@@ -7,3 +16,65 @@ class CustomIntegerField(IntegerField):
         if isinstance(data, str) and len(data) > self.MAX_STRING_LENGTH:
             self.fail('max_string_length')
         return data
+
+
+class BulkManyRelatedField(ManyRelatedField):
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+        child = self.child_relation
+        pks = []
+        for pk in data:
+            if isinstance(pk, bool):
+                child.fail('incorrect_type', data_type=type(pk).__name__)
+            try:
+                pks.append(int(pk))
+            except (TypeError, ValueError):
+                child.fail('incorrect_type', data_type=type(pk).__name__)
+        objects = child.get_queryset().in_bulk(pks)
+        for pk in pks:
+            if pk not in objects:
+                child.fail('does_not_exist', pk_value=pk)
+        return [objects[pk] for pk in pks]
+
+
+class BulkPrimaryKeyRelatedField(PrimaryKeyRelatedField):
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return BulkManyRelatedField(**list_kwargs)
+
+
+class ThumbnailImageField(ReadOnlyField):
+
+    def __init__(self, size, **kwargs):
+        self.size = size
+        kwargs['source'] = '*'
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        url = thumbnail_url(value, self.size)
+        request = self.context.get('request')
+        if url is None or request is None:
+            return url
+        return request.build_absolute_uri(url)
+
+
+class StoredImageField(Base64ImageField):
+    # Also accepts the storage name of an image that is already in the
+    # media storage, which is how recipes are exported.
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) and not data.startswith('data:'):
+            name = posixpath.normpath(data)
+            upload_to = Recipe._meta.get_field('image').upload_to
+            if name.startswith(upload_to) and default_storage.exists(name):
+                return name
+        return super().to_internal_value(data)
@@ -1,8 +1,12 @@
 from django.contrib.auth import get_user_model
-from django_filters import AllValuesMultipleFilter, BooleanFilter, FilterSet
+from django.db.models import Case, Exists, IntegerField, OuterRef, Value, When
+from django.utils.functional import cached_property
+from django_filters import (BooleanFilter, ChoiceFilter, FilterSet,
+                            MultipleChoiceFilter)
 from django_filters.filters import CharFilter
 
-from recipes.models import Ingredient, Recipe
+from recipes.cache import get_tag_ids
+from recipes.models import Ingredient, Recipe, RecipeTag
 
 User = get_user_model()
 
@@ -16,7 +20,22 @@ class RecipeFilter(FilterSet):
         field_name='cart_users',
         method='filter_cart_favorite'
     )
-    tags = AllValuesMultipleFilter(field_name='tags__slug')
+    tags = MultipleChoiceFilter(method='filter_tags')
+    ordering = ChoiceFilter(
+        choices=(('popular', 'popular'),),
+        method='filter_ordering'
+    )
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # The form checks every submitted slug against the choices, so
+        # the map is resolved once per filterset and only when used.
+        self.filters['tags'].extra['choices'] = lambda: [
+            (slug, slug) for slug in self.tag_ids]
+
+    @cached_property
+    def tag_ids(self):
+        return get_tag_ids()
 
     def filter_cart_favorite(self, queryset, name, value):
         user = getattr(self.request, 'user', None)
@@ -25,13 +44,32 @@ class RecipeFilter(FilterSet):
             return queryset
         return queryset.filter(**{lookup: user})
 
+    def filter_tags(self, queryset, name, value):
+        return queryset.filter(Exists(RecipeTag.objects.filter(
+            recipe=OuterRef('pk'),
+            tag_id__in=[self.tag_ids[slug] for slug in value
+                        if slug in self.tag_ids]
+        )))
+
+    def filter_ordering(self, queryset, name, value):
+        return queryset.order_by('-favorites_count', '-pub_date', '-id')
+
     class Meta:
         model = Recipe
         fields = ('author', 'tags',)
 
 
 class IngredientFilter(FilterSet):
-    name = CharFilter(field_name='name', lookup_expr='icontains')
+    name = CharFilter(method='filter_name')
+
+    def filter_name(self, queryset, name, value):
+        return queryset.filter(name__icontains=value).annotate(
+            is_substring=Case(
+                When(name__istartswith=value, then=Value(0)),
+                default=Value(1),
+                output_field=IntegerField()
+            )
+        ).order_by('is_substring', 'name')
 
     class Meta:
         model = Ingredient
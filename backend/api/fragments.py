@@ -0,0 +1,60 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models import Exists, OuterRef
+
+from recipes.cache import get_cache, get_recipe_version
+from users.models import Favorite, ShoppingCart, Subscribe
+
+from .middleware import serialization
+from .serializers import RecipeGetSerializer
+from .utils import get_membership
+
+User = get_user_model()
+
+FRAGMENT_KEY = 'recipe:{}:{}'
+
+
+def get_fragment(view, pk):
+    cache = get_cache('RECIPE_CACHE_ALIAS')
+    key = FRAGMENT_KEY.format(pk, get_recipe_version(pk))
+    fragment = cache.get(key)
+    if fragment is None:
+        # Without a request the serializer leaves every per-user flag
+        # False and the image URL relative, so the payload can be shared.
+        instance = view.get_object()
+        with serialization(view.request):
+            fragment = RecipeGetSerializer(instance).data
+        cache.set(key, fragment, settings.RECIPE_CACHE_TIMEOUT)
+    return fragment
+
+
+def get_flags(request, recipe_id, author_id):
+    user = request.user
+    if user.is_anonymous:
+        return False, False, False
+    if get_cache('MEMBERSHIP_CACHE_ALIAS') is not None:
+        membership = get_membership(request)
+        return (recipe_id in membership.favorites,
+                recipe_id in membership.shopping_cart,
+                author_id in membership.subscriptions)
+    return User.objects.filter(pk=user.pk).annotate(
+        favorited=Exists(Favorite.objects.filter(
+            user=OuterRef('pk'), recipe_id=recipe_id)),
+        in_cart=Exists(ShoppingCart.objects.filter(
+            user=OuterRef('pk'), recipe_id=recipe_id)),
+        subscribed=Exists(Subscribe.objects.filter(
+            user=OuterRef('pk'), author_id=author_id)),
+    ).values_list('favorited', 'in_cart', 'subscribed').get()
+
+
+def get_recipe_detail(view, request, pk):
+    fragment = get_fragment(view, pk)
+    favorited, in_cart, subscribed = get_flags(
+        request, fragment['id'], fragment['author']['id'])
+    data = dict(fragment)
+    data['author'] = dict(fragment['author'], is_subscribed=subscribed)
+    data['is_favorited'] = favorited
+    data['is_in_shopping_cart'] = in_cart
+    if data['image'] is not None:
+        data['image'] = request.build_absolute_uri(data['image'])
+    return data
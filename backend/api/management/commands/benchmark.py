@@ -0,0 +1,384 @@
+import json
+import math
+import time
+from contextlib import ExitStack
+from datetime import datetime
+from functools import partial
+from tempfile import TemporaryDirectory
+from urllib.parse import quote
+from uuid import uuid4
+
+import django
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import (close_old_connections, connection, connections,
+                       transaction)
+from django.db.models import Exists, OuterRef
+from django.test import Client
+from django.test.utils import (override_settings, setup_test_environment,
+                               teardown_test_environment)
+from rest_framework.authtoken.models import Token
+
+from api.middleware import QueryTimer
+from recipes.management.commands.generate_data import PASSWORD
+from recipes.models import Ingredient, Recipe, RecipeIngredient, Tag
+from users.membership import Membership
+from users.models import Favorite, ShoppingCart, Subscribe
+
+User = get_user_model()
+
+IMAGE = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABAQMAAAAl21bKAAAA'
+    'A1BMVEX///+nxBvIAAAACklEQVQI12NgAAAAAgAB4iG8MwAAAABJRU5ErkJggg=='
+)
+
+
+def percentile(values, fraction):
+    return values[max(math.ceil(fraction * len(values)) - 1, 0)]
+
+
+def flags_membership(user, size):
+    membership = Membership.from_db(user.pk)
+    return [
+        (pk, pk in membership.favorites, pk in membership.shopping_cart,
+         author_id in membership.subscriptions)
+        for pk, author_id in Recipe.objects.values_list(
+            'pk', 'author_id')[:size]
+    ]
+
+
+def flags_exists(user, size):
+    # The per-row annotations the recipe views used before the flags were
+    # read from membership sets, kept as the baseline.
+    return list(Recipe.objects.annotate(
+        is_favorited=Exists(Recipe.objects.filter(
+            pk=OuterRef('pk'), favorited_by=user)),
+        is_in_shopping_cart=Exists(Recipe.objects.filter(
+            cart_users=user, pk=OuterRef('pk'))),
+        is_subscribed=Exists(Subscribe.objects.filter(
+            user=user, author=OuterRef('author'))),
+    ).values_list('pk', 'is_favorited', 'is_in_shopping_cart',
+                  'is_subscribed')[:size])
+
+
+class Scenario:
+
+    def __init__(self, name, method, path, data=None, auth=True,
+                 write=False, call=None):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.data = data
+        self.auth = auth
+        self.write = write
+        self.call = call
+
+    def get_data(self):
+        return self.data() if callable(self.data) else self.data
+
+
+class Command(BaseCommand):
+    help = 'Benchmark every API route against the configured database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument('--only', action='append', default=[],
+                            help='Run scenarios whose name contains this '
+                                 'substring (repeatable)')
+        parser.add_argument('--output',
+                            help='Write JSON results to this file instead '
+                                 'of stdout')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError('--iterations must be positive')
+        scenarios = self.get_scenarios()
+        if options['only']:
+            scenarios = [
+                scenario for scenario in scenarios
+                if any(part in scenario.name for part in options['only'])
+            ]
+        setup_test_environment()
+        try:
+            with TemporaryDirectory() as media:
+                with override_settings(MEDIA_ROOT=media):
+                    results = [
+                        self.run(scenario, options['iterations'],
+                                 options['warmup'])
+                        for scenario in scenarios
+                    ]
+        finally:
+            teardown_test_environment()
+        report = {
+            'started': datetime.now().isoformat(timespec='seconds'),
+            'database': connection.vendor,
+            'conn_max_age': connection.settings_dict['CONN_MAX_AGE'],
+            'django': django.get_version(),
+            'iterations': options['iterations'],
+            'dataset': {
+                'users': User.objects.count(),
+                'recipes': Recipe.objects.count(),
+                'ingredients': Ingredient.objects.count(),
+            },
+            'results': results,
+        }
+        if options['output'] is None:
+            self.stdout.write(json.dumps(report, ensure_ascii=False,
+                                         indent=2))
+            return
+        with open(options['output'], 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        for result in results:
+            self.stdout.write(
+                f'{result["name"]:<32} {result["status"]:>4} '
+                f'p50 {result["p50_ms"]:>8.2f}ms '
+                f'p99 {result["p99_ms"]:>8.2f}ms '
+                f'{result["throughput"]:>8.1f} req/s '
+                f'{result["queries"]:>4} queries')
+
+    def get_scenarios(self):
+        user = User.objects.filter(
+            pk__in=ShoppingCart.objects.values('user_id')).first()
+        user = user or User.objects.first()
+        recipe = Recipe.objects.first()
+        if user is None or recipe is None:
+            raise CommandError(
+                'The database is empty, run generate_data first')
+        self.token = Token.objects.get_or_create(user=user)[0].key
+        tag = Tag.objects.first()
+        ingredient = Ingredient.objects.first()
+        own = Recipe.objects.filter(author=user).first()
+        free = Recipe.objects.exclude(favorited_by=user).exclude(
+            cart_users=user).first()
+        favorite = Favorite.objects.filter(user=user).first()
+        cart = ShoppingCart.objects.filter(user=user).first()
+        subscription = Subscribe.objects.filter(user=user).first()
+        batch = list(Recipe.objects.exclude(cart_users=user).values_list(
+            'pk', flat=True)[:50])
+        author = User.objects.exclude(pk=user.pk).exclude(
+            subscription__user=user).first()
+        tags = '&'.join(f'tags={slug}' for slug in Tag.objects.values_list(
+            'slug', flat=True)[:2])
+        deep_page = max(Recipe.objects.count() // 6 // 2, 1)
+
+        scenarios = [
+            Scenario('recipes-list', 'get', '/api/recipes/', auth=False),
+            Scenario('recipes-list-auth', 'get', '/api/recipes/'),
+            Scenario('recipes-list-deep-page', 'get',
+                     f'/api/recipes/?page={deep_page}'),
+            Scenario('recipes-list-cursor', 'get', '/api/recipes/?cursor='),
+            Scenario('recipes-list-tags', 'get', f'/api/recipes/?{tags}'),
+            Scenario('recipes-list-favorited', 'get',
+                     '/api/recipes/?is_favorited=true'),
+            Scenario('recipes-list-shopping-cart', 'get',
+                     '/api/recipes/?is_in_shopping_cart=true'),
+            Scenario('recipes-feed', 'get', '/api/recipes/feed/'),
+            Scenario('recipes-detail', 'get', f'/api/recipes/{recipe.pk}/'),
+            Scenario('recipes-create', 'post', '/api/recipes/',
+                     data=lambda: self.recipe_data(tag, ingredient),
+                     write=True),
+            Scenario('download-shopping-cart-txt', 'get',
+                     '/api/recipes/download_shopping_cart/?format=txt'),
+            Scenario('download-shopping-cart-csv', 'get',
+                     '/api/recipes/download_shopping_cart/?format=csv'),
+            Scenario('download-shopping-cart-pdf', 'get',
+                     '/api/recipes/download_shopping_cart/?format=pdf'),
+            Scenario('tags-list', 'get', '/api/tags/', auth=False),
+            Scenario('ingredients-list', 'get', '/api/ingredients/',
+                     auth=False),
+            Scenario('ingredients-search', 'get',
+                     '/api/ingredients/?name=' + quote(
+                         ingredient.name[:3] if ingredient else 'а'),
+                     auth=False),
+            Scenario('users-list', 'get', '/api/users/'),
+            Scenario('users-detail', 'get', f'/api/users/{user.pk}/'),
+            Scenario('users-me', 'get', '/api/users/me/'),
+            Scenario('users-subscriptions', 'get',
+                     '/api/users/subscriptions/?recipes_limit=3'),
+            Scenario('users-create', 'post', '/api/users/',
+                     data=self.user_data, auth=False, write=True),
+            Scenario('users-set-password', 'post',
+                     '/api/users/set_password/',
+                     data={'current_password': PASSWORD,
+                           'new_password': PASSWORD},
+                     write=True),
+            Scenario('token-login', 'post', '/api/auth/token/login/',
+                     data={'email': user.email, 'password': PASSWORD},
+                     auth=False, write=True),
+            Scenario('token-logout', 'post', '/api/auth/token/logout/',
+                     write=True),
+        ]
+        scenarios += self.get_flag_scenarios(user)
+        scenarios += self.get_keystroke_scenarios(ingredient)
+        if tag is not None:
+            scenarios.append(
+                Scenario('tags-detail', 'get', f'/api/tags/{tag.pk}/',
+                         auth=False))
+        if ingredient is not None:
+            scenarios.append(
+                Scenario('ingredients-detail', 'get',
+                         f'/api/ingredients/{ingredient.pk}/', auth=False))
+        if own is not None:
+            scenarios += [
+                Scenario('recipes-update', 'patch', f'/api/recipes/{own.pk}/',
+                         data=self.update_data(own), write=True),
+                Scenario('recipes-delete', 'delete',
+                         f'/api/recipes/{own.pk}/', write=True),
+            ]
+        if free is not None:
+            scenarios += [
+                Scenario('favorite-add', 'get',
+                         f'/api/recipes/{free.pk}/favorite/', write=True),
+                Scenario('shopping-cart-add', 'get',
+                         f'/api/recipes/{free.pk}/shopping_cart/',
+                         write=True),
+                Scenario('shopping-cart-batch-add', 'post',
+                         '/api/recipes/shopping_cart/',
+                         data={'recipes': batch}, write=True),
+            ]
+        if favorite is not None:
+            scenarios.append(Scenario(
+                'favorite-remove', 'delete',
+                f'/api/recipes/{favorite.recipe_id}/favorite/', write=True))
+        if cart is not None:
+            scenarios.append(Scenario(
+                'shopping-cart-remove', 'delete',
+                f'/api/recipes/{cart.recipe_id}/shopping_cart/', write=True))
+        if author is not None:
+            scenarios.append(Scenario(
+                'subscribe', 'get', f'/api/users/{author.pk}/subscribe/',
+                write=True))
+        if subscription is not None:
+            scenarios.append(Scenario(
+                'unsubscribe', 'delete',
+                f'/api/users/{subscription.author_id}/subscribe/',
+                write=True))
+        return scenarios
+
+    @staticmethod
+    def get_flag_scenarios(user):
+        scenarios = []
+        for size in (6, 100):
+            scenarios += [
+                Scenario(f'recipe-flags-membership-{size}', 'call',
+                         f'flags_membership(user, {size})',
+                         call=partial(flags_membership, user, size)),
+                Scenario(f'recipe-flags-exists-{size}', 'call',
+                         f'flags_exists(user, {size})',
+                         call=partial(flags_exists, user, size)),
+            ]
+        return scenarios
+
+    @staticmethod
+    def get_keystroke_scenarios(ingredient):
+        # The ingredient field of the recipe form searches on every
+        # keystroke, the short prefixes match most of the catalogue.
+        if ingredient is None:
+            return []
+        return [
+            Scenario(f'ingredients-keystroke-{length}', 'get',
+                     '/api/ingredients/?name=' + quote(
+                         ingredient.name[:length]),
+                     auth=False)
+            for length in range(1, min(len(ingredient.name), 8) + 1)
+        ]
+
+    @staticmethod
+    def recipe_data(tag, ingredient):
+        return {
+            'name': f'Benchmark {uuid4().hex}',
+            'text': 'Описание рецепта',
+            'cooking_time': 10,
+            'image': IMAGE,
+            'tags': [tag.pk] if tag else [],
+            'ingredients': [{'id': ingredient.pk, 'amount': 10}]
+            if ingredient else [],
+        }
+
+    @staticmethod
+    def update_data(recipe):
+        ingredients = RecipeIngredient.objects.filter(recipe=recipe)
+        return {
+            'cooking_time': recipe.cooking_time + 1,
+            'tags': list(recipe.tags.values_list('pk', flat=True)),
+            'ingredients': [
+                {'id': item.ingredient_id, 'amount': item.amount + 1}
+                for item in ingredients
+            ],
+        }
+
+    @staticmethod
+    def user_data():
+        username = f'benchmark_{uuid4().hex[:12]}'
+        return {
+            'email': f'{username}@example.com',
+            'username': username,
+            'first_name': 'Имя',
+            'last_name': 'Фамилия',
+            'password': PASSWORD,
+        }
+
+    def request(self, client, scenario):
+        headers = {}
+        if scenario.auth:
+            headers['HTTP_AUTHORIZATION'] = f'Token {self.token}'
+        data = scenario.get_data()
+        kwargs = {}
+        if data is not None:
+            kwargs['data'] = json.dumps(data)
+            kwargs['content_type'] = 'application/json'
+        timer = QueryTimer()
+        with ExitStack() as stack:
+            if scenario.write:
+                # Writes are rolled back so every iteration sees the same
+                # dataset; on_commit callbacks are discarded with them.
+                stack.enter_context(transaction.atomic())
+            for db in connections.all():
+                stack.enter_context(db.execute_wrapper(timer))
+            started = time.perf_counter()
+            if scenario.call is not None:
+                scenario.call()
+                status = 200
+            else:
+                response = getattr(client, scenario.method)(
+                    scenario.path, **kwargs, **headers)
+                if hasattr(response, 'streaming_content'):
+                    for _ in response.streaming_content:
+                        pass
+                status = response.status_code
+            elapsed = time.perf_counter() - started
+            if scenario.write:
+                transaction.set_rollback(True)
+        # The test client keeps connections open between requests; close
+        # them like the WSGI handler does so CONN_MAX_AGE is honoured and
+        # connection setup shows up in the latencies.
+        close_old_connections()
+        return status, elapsed, timer.count
+
+    def run(self, scenario, iterations, warmup):
+        client = Client()
+        for _ in range(warmup):
+            self.request(client, scenario)
+        latencies = []
+        queries = []
+        statuses = set()
+        for _ in range(iterations):
+            status, elapsed, count = self.request(client, scenario)
+            statuses.add(status)
+            latencies.append(elapsed)
+            queries.append(count)
+        latencies.sort()
+        total = sum(latencies)
+        return {
+            'name': scenario.name,
+            'method': scenario.method.upper(),
+            'path': scenario.path,
+            'status': max(statuses),
+            'iterations': iterations,
+            'throughput': round(iterations / total, 2) if total else None,
+            'mean_ms': round(total / iterations * 1000, 3),
+            'p50_ms': round(percentile(latencies, 0.5) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+            'queries': max(queries),
+        }
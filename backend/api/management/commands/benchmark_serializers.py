@@ -0,0 +1,137 @@
+import json
+import time
+from contextlib import ExitStack
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from django.test.utils import (override_settings, setup_test_environment,
+                               teardown_test_environment)
+from rest_framework.authtoken.models import Token
+
+from api.middleware import QueryTimer
+from recipes.models import Recipe, Tag
+from users.models import ShoppingCart
+
+from .benchmark import percentile
+
+User = get_user_model()
+
+MODES = (('drf', False), ('compiled', True))
+
+
+class Command(BaseCommand):
+    help = ('Check that the compiled recipe list renders the same bytes as '
+            'the DRF serializers and compare their throughput')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=30)
+        parser.add_argument('--limit', type=int, default=50)
+        parser.add_argument('--output',
+                            help='Write JSON results to this file instead '
+                                 'of stdout')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError('--iterations must be positive')
+        user = User.objects.filter(
+            pk__in=ShoppingCart.objects.values('user_id')).first()
+        user = user or User.objects.first()
+        if user is None or not Recipe.objects.exists():
+            raise CommandError(
+                'The database is empty, run generate_data first')
+        token = Token.objects.get_or_create(user=user)[0].key
+        clients = {
+            'anonymous': Client(),
+            'authenticated': Client(HTTP_AUTHORIZATION=f'Token {token}'),
+        }
+        setup_test_environment()
+        try:
+            checked = self.check_parity(clients, self.get_paths(
+                options['limit'], user))
+            path = f'/api/recipes/?limit={options["limit"]}'
+            results = [
+                self.measure(clients['authenticated'], path, name, fast,
+                             options['iterations'])
+                for name, fast in MODES
+            ]
+        finally:
+            teardown_test_environment()
+        report = {'parity_checked': checked, 'path': path,
+                  'results': results}
+        if options['output'] is None:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        with open(options['output'], 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(f'Identical output for {checked} responses')
+        for result in results:
+            self.stdout.write(
+                f'{result["mode"]:<10} p50 {result["p50_ms"]:>8.2f}ms '
+                f'p99 {result["p99_ms"]:>8.2f}ms '
+                f'sql {result["sql_ms"]:>8.2f}ms '
+                f'python {result["python_ms"]:>8.2f}ms '
+                f'{result["throughput"]:>8.1f} req/s')
+
+    @staticmethod
+    def get_paths(limit, user):
+        tags = '&'.join(f'tags={slug}' for slug in Tag.objects.values_list(
+            'slug', flat=True)[:2])
+        author = Recipe.objects.values_list('author_id', flat=True).first()
+        return [
+            '/api/recipes/',
+            f'/api/recipes/?limit={limit}',
+            f'/api/recipes/?limit={limit}&page=2',
+            f'/api/recipes/?limit={limit}&cursor=',
+            f'/api/recipes/?limit={limit}&{tags}',
+            f'/api/recipes/?limit={limit}&author={author}',
+            f'/api/recipes/?limit={limit}&ordering=popular',
+            f'/api/recipes/?limit={limit}&is_favorited=true',
+            f'/api/recipes/?limit={limit}&is_in_shopping_cart=true',
+            '/api/recipes/?cursor=invalid',
+        ]
+
+    @staticmethod
+    def fetch(client, path, fast):
+        with override_settings(API_FAST_RECIPE_LIST=fast):
+            response = client.get(path)
+        return response.status_code, response.content
+
+    def check_parity(self, clients, paths):
+        checked = 0
+        for name, client in clients.items():
+            for path in paths:
+                expected = self.fetch(client, path, False)
+                actual = self.fetch(client, path, True)
+                if actual != expected:
+                    raise CommandError(
+                        f'{name} {path}: compiled output differs\n'
+                        f'drf:      {expected!r:.500}\n'
+                        f'compiled: {actual!r:.500}')
+                checked += 1
+        return checked
+
+    def measure(self, client, path, mode, fast, iterations):
+        latencies = []
+        sql = []
+        for _ in range(iterations):
+            timer = QueryTimer()
+            with ExitStack() as stack:
+                for db in connections.all():
+                    stack.enter_context(db.execute_wrapper(timer))
+                started = time.perf_counter()
+                self.fetch(client, path, fast)
+                latencies.append(time.perf_counter() - started)
+            sql.append(timer.elapsed)
+        total = sum(latencies)
+        latencies.sort()
+        return {
+            'mode': mode,
+            'iterations': iterations,
+            'throughput': round(iterations / total, 2),
+            'p50_ms': round(percentile(latencies, 0.5) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+            'sql_ms': round(sum(sql) / iterations * 1000, 3),
+            'python_ms': round((total - sum(sql)) / iterations * 1000, 3),
+        }
@@ -0,0 +1,140 @@
+import json
+import re
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+from rest_framework.authtoken.models import Token
+
+from recipes.models import Recipe, RecipeIngredient, RecipeTag, Tag
+from users.models import (Favorite, ShoppingCart, ShoppingListItem, Subscribe,
+                          TimelineEntry)
+
+User = get_user_model()
+
+# A full scan shows up as "SCAN <table>" without an index on SQLite and
+# as "Seq Scan on <table>" on PostgreSQL.
+FULL_SCAN = {
+    'sqlite': re.compile(r'\bSCAN (?!.*\bUSING\b)(\w+)'),
+    'postgresql': re.compile(r'\bSeq Scan on (\w+)'),
+}
+# Page counts visit every matching row by design, their plans are kept
+# but not checked; PAGINATION_COUNT_CACHE_ALIAS caches them.
+PAGE_COUNT = re.compile(r'^\s*SELECT COUNT\(\*\) AS "__count" FROM')
+
+PAGE = 'limit=6'
+
+
+class QueryRecorder:
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if not many and sql.lstrip().upper().startswith('SELECT'):
+            self.queries.append((sql, params))
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = ('Capture the query plans of the hot API endpoints on a seeded '
+            'database and fail when one of their queries scans a whole '
+            'table')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output',
+                            help='Write JSON plans to this file instead '
+                                 'of stdout')
+
+    def handle(self, *args, **options):
+        pattern = FULL_SCAN.get(connection.vendor)
+        if pattern is None:
+            raise CommandError(f'Unsupported database: {connection.vendor}')
+        user = User.objects.filter(
+            pk__in=ShoppingCart.objects.values('user_id')).filter(
+            pk__in=Subscribe.objects.values('user_id')).first()
+        recipe = Recipe.objects.first()
+        if user is None or recipe is None:
+            raise CommandError(
+                'The database is empty, run generate_data first')
+        token = Token.objects.get_or_create(user=user)[0].key
+        client = Client(HTTP_AUTHORIZATION=f'Token {token}')
+        tables = {model._meta.db_table for model in (
+            Recipe, RecipeIngredient, RecipeTag, Favorite, ShoppingCart,
+            Subscribe, ShoppingListItem, TimelineEntry, User)}
+        plans = []
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            for name, path in self.get_requests(client, recipe):
+                for number, (sql, params) in enumerate(
+                        self.capture(client, name, path), 1):
+                    plan = self.explain(sql, params)
+                    scans = [] if PAGE_COUNT.match(sql) else sorted(
+                        set(pattern.findall(plan)) & tables)
+                    plans.append({'name': f'{name}#{number}', 'path': path,
+                                  'sql': sql, 'plan': plan,
+                                  'full_scans': scans})
+        report = {'database': connection.vendor, 'queries': plans}
+        if options['output'] is None:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+            for item in plans:
+                self.stdout.write(
+                    f'{item["name"]:<32} '
+                    f'{", ".join(item["full_scans"]) or "ok"}')
+        failed = [item['name'] for item in plans if item['full_scans']]
+        if failed:
+            raise CommandError(f'Full table scans in: {", ".join(failed)}')
+
+    @staticmethod
+    def get_requests(client, recipe):
+        # The queries come from the views, filters and paginators
+        # themselves, so the plans follow the code as it changes.
+        tags = '&'.join(f'tags={slug}' for slug in Tag.objects.values_list(
+            'slug', flat=True)[:2])
+        requests = [
+            ('recipes-list', f'/api/recipes/?{PAGE}'),
+            ('recipes-author', f'/api/recipes/?{PAGE}&author='
+                               f'{recipe.author_id}'),
+            ('recipes-popular', f'/api/recipes/?{PAGE}&ordering=popular'),
+            ('recipes-tags', f'/api/recipes/?{PAGE}&{tags}'),
+            ('recipes-favorited', f'/api/recipes/?{PAGE}&is_favorited=true'),
+            ('recipes-shopping-cart',
+             f'/api/recipes/?{PAGE}&is_in_shopping_cart=true'),
+            ('recipe-detail', f'/api/recipes/{recipe.pk}/'),
+            ('subscriptions',
+             f'/api/users/subscriptions/?{PAGE}&recipes_limit=3'),
+            ('feed', f'/api/recipes/feed/?{PAGE}'),
+            ('shopping-list', '/api/recipes/download_shopping_cart/'),
+        ]
+        # Keyset pages past the first one filter on the cursor position.
+        for name, path in (('recipes-list-cursor',
+                            f'/api/recipes/?{PAGE}&cursor='),
+                           ('feed-cursor', f'/api/recipes/feed/?{PAGE}')):
+            following = client.get(path).json()['next']
+            if following:
+                requests.append((name, following))
+        return requests
+
+    @staticmethod
+    def capture(client, name, path):
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            response = client.get(path)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        if response.status_code != 200:
+            raise CommandError(f'{name}: {path} answered '
+                               f'{response.status_code}')
+        return recorder.queries
+
+    @staticmethod
+    def explain(sql, params):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'{connection.ops.explain_query_prefix()} {sql}', params)
+            return '\n'.join(' '.join(map(str, row))
+                             for row in cursor.fetchall())
@@ -0,0 +1,117 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection, HTTPException
+from threading import Lock
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+from .benchmark import percentile
+
+DEFAULT_PATHS = (
+    '/api/recipes/',
+    '/api/recipes/?cursor=',
+    '/api/tags/',
+    '/api/ingredients/?name=%D1%81%D0%BE',
+)
+
+
+class Command(BaseCommand):
+    help = ('Hit a running server with concurrent keep-alive clients to '
+            'compare WSGI and ASGI workers')
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', help='Server base URL, e.g. '
+                                        'http://127.0.0.1:8000')
+        parser.add_argument('--path', action='append', dest='paths',
+                            help='Path to request (repeatable)')
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--read-delay', type=float, default=0.0,
+                            help='Seconds a client waits between reading '
+                                 'the headers and the body, simulating '
+                                 'slow clients')
+        parser.add_argument('--token', help='Authorization token')
+        parser.add_argument('--label', default='',
+                            help='Stored in the report, e.g. wsgi or asgi')
+        parser.add_argument('--output',
+                            help='Write JSON results to this file instead '
+                                 'of stdout')
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['url'])
+        if url.scheme != 'http' or not url.hostname:
+            raise CommandError('Only http:// URLs are supported')
+        self.host, self.port = url.hostname, url.port or 80
+        self.paths = options['paths'] or DEFAULT_PATHS
+        self.headers = {}
+        if options['token']:
+            self.headers['Authorization'] = f'Token {options["token"]}'
+        self.read_delay = options['read_delay']
+        self.remaining = options['requests']
+        self.lock = Lock()
+        self.latencies = []
+        self.errors = 0
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(options['concurrency']) as executor:
+            for _ in range(options['concurrency']):
+                executor.submit(self.client)
+        elapsed = time.perf_counter() - started
+
+        latencies = sorted(self.latencies)
+        report = {
+            'label': options['label'],
+            'url': options['url'],
+            'paths': list(self.paths),
+            'concurrency': options['concurrency'],
+            'read_delay': self.read_delay,
+            'requests': len(latencies),
+            'errors': self.errors,
+            'elapsed_s': round(elapsed, 3),
+            'throughput': round(len(latencies) / elapsed, 2),
+            'p50_ms': round(percentile(latencies, 0.5) * 1000, 3)
+            if latencies else None,
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 3)
+            if latencies else None,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output'] is None:
+            self.stdout.write(output)
+            return
+        with open(options['output'], 'w', encoding='utf-8') as f:
+            f.write(output)
+
+    def take(self):
+        with self.lock:
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            return True
+
+    def client(self):
+        connection = HTTPConnection(self.host, self.port, timeout=60)
+        number = 0
+        while self.take():
+            path = self.paths[number % len(self.paths)]
+            number += 1
+            started = time.perf_counter()
+            try:
+                connection.request('GET', path, headers=self.headers)
+                response = connection.getresponse()
+                if self.read_delay:
+                    time.sleep(self.read_delay)
+                response.read()
+            except (OSError, HTTPException):
+                connection.close()
+                connection = HTTPConnection(self.host, self.port, timeout=60)
+                with self.lock:
+                    self.errors += 1
+                continue
+            elapsed = time.perf_counter() - started
+            with self.lock:
+                if response.status >= 400:
+                    self.errors += 1
+                self.latencies.append(elapsed)
+        connection.close()
@@ -0,0 +1,58 @@
+from collections import defaultdict
+from threading import Lock
+
+from django.http import HttpResponse
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Metrics:
+    counters = (
+        ('requests_total', 'Requests served'),
+        ('errors_total', 'Requests answered with 5xx'),
+        ('sql_queries_total', 'SQL queries executed'),
+        ('sql_seconds_total', 'Time spent in SQL'),
+        ('serialize_seconds_total', 'Time spent serializing response data'),
+        ('render_seconds_total', 'Time spent rendering responses'),
+        ('request_seconds_total', 'Total request time'),
+    )
+    prefix = 'foodgram_'
+
+    def __init__(self):
+        self.lock = Lock()
+        self.values = defaultdict(lambda: defaultdict(float))
+
+    def record(self, view, method, status, sql_count, sql_time,
+               serialize_time, render_time, total_time):
+        labels = (view, method)
+        with self.lock:
+            values = self.values[labels]
+            values['requests_total'] += 1
+            values['errors_total'] += status >= 500
+            values['sql_queries_total'] += sql_count
+            values['sql_seconds_total'] += sql_time
+            values['serialize_seconds_total'] += serialize_time
+            values['render_seconds_total'] += render_time
+            values['request_seconds_total'] += total_time
+
+    def lines(self):
+        with self.lock:
+            snapshot = {labels: dict(values)
+                        for labels, values in self.values.items()}
+        for counter, description in self.counters:
+            name = f'{self.prefix}{counter}'
+            yield f'# HELP {name} {description}.'
+            yield f'# TYPE {name} counter'
+            for (view, method), values in sorted(snapshot.items()):
+                yield (f'{name}{{view="{view}",method="{method}"}} '
+                       f'{float(values.get(counter, 0))}')
+
+    def render(self):
+        return '\n'.join(self.lines()) + '\n'
+
+
+metrics = Metrics()
+
+
+def metrics_view(request):
+    return HttpResponse(metrics.render(), content_type=CONTENT_TYPE)
@@ -0,0 +1,214 @@
+import asyncio
+import cProfile
+import os
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+from rest_framework.permissions import SAFE_METHODS
+
+from foodgram.routers import REPLICA, replica_reads
+
+from .metrics import metrics
+
+
+class QueryTimer:
+
+    def __init__(self):
+        self.count = 0
+        self.elapsed = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.elapsed += time.perf_counter() - started
+            self.count += 1
+
+
+# The timer of the request being served. Context variables follow the
+# request into the threads sync_to_async runs views in under ASGI, so
+# one wrapper installed on every connection (see api.signals) reaches
+# the right timer in both deployments.
+request_timer = ContextVar('request_timer', default=None)
+
+
+def time_query(execute, sql, params, many, context):
+    timer = request_timer.get()
+    if timer is None:
+        return execute(sql, params, many, context)
+    return timer(execute, sql, params, many, context)
+
+
+@contextmanager
+def serialization(request):
+    # DRF views pass their Request, which wraps the HttpRequest that the
+    # middleware reads the timings from.
+    request = getattr(request, '_request', request)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if hasattr(request, '_serialize_time'):
+            request._serialize_time += time.perf_counter() - started
+
+
+class HybridMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = asyncio.iscoroutinefunction(get_response)
+        if self.async_mode:
+            # Marks the instance as a coroutine function for Django 3.2.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.async_call(request)
+        return self.sync_call(request)
+
+
+class InstrumentationMiddleware(HybridMiddleware):
+
+    def sync_call(self, request):
+        profiler = start_profiler()
+        timer = self.start(request)
+        started = time.perf_counter()
+        token = request_timer.set(timer)
+        try:
+            response = self.get_response(request)
+        finally:
+            request_timer.reset(token)
+        if profiler is not None:
+            profiler.disable()
+            request._profiler = profiler
+        return self.finish(request, response, timer, started)
+
+    async def async_call(self, request):
+        # The profiler can only follow the thread it is enabled in, so
+        # under ASGI api.async_views profiles the views it runs instead.
+        timer = self.start(request)
+        started = time.perf_counter()
+        token = request_timer.set(timer)
+        try:
+            response = await self.get_response(request)
+        finally:
+            request_timer.reset(token)
+        return self.finish(request, response, timer, started)
+
+    @staticmethod
+    def start(request):
+        request._render_time = 0.0
+        request._serialize_time = 0.0
+        request._profiler = None
+        return QueryTimer()
+
+    def finish(self, request, response, timer, started):
+        total = time.perf_counter() - started
+        view = self.get_view_name(request)
+        metrics.record(view, request.method, response.status_code,
+                       timer.count, timer.elapsed, request._serialize_time,
+                       request._render_time, total)
+        if request._profiler is not None and (
+                total * 1000 >= settings.INSTRUMENTATION_PROFILE_THRESHOLD):
+            dump_profile(request._profiler, view)
+        if settings.INSTRUMENTATION_SERVER_TIMING:
+            response['Server-Timing'] = ', '.join((
+                f'sql;desc="{timer.count} queries";'
+                f'dur={timer.elapsed * 1000:.1f}',
+                f'serialize;dur={request._serialize_time * 1000:.1f}',
+                f'render;dur={request._render_time * 1000:.1f}',
+                f'total;dur={total * 1000:.1f}',
+            ))
+        return response
+
+    def process_template_response(self, request, response):
+        started = time.perf_counter()
+
+        def rendered(response):
+            request._render_time += time.perf_counter() - started
+
+        response.add_post_render_callback(rendered)
+        return response
+
+    @staticmethod
+    def get_view_name(request):
+        match = getattr(request, 'resolver_match', None)
+        if match is None:
+            return 'unresolved'
+        return match.view_name
+
+
+def start_profiler():
+    if settings.INSTRUMENTATION_PROFILE_THRESHOLD is None:
+        return None
+    if random.random() >= settings.INSTRUMENTATION_PROFILE_SAMPLE_RATE:
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiler is already active in this thread.
+        return None
+    return profiler
+
+
+def dump_profile(profiler, view):
+    os.makedirs(settings.INSTRUMENTATION_PROFILE_DIR, exist_ok=True)
+    profiler.dump_stats(os.path.join(
+        settings.INSTRUMENTATION_PROFILE_DIR,
+        f'{view.replace(":", "-")}-{time.time_ns()}.prof'))
+
+
+def check_connections():
+    for connection in connections.all():
+        if connection.connection is None or connection.in_atomic_block:
+            continue
+        if not connection.is_usable():
+            connection.close()
+
+
+def use_replica(request, view_func):
+    if REPLICA not in settings.DATABASES:
+        return False
+    if request.method not in SAFE_METHODS:
+        return False
+    # GET endpoints that write (favorite, cart, subscribe toggles)
+    # opt out, since their checks must see the primary's state.
+    return getattr(getattr(view_func, 'cls', None), 'use_replica', True)
+
+
+class DatabaseMiddleware(HybridMiddleware):
+
+    def sync_call(self, request):
+        if settings.DB_CONN_HEALTH_CHECKS:
+            check_connections()
+        token = replica_reads.set(False)
+        try:
+            return self.get_response(request)
+        finally:
+            replica_reads.reset(token)
+
+    async def async_call(self, request):
+        # Sync views run in the thread-sensitive executor, whose
+        # connections are checked here; api.async_views checks the pool
+        # thread it runs a view in. sync_to_async carries the flag set by
+        # process_view back to this context and on to either thread.
+        if settings.DB_CONN_HEALTH_CHECKS:
+            await sync_to_async(check_connections)()
+        token = replica_reads.set(False)
+        try:
+            return await self.get_response(request)
+        finally:
+            replica_reads.reset(token)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if use_replica(request, view_func):
+            replica_reads.set(True)
@@ -0,0 +1,34 @@
+from django.db import migrations
+
+# The app migrations of users and recipes are generated at deploy, so the
+# hand-written ones live here and run after the recipes tables exist.
+INDEX = 'ingredient_name_trgm'
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    table = apps.get_model('recipes', 'Ingredient')._meta.db_table
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    # icontains compares UPPER(name), the index covers that expression.
+    schema_editor.execute(
+        f'CREATE INDEX IF NOT EXISTS {INDEX} ON {table} '
+        'USING gin (UPPER(name::text) gin_trgm_ops)'
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(f'DROP INDEX IF EXISTS {INDEX}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '__first__'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,80 @@
+from hashlib import md5
+
+from django.conf import settings
+from django.utils.cache import (parse_etags, patch_cache_control,
+                                patch_vary_headers)
+from rest_framework import status
+from rest_framework.response import Response
+
+from recipes.cache import get_cache, get_version
+
+from .middleware import serialization
+
+
+class TimedSerializer:
+    # Stands in for a serializer and times .data, where DRF builds the
+    # representation, as the serialize phase of the request.
+
+    def __init__(self, serializer, request):
+        self._serializer = serializer
+        self._request = request
+
+    def __getattr__(self, name):
+        return getattr(self._serializer, name)
+
+    @property
+    def data(self):
+        with serialization(self._request):
+            return self._serializer.data
+
+
+class SerializationTimingMixin:
+
+    def get_serializer(self, *args, **kwargs):
+        with serialization(self.request):
+            serializer = super().get_serializer(*args, **kwargs)
+        return TimedSerializer(serializer, self.request)
+
+
+class ReferenceCacheMixin:
+
+    def get_etag(self, request):
+        if request.accepted_renderer.format != 'json':
+            return None
+        version = get_version(self.get_queryset().model)
+        if version is None:
+            return None
+        # The model version changes on every write, so the payload and the
+        # strong ETag are both keyed by it together with the query string.
+        key = f'{version}:{request.get_full_path()}'
+        return f'"{md5(key.encode()).hexdigest()}"'
+
+    def cached(self, handler, request, *args, **kwargs):
+        etag = self.get_etag(request)
+        if etag is None:
+            return handler(request, *args, **kwargs)
+        if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            cache = get_cache()
+            key = f'response:{etag}'
+            data = cache.get(key)
+            if data is not None:
+                response = Response(data)
+            else:
+                response = handler(request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                cache.set(key, response.data,
+                          settings.REFERENCE_CACHE_TIMEOUT)
+        response['ETag'] = etag
+        patch_cache_control(response, public=True,
+                            max_age=settings.REFERENCE_CACHE_MAX_AGE)
+        patch_vary_headers(response, ('Accept',))
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached(super().retrieve, request, *args, **kwargs)
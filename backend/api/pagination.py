@@ -1,5 +1,179 @@
+from base64 import b64decode, b64encode
+from collections import OrderedDict
+from hashlib import md5
+from uuid import uuid4
+
+from django.apps import apps
+from django.conf import settings
+from django.core.paginator import Paginator as DjangoPaginator
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from recipes.cache import get_cache
+
+COUNT_VERSION_KEY = 'count_version:{}'
+
+
+def get_count_version(cache, sql):
+    # Each table the query reads has a version token, so a write to any of
+    # them moves the count to a new key. Writes that send no signals, such
+    # as bulk loads, are only bounded by PAGINATION_COUNT_CACHE_TIMEOUT.
+    keys = sorted(
+        COUNT_VERSION_KEY.format(model._meta.db_table)
+        for model in apps.get_models(include_auto_created=True)
+        if f'"{model._meta.db_table}"' in sql
+    )
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, uuid4().hex, None)
+            versions[key] = cache.get(key) or ''
+    return ':'.join(versions[key] for key in keys)
+
+
+def bump_count_version(model):
+    cache = get_cache('PAGINATION_COUNT_CACHE_ALIAS')
+    if cache is not None:
+        cache.set(COUNT_VERSION_KEY.format(model._meta.db_table),
+                  uuid4().hex, None)
+
+
+def get_count(queryset):
+    cache = get_cache('PAGINATION_COUNT_CACHE_ALIAS')
+    if cache is None or not hasattr(queryset, 'query'):
+        return None
+    sql = str(queryset.query)
+    version = get_count_version(cache, sql)
+    key = f'count:{md5(f"{version}:{sql}".encode()).hexdigest()}'
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, settings.PAGINATION_COUNT_CACHE_TIMEOUT)
+    return count
+
+
+class CachedCountPaginator(DjangoPaginator):
+
+    @cached_property
+    def count(self):
+        count = get_count(self.object_list)
+        if count is None:
+            return DjangoPaginator.count.func(self)
+        return count
 
 
 class CustomPagination(PageNumberPagination):
+    django_paginator_class = CachedCountPaginator
     page_size_query_param = 'limit'
+
+
+class RecipePagination(CustomPagination):
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # Cursors encode a feed position, so explicit orderings such as
+        # ?ordering=popular keep page numbers.
+        self.keyset = not queryset.query.order_by and (
+            self.cursor_query_param in request.query_params)
+        if not self.keyset:
+            return super().paginate_queryset(queryset, request, view)
+        return self.paginate_keyset(request, lambda cursor, limit: list(
+            self.order_position(queryset, cursor)[:limit]
+        ), get_count(queryset))
+
+    def paginate_keyset(self, request, fetch, count=None):
+        # fetch(cursor, limit) returns up to limit rows past the cursor in
+        # the order given by order_position.
+        self.keyset = True
+        self.count = count
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+        reverse = cursor is not None and cursor[0] == 'p'
+        results = fetch(cursor, self.page_size + 1)
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+        self.results = results
+        return results
+
+    @classmethod
+    def order_position(cls, queryset, cursor, pk='id'):
+        if cursor is None:
+            return queryset.order_by('-pub_date', f'-{pk}')
+        queryset = cls.filter_position(queryset, *cursor, field=pk)
+        if cursor[0] == 'p':
+            return queryset.order_by('pub_date', pk)
+        return queryset.order_by('-pub_date', f'-{pk}')
+
+    @staticmethod
+    def filter_position(queryset, direction, pub_date, pk, field='id'):
+        # pub_date alone bounds the index range scan, the pk only breaks
+        # ties between recipes published at the same moment.
+        if direction == 'n':
+            return queryset.filter(
+                Q(pub_date__lt=pub_date) | Q(**{f'{field}__lt': pk}),
+                pub_date__lte=pub_date)
+        return queryset.filter(
+            Q(pub_date__gt=pub_date) | Q(**{f'{field}__gt': pk}),
+            pub_date__gte=pub_date)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            direction, pub_date, pk = b64decode(
+                encoded.encode(), altchars=b'-_', validate=True
+            ).decode().split('|')
+            pub_date, pk = parse_datetime(pub_date), int(pk)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if direction not in ('n', 'p') or pub_date is None:
+            raise NotFound(self.invalid_cursor_message)
+        return direction, pub_date, pk
+
+    def encode_cursor(self, direction, recipe):
+        if isinstance(recipe, dict):
+            pub_date, pk = recipe['pub_date'], recipe['id']
+        else:
+            pub_date, pk = recipe.pub_date, recipe.pk
+        position = f'{direction}|{pub_date.isoformat()}|{pk}'
+        encoded = b64encode(position.encode(), altchars=b'-_').decode()
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.page_query_param)
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.keyset:
+            return super().get_next_link()
+        if not self.has_next or not self.results:
+            return None
+        return self.encode_cursor('n', self.results[-1])
+
+    def get_previous_link(self):
+        if not self.keyset:
+            return super().get_previous_link()
+        if not self.has_previous or not self.results:
+            return None
+        return self.encode_cursor('p', self.results[0])
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+        fields = [('next', self.get_next_link()),
+                  ('previous', self.get_previous_link()),
+                  ('results', data)]
+        if self.count is not None:
+            fields.insert(0, ('count', self.count))
+        return Response(OrderedDict(fields))
@@ -0,0 +1,165 @@
+import csv
+import os
+from abc import ABCMeta, abstractmethod
+from tempfile import SpooledTemporaryFile
+
+import orjson
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+
+class FastJSONRenderer(JSONRenderer):
+    # Same bytes as JSONRenderer for compact unicode output, which is what
+    # API clients get; pretty-printed and ASCII output keep the json path.
+    line_separators = (
+        ('\u2028'.encode(), b'\\u2028'),
+        ('\u2029'.encode(), b'\\u2029'),
+    )
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None or self.ensure_ascii or not self.compact or (
+                self.get_indent(accepted_media_type,
+                                renderer_context or {}) is not None):
+            return super().render(data, accepted_media_type,
+                                  renderer_context)
+        # Datetimes go through the DRF encoder, which formats them
+        # differently from orjson.
+        ret = orjson.dumps(data, default=self.encoder_class().default,
+                           option=orjson.OPT_PASSTHROUGH_DATETIME)
+        for character, escaped in self.line_separators:
+            if character in ret:
+                ret = ret.replace(character, escaped)
+        return ret
+
+
+class Echo:
+
+    def write(self, value):
+        return value
+
+
+class ShoppingCartRenderer(BaseRenderer, metaclass=ABCMeta):
+    charset = 'utf-8'
+    filename = 'Ingredients'
+    chunk_size = 64 * 1024
+
+    @property
+    def content_type(self):
+        if self.charset is None:
+            return self.media_type
+        return f'{self.media_type}; charset={self.charset}'
+
+    def get_filename(self):
+        return f'{self.filename}.{self.format}'
+
+    # Yields the document as byte chunks, so the view can stream it.
+    @abstractmethod
+    def stream(self, rows):
+        ...
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return b''.join(self.stream(data))
+
+
+class LineShoppingCartRenderer(ShoppingCartRenderer):
+
+    # Yields one encoded line per ingredient row.
+    @abstractmethod
+    def lines(self, rows):
+        ...
+
+    def stream(self, rows):
+        chunk = []
+        size = 0
+        for line in self.lines(rows):
+            chunk.append(line)
+            size += len(line)
+            if size >= self.chunk_size:
+                yield b''.join(chunk)
+                chunk = []
+                size = 0
+        if chunk:
+            yield b''.join(chunk)
+
+
+class TextShoppingCartRenderer(LineShoppingCartRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def lines(self, rows):
+        for name, unit, amount in rows:
+            yield f'{name} - {amount}{unit} \n'.encode(self.charset)
+
+
+class CSVShoppingCartRenderer(LineShoppingCartRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+    header = ('Ингредиент', 'Количество', 'Единица измерения')
+
+    def lines(self, rows):
+        writer = csv.writer(Echo())
+        yield writer.writerow(self.header).encode(self.charset)
+        for name, unit, amount in rows:
+            yield writer.writerow((name, amount, unit)).encode(self.charset)
+
+
+class PDFShoppingCartRenderer(ShoppingCartRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+    title = 'Список покупок'
+    font_name = 'ShoppingCartFont'
+    font_size = 12
+    line_height = 18
+    margin = 50
+    spool_size = 1024 * 1024
+
+    def get_font(self):
+        path = settings.SHOPPING_CART_PDF_FONT
+        if not os.path.exists(path):
+            # The built-in PDF fonts have no Cyrillic glyphs and would
+            # render every ingredient name blank.
+            raise ImproperlyConfigured(
+                f'SHOPPING_CART_PDF_FONT: font file {path} not found, '
+                f'install fonts-dejavu-core or point the setting to a '
+                f'TrueType font with Cyrillic glyphs')
+        if self.font_name not in pdfmetrics.getRegisteredFontNames():
+            pdfmetrics.registerFont(TTFont(self.font_name, path))
+        return self.font_name
+
+    def stream(self, rows):
+        # Checked before the response starts, a missing font must fail the
+        # request instead of breaking off a streamed document.
+        return self.pages(rows, self.get_font())
+
+    def pages(self, rows, font):
+        width, height = A4
+        with SpooledTemporaryFile(max_size=self.spool_size) as output:
+            pdf = canvas.Canvas(output, pagesize=A4)
+            pdf.setTitle(self.title)
+            pdf.setFont(font, self.font_size + 4)
+            pdf.drawString(self.margin, height - self.margin, self.title)
+            y = height - self.margin - 2 * self.line_height
+            pdf.setFont(font, self.font_size)
+            for name, unit, amount in rows:
+                if y < self.margin:
+                    pdf.showPage()
+                    pdf.setFont(font, self.font_size)
+                    y = height - self.margin
+                pdf.drawString(self.margin, y, f'{name} - {amount}{unit}')
+                y -= self.line_height
+            pdf.save()
+            output.seek(0)
+            yield from iter(lambda: output.read(self.chunk_size), b'')
+
+
+SHOPPING_CART_RENDERERS = (
+    TextShoppingCartRenderer,
+    CSVShoppingCartRenderer,
+    PDFShoppingCartRenderer,
+)
@@ -1,18 +1,28 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
 from django.shortcuts import get_object_or_404
 from djoser.serializers import UserCreateSerializer, UserSerializer
 from drf_extra_fields.fields import Base64ImageField
+from rest_framework.authtoken.models import Token
 from rest_framework.fields import (BooleanField, CharField, CurrentUserDefault,
-                                   EmailField, HiddenField, ReadOnlyField)
-from rest_framework.relations import PrimaryKeyRelatedField
+                                   EmailField, HiddenField, ListField,
+                                   ReadOnlyField, SlugField)
 from rest_framework.serializers import (IntegerField, ModelSerializer,
+                                        Serializer, SerializerMethodField,
                                         ValidationError)
 from rest_framework.validators import UniqueValidator
 
+from recipes.images import discard_thumbnails, schedule_thumbnails
 from recipes.models import Ingredient, Recipe, RecipeIngredient, RecipeTag, Tag
 from users.models import Subscribe
+from users.shopping_list import cart_users, change
+from users.tokens import make_signed_token
 
-from .fields import CustomIntegerField
+from .fields import (BulkPrimaryKeyRelatedField, CustomIntegerField,
+                     StoredImageField, ThumbnailImageField)
+from .utils import get_membership, get_recipes_limit
 
 User = get_user_model()
 
@@ -33,14 +43,31 @@ class CustomUserCreateSerializer(UserCreateSerializer):
     )
 
 
+class CustomTokenSerializer(ModelSerializer):
+    auth_token = SerializerMethodField()
+
+    class Meta:
+        model = Token
+        fields = ('auth_token',)
+
+    def get_auth_token(self, obj):
+        if settings.AUTH_SIGNED_TOKENS:
+            return make_signed_token(obj.user)
+        return obj.key
+
+
 class CustomUserSerializer(UserSerializer):
-    is_subscribed = BooleanField(read_only=True, default=False)
+    is_subscribed = SerializerMethodField()
 
     class Meta:
         model = User
         fields = ('email', 'id', 'username',
                   'first_name', 'last_name', 'is_subscribed',)
 
+    def get_is_subscribed(self, obj):
+        membership = get_membership(self.context.get('request'))
+        return obj.pk in membership.subscriptions
+
 
 class TagSerializer(ModelSerializer):
 
@@ -74,8 +101,8 @@ class RecipeGetSerializer(ModelSerializer):
     ingredients = RecipeIngredientSerializer(source='recipe_ingredients',
                                              many=True)
     author = CustomUserSerializer()
-    is_in_shopping_cart = BooleanField(read_only=True, default=False)
-    is_favorited = BooleanField(read_only=True, default=False)
+    is_in_shopping_cart = SerializerMethodField()
+    is_favorited = SerializerMethodField()
 
     class Meta:
         model = Recipe
@@ -83,11 +110,23 @@ class RecipeGetSerializer(ModelSerializer):
                   'is_in_shopping_cart', 'name', 'text',
                   'image', 'cooking_time',)
 
+    def get_is_in_shopping_cart(self, obj):
+        membership = get_membership(self.context.get('request'))
+        return obj.pk in membership.shopping_cart
+
+    def get_is_favorited(self, obj):
+        membership = get_membership(self.context.get('request'))
+        return obj.pk in membership.favorites
+
+
+class RecipeListSerializer(RecipeGetSerializer):
+    image = ThumbnailImageField(size='medium')
+
 
 class RecipeCreateUpdateSerializer(ModelSerializer):
     author = HiddenField(default=CurrentUserDefault())
-    tags = PrimaryKeyRelatedField(queryset=Tag.objects.all(),
-                                  many=True)
+    tags = BulkPrimaryKeyRelatedField(queryset=Tag.objects.all(),
+                                      many=True)
     ingredients = IngredientSerializer(many=True)
     image = Base64ImageField(max_length=None, use_url=True)
 
@@ -113,6 +152,12 @@ class RecipeCreateUpdateSerializer(ModelSerializer):
         }
 
     def to_representation(self, instance):
+        prefetch_related_objects(
+            [instance], 'tags',
+            Prefetch('recipe_ingredients',
+                     queryset=RecipeIngredient.objects.select_related(
+                         'ingredient'))
+        )
         serializer = RecipeGetSerializer(instance, context=self.context)
         return serializer.data
 
@@ -146,71 +191,147 @@ class RecipeCreateUpdateSerializer(ModelSerializer):
         if quantity != len(cleaned):
             raise ValidationError(
                 'Ингредиенты в рецепте не должны повторяться!')
+
+        missing = cleaned - Ingredient.objects.in_bulk(cleaned).keys()
+        if missing:
+            raise ValidationError(
+                'Ингредиенты не найдены: '
+                f'{", ".join(map(str, sorted(missing)))}!')
         return value
 
+    @staticmethod
+    def add_tags_ingredients(recipe, tags, ingredients):
+        RecipeTag.objects.bulk_create(
+            RecipeTag(recipe=recipe, tag=tag) for tag in tags)
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe,
+                             ingredient_id=ingredient['id'],
+                             amount=ingredient['amount'])
+            for ingredient in ingredients)
+
+    @transaction.atomic
     def create(self, validated_data):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
         recipe = Recipe.objects.create(**validated_data)
-        recipe.tags.set(tags)
-        recipe_ingredients = [RecipeIngredient(
-            recipe=recipe,
-            ingredient=get_object_or_404(Ingredient,
-                                         id=ingredient['id']),
-            amount=ingredient['amount'])
-            for ingredient in ingredients]
-        RecipeIngredient.objects.bulk_create(recipe_ingredients)
+        self.add_tags_ingredients(recipe, tags, ingredients)
+        schedule_thumbnails(recipe)
         return recipe
 
+    @staticmethod
+    def update_tags(recipe, tags):
+        current = set(RecipeTag.objects.filter(
+            recipe=recipe).values_list('tag_id', flat=True))
+        submitted = {tag.pk for tag in tags}
+        if current - submitted:
+            RecipeTag.objects.filter(
+                recipe=recipe, tag_id__in=current - submitted).delete()
+        RecipeTag.objects.bulk_create(
+            RecipeTag(recipe=recipe, tag_id=pk)
+            for pk in submitted - current)
+
+    @staticmethod
+    def update_ingredients(recipe, ingredients):
+        current = {
+            recipe_ingredient.ingredient_id: recipe_ingredient
+            for recipe_ingredient in RecipeIngredient.objects.filter(
+                recipe=recipe)
+        }
+        submitted = {ingredient['id']: int(ingredient['amount'])
+                     for ingredient in ingredients}
+        removed = current.keys() - submitted.keys()
+        deltas = {pk: -current[pk].amount for pk in removed}
+        for pk, amount in submitted.items():
+            deltas[pk] = amount - getattr(current.get(pk), 'amount', 0)
+        if removed:
+            RecipeIngredient.objects.filter(
+                recipe=recipe, ingredient_id__in=removed).delete()
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient_id=pk, amount=amount)
+            for pk, amount in submitted.items() if pk not in current)
+        changed = []
+        for pk, amount in submitted.items():
+            if pk in current and current[pk].amount != amount:
+                current[pk].amount = amount
+                changed.append(current[pk])
+        RecipeIngredient.objects.bulk_update(changed, ('amount',))
+        if any(deltas.values()):
+            change(cart_users(recipe.pk), deltas)
+
+    @transaction.atomic
     def update(self, instance, validated_data):
-        if 'tags' in validated_data:
-            tags = validated_data.pop('tags')
-            RecipeTag.objects.filter(recipe=instance).delete()
-            instance.tags.add(*tags)
-        if 'ingredients' in validated_data:
-            ingredients = validated_data.pop('ingredients')
-            RecipeIngredient.objects.filter(recipe=instance).delete()
-            new_ingredients = [RecipeIngredient(
-                recipe=instance,
-                ingredient=get_object_or_404(Ingredient, pk=ingredient['id']),
-                amount=ingredient['amount']) for ingredient in ingredients]
-            RecipeIngredient.objects.bulk_create(new_ingredients)
-        return super().update(instance, validated_data)
+        tags = validated_data.pop('tags', None)
+        ingredients = validated_data.pop('ingredients', None)
+        if tags is not None or ingredients is not None:
+            list(Recipe.objects.select_for_update().filter(
+                pk=instance.pk).values_list('pk'))
+        if tags is not None:
+            self.update_tags(instance, tags)
+        if ingredients is not None:
+            self.update_ingredients(instance, ingredients)
+        if 'image' in validated_data:
+            validated_data['thumbnails_ready'] = False
+            discard_thumbnails(instance.image.name)
+        instance = super().update(instance, validated_data)
+        if 'image' in validated_data:
+            schedule_thumbnails(instance)
+        return instance
+
+
+class IngredientImportSerializer(Serializer):
+    name = CharField(max_length=256)
+    measurement_unit = CharField(max_length=50)
+    amount = IntegerField(
+        min_value=1, max_value=32767,
+        error_messages={
+            'min_value': 'Количество ингредиента не должно быть менее 1!'})
+
+
+class RecipeImportSerializer(Serializer):
+    # One NDJSON line of /api/recipes/bulk/. Tags and ingredients are
+    # referenced by slug and by name with unit, and resolved for a whole
+    # chunk of lines at once.
+    # Username of the author, the importing admin when left out.
+    author = CharField(max_length=150, required=False)
+    name = CharField(max_length=200)
+    text = CharField(max_length=1500)
+    cooking_time = IntegerField(
+        min_value=1, max_value=32767,
+        error_messages={
+            'min_value': 'Время приготовления не должно быть менее 1 минуты!'})
+    image = StoredImageField()
+    tags = ListField(child=SlugField(max_length=50), allow_empty=False)
+    ingredients = IngredientImportSerializer(many=True, allow_empty=False)
+
+    def validate_tags(self, value):
+        if len(value) != len(set(value)):
+            raise ValidationError('Теги не должны повторяться!')
+        return value
+
+    def validate_ingredients(self, value):
+        keys = {(item['name'], item['measurement_unit']) for item in value}
+        if len(keys) != len(value):
+            raise ValidationError(
+                'Ингредиенты в рецепте не должны повторяться!')
+        return value
 
 
 class CartFavoriteSerializer(ModelSerializer):
+    image = ThumbnailImageField(size='small')
 
     class Meta:
         model = Recipe
         fields = ('id', 'name', 'cooking_time', 'image',)
-        read_only_fields = ('name', 'cooking_time', 'image',)
+        read_only_fields = ('name', 'cooking_time',)
 
-    def validate(self, data):
-        request = self.context['request']
-        if request.method == 'GET':
-            attr = request.resolver_match.url_name
-            user = request.user
-            pk = self.context['view'].kwargs.get('pk')
-            attr_msg = {'favorites': 'избранное',
-                        'shopping_cart': 'список покупок'}
-            if getattr(user, attr).filter(pk=pk).exists():
-                raise ValidationError(
-                    f'Рецепт уже был добавлен в {attr_msg[attr]}!')
-        return data
 
-    def update(self, instance, validated_data):
-        request = self.context['request']
-        attr = request.resolver_match.url_name
-        user = request.user
-        if request.method == 'GET':
-            getattr(user, attr).add(instance)
-        else:
-            getattr(user, attr).remove(instance)
-        return instance
+class CartFavoriteBatchSerializer(Serializer):
+    recipes = ListField(child=IntegerField(min_value=1), allow_empty=False,
+                        max_length=settings.CART_FAVORITE_BATCH_LIMIT)
 
 
 class SubscriptionsSerializer(ModelSerializer):
-    recipes = CartFavoriteSerializer(read_only=True, many=True)
+    recipes = SerializerMethodField()
     is_subscribed = BooleanField(read_only=True, default=True)
 
     class Meta:
@@ -218,6 +339,14 @@ class SubscriptionsSerializer(ModelSerializer):
         fields = ('email', 'id', 'username', 'first_name', 'last_name',
                   'is_subscribed', 'recipes', 'recipes_count',)
 
+    def get_recipes(self, obj):
+        recipes = obj.recipes.all()
+        limit = get_recipes_limit(self.context.get('request'))
+        if limit is not None:
+            recipes = recipes[:limit]
+        return CartFavoriteSerializer(recipes, many=True,
+                                      context=self.context).data
+
 
 class SubscribeSerializer(ModelSerializer):
     user = HiddenField(default=CurrentUserDefault())
@@ -0,0 +1,32 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from recipes.cache import get_cache
+
+from .middleware import time_query
+from .pagination import bump_count_version
+
+
+@receiver(connection_created)
+def install_query_timer(sender, connection, **kwargs):
+    # The wrapper list belongs to the connection wrapper and outlives
+    # reconnects, so it is installed once.
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+
+
+@receiver(m2m_changed)
+@receiver(post_delete)
+@receiver(post_save)
+def rows_changed(sender, using=None, action='post_save', **kwargs):
+    # Bumped after the commit, so a count taken from the old rows is never
+    # stored under the new version.
+    if not action.startswith('post_'):
+        return
+    if get_cache('PAGINATION_COUNT_CACHE_ALIAS') is not None:
+        transaction.on_commit(partial(bump_count_version, sender),
+                              using=using)
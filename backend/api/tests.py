@@ -0,0 +1,1306 @@
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+from base64 import urlsafe_b64encode
+from datetime import timedelta
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.db.models.signals import pre_delete
+from django.test import (AsyncClient, RequestFactory, TestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from foodgram.routers import ReplicaRouter, replica_reads
+from recipes.cache import get_tag_ids
+from recipes.images import thumbnail_names
+from recipes.models import Ingredient, Recipe, RecipeIngredient, RecipeTag, Tag
+from users.checks import check_token_cache
+from users.membership import Membership
+from users.models import (Favorite, ShoppingCart, ShoppingListItem, Subscribe,
+                          TimelineEntry)
+from users.shopping_list import find_drifted
+from users.tokens import USER_KEY, get_user, password_hash
+
+from . import middleware
+from .async_views import async_view
+from .metrics import metrics
+from .middleware import InstrumentationMiddleware
+from .renderers import LineShoppingCartRenderer, ShoppingCartRenderer
+from .views import TagViewSet
+
+User = get_user_model()
+
+LOCMEM = 'django.core.cache.backends.locmem.LocMemCache'
+
+IMAGE = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABAQMAAAAl21bKAAAA'
+    'A1BMVEX///+nxBvIAAAACklEQVQI12NgAAAAAgAB4iG8MwAAAABJRU5ErkJggg=='
+)
+
+
+def create_user(username):
+    return User.objects.create(username=username, email=f'{username}@ya.ru',
+                               first_name=username, last_name=username)
+
+
+def token_client(user):
+    # Authenticates through the token like API clients do, so the token
+    # lookup is part of every counted request.
+    client = APIClient()
+    token = Token.objects.create(user=user)
+    client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+    return client
+
+
+def create_recipes(author, count):
+    return Recipe.objects.bulk_create(
+        Recipe(author=author, name=f'{author.username} {number}', text='Текст',
+               cooking_time=10, image='recipes/image.png')
+        for number in range(count))
+
+
+class SubscriptionsQueriesTest(TestCase):
+    url = '/api/users/subscriptions/'
+
+    def setUp(self):
+        self.user = create_user('reader')
+        self.client = token_client(self.user)
+
+    def subscribe(self, authors, recipes):
+        for number in range(authors):
+            author = create_user(f'author{number}')
+            create_recipes(author, recipes)
+            Subscribe.objects.create(user=self.user, author=author)
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        for authors, recipes in ((1, 1), (6, 3), (6, 20)):
+            with self.subTest(authors=authors, recipes=recipes):
+                User.objects.exclude(pk=self.user.pk).delete()
+                self.subscribe(authors, recipes)
+                for params in ('', '?recipes_limit=2'):
+                    with self.assertNumQueries(4):
+                        response = self.client.get(self.url + params)
+                    self.assertEqual(response.status_code, 200)
+                    results = response.json()['results']
+                    self.assertEqual(len(results), authors)
+                    expected = min(recipes, 2) if params else recipes
+                    for author in results:
+                        self.assertEqual(len(author['recipes']), expected)
+
+
+class ShoppingCartDownloadTest(TestCase):
+    url = '/api/recipes/download_shopping_cart/?format=pdf'
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(create_user('buyer'))
+
+    def test_pdf(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(b''.join(response.streaming_content).startswith(
+            b'%PDF'))
+
+    @override_settings(SHOPPING_CART_PDF_FONT='/nonexistent/font.ttf')
+    def test_pdf_without_font_fails(self):
+        with self.assertRaises(ImproperlyConfigured):
+            self.client.get(self.url)
+
+    def test_text_formats(self):
+        for format, content_type in (('txt', 'text/plain; charset=utf-8'),
+                                     ('csv', 'text/csv; charset=utf-8')):
+            with self.subTest(format=format):
+                response = self.client.get(
+                    f'/api/recipes/download_shopping_cart/?format={format}')
+                self.assertEqual(response['Content-Type'], content_type)
+                b''.join(response.streaming_content)
+
+    def test_base_renderers_are_abstract(self):
+        for renderer in (ShoppingCartRenderer, LineShoppingCartRenderer):
+            with self.subTest(renderer=renderer.__name__):
+                with self.assertRaises(TypeError):
+                    renderer()
+
+
+class RecipeWriteQueriesTest(TestCase):
+    url = '/api/recipes/'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media = tempfile.mkdtemp()
+        cls.settings = override_settings(MEDIA_ROOT=cls.media)
+        cls.settings.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.settings.disable()
+        shutil.rmtree(cls.media, ignore_errors=True)
+        super().tearDownClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('cook')
+        Tag.objects.bulk_create(
+            Tag(name=f'Тег {number}', color=f'#00000{number}',
+                slug=f'tag{number}') for number in range(2))
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ингредиент {number}', measurement_unit='г')
+            for number in range(31))
+        cls.tags = list(Tag.objects.order_by('pk'))
+        *cls.ingredients, cls.replaced = Ingredient.objects.order_by('pk')
+
+    def setUp(self):
+        self.client = token_client(self.user)
+
+    def recipe_data(self, name, ingredients):
+        return {
+            'name': name,
+            'text': 'Описание',
+            'cooking_time': 10,
+            'image': IMAGE,
+            'tags': [tag.pk for tag in self.tags],
+            'ingredients': [{'id': ingredient.pk, 'amount': 10}
+                            for ingredient in ingredients],
+        }
+
+    def test_create_query_count_does_not_depend_on_ingredients(self):
+        for ingredients in (1, 30):
+            with self.subTest(ingredients=ingredients):
+                data = self.recipe_data(f'Рецепт {ingredients}',
+                                        self.ingredients[:ingredients])
+                with self.assertNumQueries(17):
+                    response = self.client.post(self.url, data,
+                                                format='json')
+                self.assertEqual(response.status_code, 201)
+                self.assertEqual(len(response.json()['ingredients']),
+                                 ingredients)
+
+    def test_update_query_count_does_not_depend_on_ingredients(self):
+        for ingredients in (1, 30):
+            with self.subTest(ingredients=ingredients):
+                name = f'Рецепт {ingredients}'
+                response = self.client.post(
+                    self.url, self.recipe_data(name, [self.replaced]),
+                    format='json')
+                url = f'{self.url}{response.json()["id"]}/'
+                data = self.recipe_data(name, self.ingredients[:ingredients])
+                for ingredient in data['ingredients']:
+                    ingredient['amount'] = 20
+                with self.assertNumQueries(22):
+                    response = self.client.patch(url, data, format='json')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(
+                    [item['amount'] for item in response.json()[
+                        'ingredients']], [20] * ingredients)
+
+    def write_statements(self, queries):
+        tables = (RecipeTag._meta.db_table, RecipeIngredient._meta.db_table)
+        statements = [query['sql'] for query in queries if query[
+            'sql'].startswith(('INSERT', 'DELETE', 'UPDATE'))]
+        return [sql for sql in statements
+                if any(f'"{table}"' in sql for table in tables)]
+
+    def test_resubmitting_unchanged_recipe_writes_no_links(self):
+        data = self.recipe_data('Рецепт', self.ingredients[:5])
+        recipe = self.client.post(self.url, data, format='json').json()
+        rows = dict(RecipeIngredient.objects.filter(
+            recipe=recipe['id']).values_list('ingredient_id', 'pk'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(f'{self.url}{recipe["id"]}/', data,
+                                         format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.write_statements(queries), [])
+        self.assertEqual(dict(RecipeIngredient.objects.filter(
+            recipe=recipe['id']).values_list('ingredient_id', 'pk')), rows)
+
+    def test_changed_amount_updates_only_its_row(self):
+        data = self.recipe_data('Рецепт', self.ingredients[:5])
+        recipe = self.client.post(self.url, data, format='json').json()
+        rows = dict(RecipeIngredient.objects.filter(
+            recipe=recipe['id']).values_list('ingredient_id', 'pk'))
+        data['ingredients'][0]['amount'] = 99
+        with CaptureQueriesContext(connection) as queries:
+            self.client.patch(f'{self.url}{recipe["id"]}/', data,
+                              format='json')
+        statements = self.write_statements(queries)
+        self.assertEqual(len(statements), 1)
+        self.assertTrue(statements[0].startswith('UPDATE'))
+        self.assertEqual(dict(RecipeIngredient.objects.filter(
+            recipe=recipe['id']).values_list('ingredient_id', 'pk')), rows)
+        self.assertEqual(RecipeIngredient.objects.get(
+            pk=rows[self.ingredients[0].pk]).amount, 99)
+
+    @override_settings(RECIPE_IMAGE_WORKERS=0)
+    def test_replacing_image_removes_old_thumbnails(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe = self.client.post(self.url, self.recipe_data(
+                'Рецепт', self.ingredients[:1]), format='json').json()
+        old = Recipe.objects.get(pk=recipe['id']).image.name
+        self.assertTrue(all(map(default_storage.exists,
+                                thumbnail_names(old))))
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(f'{self.url}{recipe["id"]}/',
+                                         {'image': IMAGE}, format='json')
+        self.assertEqual(response.status_code, 200)
+        new = Recipe.objects.get(pk=recipe['id'])
+        self.assertTrue(new.thumbnails_ready)
+        self.assertFalse(any(map(default_storage.exists,
+                                 thumbnail_names(old))))
+        self.assertTrue(all(map(default_storage.exists,
+                                thumbnail_names(new.image.name))))
+
+    def test_unknown_ingredients_are_checked_in_one_query(self):
+        data = self.recipe_data('Рецепт', self.ingredients)
+        data['ingredients'] += [{'id': 100000 + number, 'amount': 1}
+                                for number in range(3)]
+        # Token, tags, name uniqueness and all ingredients in one query.
+        with self.assertNumQueries(4):
+            response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('100000, 100001, 100002',
+                      response.json()['ingredients'][0])
+
+
+class RecipeTagFilterTest(TestCase):
+    url = '/api/recipes/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        # Created one by one, the post_save signal resets the cached
+        # slug map.
+        cls.tags = [Tag.objects.create(name=f'Тег {number}',
+                                       color=f'#00000{number}',
+                                       slug=f'tag{number}')
+                    for number in range(3)]
+        create_recipes(cls.user, 4)
+        recipes = list(Recipe.objects.order_by('pk'))
+        RecipeTag.objects.bulk_create([
+            RecipeTag(recipe=recipes[0], tag=cls.tags[0]),
+            RecipeTag(recipe=recipes[0], tag=cls.tags[1]),
+            RecipeTag(recipe=recipes[1], tag=cls.tags[1]),
+            RecipeTag(recipe=recipes[2], tag=cls.tags[2]),
+        ])
+        cls.recipes = recipes
+
+    def setUp(self):
+        self.client = token_client(self.user)
+
+    def get(self, *slugs):
+        query = '&'.join(f'tags={slug}' for slug in slugs)
+        return self.client.get(f'{self.url}?{query}')
+
+    def test_query_count_does_not_depend_on_tags(self):
+        self.get()
+        for slugs in ((), ('tag0',), ('tag0', 'tag1'),
+                      ('tag0', 'tag1', 'tag2')):
+            with self.subTest(slugs=slugs):
+                with self.assertNumQueries(8):
+                    response = self.get(*slugs)
+                self.assertEqual(response.status_code, 200)
+
+    def test_multiple_tags_match_once(self):
+        response = self.get('tag0', 'tag1')
+        self.assertEqual(
+            sorted(recipe['id'] for recipe in response.json()['results']),
+            [self.recipes[0].pk, self.recipes[1].pk])
+        self.assertEqual(response.json()['count'], 2)
+
+    def test_multiple_tags_filter_with_one_exists(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.get('tag0', 'tag1')
+        table = RecipeTag._meta.db_table
+        sql = [query['sql'] for query in queries
+               if 'FROM "recipes_recipe"' in query['sql']]
+        self.assertTrue(sql)
+        for query in sql:
+            self.assertEqual(query.count(f'EXISTS(SELECT (1) AS "a" FROM '
+                                         f'"{table}"'), 1)
+            self.assertNotIn('DISTINCT', query)
+            self.assertNotIn(f'JOIN "{table}"', query)
+
+    def test_unknown_tag_is_rejected(self):
+        response = self.get('tag0', 'missing')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('tags', response.json())
+
+
+@override_settings(REFERENCE_CACHE_ALIAS='default')
+class ReferenceCacheTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tag = Tag.objects.create(name='Завтрак', color='#000000',
+                                     slug='breakfast')
+        cls.ingredient = Ingredient.objects.create(name='Соль',
+                                                   measurement_unit='г')
+
+    def setUp(self):
+        caches['default'].clear()
+
+    def get(self, url, etag=None):
+        headers = {} if etag is None else {'HTTP_IF_NONE_MATCH': etag}
+        return self.client.get(url, **headers)
+
+    def test_etag_and_not_modified(self):
+        response = self.get('/api/tags/')
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertIn('max-age=', response['Cache-Control'])
+        with self.assertNumQueries(0):
+            response = self.get('/api/tags/', etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        with self.assertNumQueries(0):
+            response = self.get('/api/tags/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['slug'], 'breakfast')
+
+    def test_tag_write_changes_etag(self):
+        etag = self.get('/api/tags/')['ETag']
+        detail = self.get(f'/api/tags/{self.tag.pk}/')['ETag']
+        ingredients = self.get('/api/ingredients/')['ETag']
+        self.tag.name = 'Ужин'
+        self.tag.save()
+        response = self.get('/api/tags/', etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()[0]['name'], 'Ужин')
+        self.assertEqual(
+            self.get(f'/api/tags/{self.tag.pk}/', detail).status_code, 200)
+        self.assertEqual(
+            self.get('/api/ingredients/', ingredients).status_code, 304)
+
+    def test_ingredient_write_changes_etag(self):
+        etag = self.get('/api/ingredients/')['ETag']
+        tags = self.get('/api/tags/')['ETag']
+        Ingredient.objects.create(name='Сахар', measurement_unit='г')
+        response = self.get('/api/ingredients/', etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(response.json()), 2)
+        self.ingredient.delete()
+        self.assertEqual(
+            len(self.get('/api/ingredients/', response['ETag']).json()), 1)
+        self.assertEqual(self.get('/api/tags/', tags).status_code, 304)
+
+
+class RecipePaginationTest(TestCase):
+    url = '/api/recipes/?limit=2'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        create_recipes(cls.user, 7)
+        recipes = list(Recipe.objects.order_by('pk'))
+        # Five recipes share a pub_date, so pages split inside the tie.
+        tied = recipes[0].pub_date
+        Recipe.objects.filter(pk__in=[r.pk for r in recipes[:5]]).update(
+            pub_date=tied)
+        for number, recipe in enumerate(recipes[5:], 1):
+            Recipe.objects.filter(pk=recipe.pk).update(
+                pub_date=tied + timedelta(minutes=number))
+        cls.order = [recipe.pk for recipe in Recipe.objects.order_by(
+            '-pub_date', '-pk')]
+
+    def setUp(self):
+        self.client = token_client(self.user)
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_keyset_pages_cover_ties_once(self):
+        pages = [self.get(f'{self.url}&cursor=')]
+        while pages[-1]['next']:
+            pages.append(self.get(pages[-1]['next']))
+        self.assertEqual(
+            [recipe['id'] for page in pages for recipe in page['results']],
+            self.order)
+        self.assertIsNone(pages[0]['previous'])
+        self.assertNotIn('count', pages[0])
+        backwards = [pages[-1]]
+        while backwards[-1]['previous']:
+            backwards.append(self.get(backwards[-1]['previous']))
+        self.assertEqual(
+            [[recipe['id'] for recipe in page['results']]
+             for page in reversed(backwards)],
+            [[recipe['id'] for recipe in page['results']]
+             for page in pages])
+
+    def test_tampered_cursor_is_not_found(self):
+        for cursor in ('garbage', '!!!', urlsafe_b64encode(b'n|x|1'),
+                       urlsafe_b64encode(b'x|2020-01-01T00:00:00|1'),
+                       urlsafe_b64encode(b'n|2020-01-01T00:00:00|a'),
+                       urlsafe_b64encode(b'n|2020-01-01'),
+                       urlsafe_b64encode(b'\xff\xfe')):
+            with self.subTest(cursor=cursor):
+                response = self.client.get(
+                    self.url, {'cursor': cursor})
+                self.assertEqual(response.status_code, 404)
+
+    def test_ordering_keeps_page_numbers(self):
+        data = self.get(f'{self.url}&cursor=&ordering=popular')
+        self.assertEqual(data['count'], 7)
+        self.assertIn('page=2', data['next'])
+        self.assertEqual(len(self.get(data['next'])['results']), 2)
+
+    @override_settings(PAGINATION_COUNT_CACHE_ALIAS='default')
+    def test_cached_count_follows_writes(self):
+        caches['default'].clear()
+        self.assertEqual(self.get(self.url)['count'], 7)
+        self.assertEqual(self.get(f'{self.url}&cursor=')['count'], 7)
+        favorited = f'{self.url}&is_favorited=true'
+        self.assertEqual(self.get(favorited)['count'], 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            Recipe.objects.create(
+                author=self.user, name='Новый', text='Текст',
+                cooking_time=10, image='recipes/image.png')
+        self.assertEqual(self.get(self.url)['count'], 8)
+        self.assertEqual(self.get(f'{self.url}&cursor=')['count'], 8)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(f'/api/recipes/{self.order[0]}/favorite/')
+        self.assertEqual(self.get(favorited)['count'], 1)
+
+
+class IngredientSearchTest(TestCase):
+    url = '/api/ingredients/'
+
+    @classmethod
+    def setUpTestData(cls):
+        # Created one by one, the post_save signal bumps the cached
+        # catalogue version.
+        for name in ('Sugar cane', 'Brown sugar', 'Sugar', 'Icing sugar',
+                     'Salt'):
+            Ingredient.objects.create(name=name, measurement_unit='г')
+
+    def search(self, name):
+        response = self.client.get(self.url, {'name': name})
+        self.assertEqual(response.status_code, 200)
+        return [item['name'] for item in response.json()]
+
+    def test_prefix_matches_come_first(self):
+        self.assertEqual(self.search('sugar'), [
+            'Sugar', 'Sugar cane', 'Brown sugar', 'Icing sugar'])
+
+    @override_settings(INGREDIENT_SEARCH_LIMIT=3)
+    def test_search_is_capped(self):
+        self.assertEqual(self.search('sugar'),
+                         ['Sugar', 'Sugar cane', 'Brown sugar'])
+        self.assertEqual(self.search('s'),
+                         ['Salt', 'Sugar', 'Sugar cane'])
+
+    @override_settings(INGREDIENT_SEARCH_LIMIT=3)
+    def test_catalogue_is_not_capped(self):
+        response = self.client.get(self.url)
+        self.assertEqual(len(response.json()), 5)
+
+
+class CompiledRecipeListParityTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        authors = [create_user(f'author{number}') for number in range(2)]
+        tags = [Tag.objects.create(name=f'Тег {number}',
+                                   color=f'#00000{number}',
+                                   slug=f'tag{number}')
+                for number in range(2)]
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ингредиент {number}', measurement_unit='г')
+            for number in range(3))
+        ingredients = list(Ingredient.objects.order_by('pk'))
+        for author in authors:
+            create_recipes(author, 3)
+        recipes = list(Recipe.objects.order_by('pk'))
+        # Thumbnails are generated in the background, so a page mixes
+        # recipes with and without them.
+        Recipe.objects.filter(
+            pk__in=[recipe.pk for recipe in recipes[::2]]
+        ).update(thumbnails_ready=True)
+        RecipeTag.objects.bulk_create(
+            RecipeTag(recipe=recipe, tag=tag)
+            for recipe in recipes for tag in tags[:recipe.pk % 3])
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                             amount=number + 1)
+            for recipe in recipes
+            for number, ingredient in enumerate(ingredients[recipe.pk % 2:]))
+        Subscribe.objects.create(user=cls.user, author=authors[0])
+        Favorite.objects.create(user=cls.user, recipe=recipes[0])
+        Favorite.objects.create(user=cls.user, recipe=recipes[3])
+        ShoppingCart.objects.create(user=cls.user, recipe=recipes[1])
+        cls.paths = (
+            '/api/recipes/',
+            '/api/recipes/?limit=2&page=2',
+            '/api/recipes/?limit=2&cursor=',
+            f'/api/recipes/?tags=tag0&author={authors[0].pk}',
+            '/api/recipes/?ordering=popular',
+            '/api/recipes/?is_favorited=true',
+            '/api/recipes/?is_in_shopping_cart=true',
+        )
+
+    def fetch(self, client, path, fast):
+        with override_settings(API_FAST_RECIPE_LIST=fast):
+            response = client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return response.content
+
+    def assert_parity(self, client):
+        for path in self.paths:
+            with self.subTest(path=path):
+                self.assertEqual(self.fetch(client, path, True),
+                                 self.fetch(client, path, False))
+
+    def test_anonymous(self):
+        self.assert_parity(APIClient())
+
+    def test_authenticated_with_flags(self):
+        client = token_client(self.user)
+        self.assert_parity(client)
+        recipes = client.get('/api/recipes/').json()['results']
+        for flag in ('is_favorited', 'is_in_shopping_cart'):
+            self.assertEqual({recipe[flag] for recipe in recipes},
+                             {True, False})
+        self.assertEqual(
+            {recipe['author']['is_subscribed'] for recipe in recipes},
+            {True, False})
+        for flag, count in (('is_favorited', 2), ('is_in_shopping_cart', 1)):
+            self.assertEqual(client.get(
+                f'/api/recipes/?{flag}=true').json()['count'], count)
+
+    def test_thumbnails_not_ready(self):
+        self.assert_parity(APIClient())
+        images = [recipe['image'] for recipe in APIClient().get(
+            '/api/recipes/').json()['results']]
+        self.assertIn('http://testserver/media/recipes/image.png', images)
+        self.assertTrue(any(
+            image.endswith(f'.{settings.RECIPE_THUMBNAIL_FORMAT}')
+            for image in images))
+
+
+@override_settings(FEED_FANOUT_LIMIT=2, FEED_BACKFILL=2)
+class FeedFanoutLimitTest(TestCase):
+    url = '/api/recipes/feed/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.followers = [create_user(f'reader{number}')
+                         for number in range(3)]
+        for follower in cls.followers:
+            Subscribe.objects.create(user=follower, author=cls.author)
+        # Published above the limit: bulk_create skips the fan-out like
+        # fans_out() would.
+        create_recipes(cls.author, 3)
+        cls.latest = list(Recipe.objects.order_by(
+            '-pub_date', '-id').values_list('pk', flat=True)[:2])
+
+    def get_feed(self, client):
+        response = client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.json()['results']]
+
+    def test_followers_keep_recipes_after_dropping_below_limit(self):
+        reader, *others = self.followers
+        client = token_client(reader)
+        self.assertEqual(len(self.get_feed(client)), 3)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            Subscribe.objects.get(user=others[0]).delete()
+        self.assertEqual(len(callbacks), 1)
+        for user in (reader, others[1]):
+            self.assertCountEqual(TimelineEntry.objects.filter(
+                user=user).values_list('recipe_id', flat=True), self.latest)
+        self.assertEqual(self.get_feed(client), self.latest)
+        self.assertFalse(TimelineEntry.objects.filter(user=others[0]))
+
+    def test_no_backfill_while_above_or_below_limit(self):
+        Subscribe.objects.create(user=create_user('reader3'),
+                                 author=self.author)
+        with self.captureOnCommitCallbacks() as callbacks:
+            Subscribe.objects.filter(user=self.followers[0]).delete()
+        self.assertFalse(callbacks)
+        with self.captureOnCommitCallbacks() as callbacks:
+            Subscribe.objects.filter(user=self.followers[1]).delete()
+        self.assertEqual(len(callbacks), 1)
+        with self.captureOnCommitCallbacks() as callbacks:
+            Subscribe.objects.filter(user=self.followers[2]).delete()
+        self.assertFalse(callbacks)
+
+
+class ExplainQueriesTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        authors = [create_user(f'author{number}') for number in range(3)]
+        tags = [Tag.objects.create(name=f'Тег {number}',
+                                   color=f'#00000{number}',
+                                   slug=f'tag{number}')
+                for number in range(3)]
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ингредиент {number}', measurement_unit='г')
+            for number in range(5))
+        ingredients = list(Ingredient.objects.all())
+        for author in authors:
+            create_recipes(author, 10)
+        recipes = list(Recipe.objects.order_by('pk'))
+        RecipeTag.objects.bulk_create(
+            RecipeTag(recipe=recipe, tag=tags[recipe.pk % 3])
+            for recipe in recipes)
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient=ingredient, amount=5)
+            for recipe in recipes for ingredient in ingredients[:3])
+        for author in authors[:2]:
+            Subscribe.objects.create(user=cls.user, author=author)
+        for recipe in recipes[::4]:
+            Favorite.objects.create(user=cls.user, recipe=recipe)
+            ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+
+    def test_hot_queries_use_indexes(self):
+        output = os.path.join(tempfile.mkdtemp(), 'plans.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(output))
+        call_command('explain_queries', output=output, stdout=io.StringIO())
+        with open(output, encoding='utf-8') as f:
+            queries = json.load(f)['queries']
+        self.assertEqual(
+            {query['name'].split('#')[0] for query in queries},
+            {'recipes-list', 'recipes-list-cursor', 'recipes-author',
+             'recipes-popular', 'recipes-tags', 'recipes-favorited',
+             'recipes-shopping-cart', 'recipe-detail', 'subscriptions',
+             'feed', 'feed-cursor', 'shopping-list'})
+        self.assertEqual(
+            [query['name'] for query in queries if query['full_scans']], [])
+
+
+@override_settings(AUTH_SIGNED_TOKENS=1, AUTH_TOKEN_CACHE_ALIAS='default')
+class SignedTokenRevocationTest(TestCase):
+
+    def setUp(self):
+        self.user = create_user('reader')
+        self.user.set_password('password')
+        self.user.save()
+
+    def login(self):
+        response = APIClient().post('/api/auth/token/login/', {
+            'email': self.user.email, 'password': 'password'})
+        return response.json()['auth_token']
+
+    def get_me(self, token):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+        return client.get('/api/users/me/').status_code
+
+    def test_login_right_after_logout_is_valid(self):
+        # Pins the signer clock, so the logout and both logins fall
+        # within the same second.
+        with mock.patch('time.time', return_value=time.time()):
+            old = self.login()
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION=f'Token {old}')
+            self.assertEqual(
+                client.post('/api/auth/token/logout/').status_code, 204)
+            new = self.login()
+            self.assertEqual(self.get_me(old), 401)
+            self.assertEqual(self.get_me(new), 200)
+
+    @override_settings(CACHES={
+        'default': {'BACKEND': LOCMEM, 'LOCATION': 'first'},
+        'other': {'BACKEND': LOCMEM, 'LOCATION': 'second'},
+    })
+    def test_logout_reaches_caches_that_never_saw_it(self):
+        old = self.login()
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {old}')
+        client.post('/api/auth/token/logout/')
+        new = self.login()
+        for alias in ('other', None):
+            with self.subTest(alias=alias):
+                with override_settings(AUTH_TOKEN_CACHE_ALIAS=alias):
+                    self.assertEqual(self.get_me(old), 401)
+                    self.assertEqual(self.get_me(new), 200)
+
+    def test_cached_user_has_no_password_hash(self):
+        self.assertEqual(self.get_me(self.login()), 200)
+        user, fingerprint = caches['default'].get(
+            USER_KEY.format(self.user.pk))
+        self.assertNotIn('password', user.__dict__)
+        self.assertEqual(fingerprint, password_hash(self.user))
+        with self.assertNumQueries(1):
+            self.assertEqual(user.password, self.user.password)
+
+    def test_user_is_read_from_primary(self):
+        # No replica is configured, a replica read would fail.
+        reads = replica_reads.set(True)
+        try:
+            self.assertEqual(get_user(self.user.pk), self.user)
+        finally:
+            replica_reads.reset(reads)
+
+    def test_per_process_cache_is_reported(self):
+        self.assertEqual(
+            [warning.id for warning in check_token_cache(None)],
+            ['users.W001'])
+        with override_settings(AUTH_TOKEN_CACHE_ALIAS=None):
+            self.assertEqual(check_token_cache(None), [])
+
+
+@override_settings(INSTRUMENTATION_SERVER_TIMING=1)
+class InstrumentationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        create_recipes(cls.user, 3)
+
+    def timings(self, response):
+        return {name: float(duration) for name, duration in re.findall(
+            r'(\w+);(?:desc="[^"]*";)?dur=([\d.]+)',
+            response['Server-Timing'])}
+
+    def test_server_timing_reports_serialization(self):
+        client = token_client(self.user)
+        for url in ('/api/recipes/', f'/api/users/{self.user.pk}/'):
+            with self.subTest(url=url):
+                response = client.get(url)
+                timings = self.timings(response)
+                self.assertEqual(
+                    set(timings), {'sql', 'serialize', 'render', 'total'})
+                self.assertGreater(timings['serialize'], 0)
+                self.assertIn('queries"', response['Server-Timing'])
+
+    def test_metrics_expose_serialization(self):
+        token_client(self.user).get('/api/recipes/')
+        self.assertIn(
+            'foodgram_serialize_seconds_total{view="recipes-list",'
+            'method="GET"}', metrics.render())
+
+    def test_sql_is_counted_for_sync_views_under_asgi(self):
+        token = Token.objects.create(user=self.user)
+        response = async_to_sync(AsyncClient().get)(
+            '/api/users/me/', authorization=f'Token {token.key}')
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(response['Server-Timing'], r'sql;desc="[1-9]\d* ')
+
+    @override_settings(INSTRUMENTATION_PROFILE_THRESHOLD=0,
+                       INSTRUMENTATION_PROFILE_SAMPLE_RATE=1)
+    def test_async_views_are_profiled(self):
+        view = async_view(TagViewSet.as_view({'get': 'list'}))
+        middleware = InstrumentationMiddleware(view)
+        profiles = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, profiles, ignore_errors=True)
+        with override_settings(INSTRUMENTATION_PROFILE_DIR=profiles):
+            response = async_to_sync(middleware.async_call)(
+                RequestFactory().get('/api/tags/'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(os.listdir(profiles)), 1)
+
+
+@override_settings(DB_CONN_HEALTH_CHECKS=1)
+class DatabaseMiddlewareAsgiTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        create_recipes(cls.user, 1)
+        cls.recipe = Recipe.objects.get()
+        cls.token = Token.objects.create(user=cls.user)
+
+    def setUp(self):
+        self.reads = []
+        # Only use_replica looks at the settings; the recorded router
+        # keeps every query on the default connection.
+        for patcher in (
+                mock.patch.dict(settings.DATABASES,
+                                replica=settings.DATABASES['default']),
+                mock.patch.object(ReplicaRouter, 'db_for_read',
+                                  autospec=True, side_effect=self.read),
+                mock.patch.object(middleware, 'check_connections',
+                                  wraps=middleware.check_connections)):
+            self.addCleanup(patcher.stop)
+            patcher.start()
+
+    def read(self, router, model, **hints):
+        self.reads.append(replica_reads.get())
+
+    def get(self, url):
+        self.reads.clear()
+        middleware.check_connections.reset_mock()
+        response = async_to_sync(AsyncClient().get)(
+            url, authorization=f'Token {self.token.key}')
+        self.assertLess(response.status_code, 500)
+        self.assertFalse(replica_reads.get())
+        middleware.check_connections.assert_called_once_with()
+        return response
+
+    def test_sync_views_read_from_replica(self):
+        for url in ('/api/recipes/feed/', '/api/users/',
+                    f'/api/users/{self.user.pk}/',
+                    '/api/recipes/download_shopping_cart/'):
+            with self.subTest(url=url):
+                self.get(url)
+                self.assertIn(True, self.reads)
+
+    def test_toggles_read_from_primary(self):
+        self.get(f'/api/recipes/{self.recipe.pk}/favorite/')
+        self.assertTrue(self.reads)
+        self.assertNotIn(True, self.reads)
+
+
+class ShoppingListDriftTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.reader = create_user('reader')
+        cls.salt, cls.sugar, cls.flour = (
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('Соль', 'Сахар', 'Мука'))
+        cls.tag = Tag.objects.create(name='Завтрак', color='#000000',
+                                     slug='breakfast')
+        create_recipes(cls.author, 2)
+        cls.recipe, cls.other = Recipe.objects.order_by('pk')
+        RecipeIngredient.objects.bulk_create([
+            RecipeIngredient(recipe=cls.recipe, ingredient=cls.salt,
+                             amount=5),
+            RecipeIngredient(recipe=cls.recipe, ingredient=cls.sugar,
+                             amount=10),
+            RecipeIngredient(recipe=cls.other, ingredient=cls.sugar,
+                             amount=20),
+        ])
+
+    def setUp(self):
+        self.author_client = token_client(self.author)
+        self.client = token_client(self.reader)
+
+    def items(self, user):
+        return dict(ShoppingListItem.objects.filter(user=user).values_list(
+            'ingredient__name', 'amount'))
+
+    def assert_no_drift(self):
+        self.assertEqual(find_drifted(), set())
+
+    def test_cart_add_and_remove(self):
+        self.client.get(f'/api/recipes/{self.recipe.pk}/shopping_cart/')
+        self.client.post('/api/recipes/shopping_cart/',
+                         {'recipes': [self.recipe.pk, self.other.pk]},
+                         format='json')
+        self.assert_no_drift()
+        self.assertEqual(self.items(self.reader), {'Соль': 5, 'Сахар': 30})
+        self.client.delete(f'/api/recipes/{self.recipe.pk}/shopping_cart/')
+        self.assert_no_drift()
+        self.assertEqual(self.items(self.reader), {'Сахар': 20})
+        self.client.delete('/api/recipes/shopping_cart/',
+                           {'recipes': [self.recipe.pk, self.other.pk]},
+                           format='json')
+        self.assert_no_drift()
+        self.assertEqual(self.items(self.reader), {})
+
+    def test_ingredient_edit_while_carted(self):
+        for client in (self.client, self.author_client):
+            client.get(f'/api/recipes/{self.recipe.pk}/shopping_cart/')
+        self.client.get(f'/api/recipes/{self.other.pk}/shopping_cart/')
+        response = self.author_client.patch(
+            f'/api/recipes/{self.recipe.pk}/', {
+                'tags': [self.tag.pk],
+                'ingredients': [{'id': self.sugar.pk, 'amount': 15},
+                                {'id': self.flour.pk, 'amount': 100}],
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assert_no_drift()
+        self.assertEqual(self.items(self.reader),
+                         {'Сахар': 35, 'Мука': 100})
+        self.assertEqual(self.items(self.author),
+                         {'Сахар': 15, 'Мука': 100})
+
+    def test_recipe_delete(self):
+        for client in (self.client, self.author_client):
+            client.get(f'/api/recipes/{self.recipe.pk}/shopping_cart/')
+        self.client.get(f'/api/recipes/{self.other.pk}/shopping_cart/')
+        response = self.author_client.delete(
+            f'/api/recipes/{self.recipe.pk}/')
+        self.assertEqual(response.status_code, 204)
+        self.assert_no_drift()
+        self.assertEqual(self.items(self.reader), {'Сахар': 20})
+        self.assertEqual(self.items(self.author), {})
+
+
+@override_settings(MEMBERSHIP_CACHE_ALIAS='default')
+class ToggleConsistencyTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.reader = create_user('reader')
+        cls.salt = Ingredient.objects.create(name='Соль',
+                                             measurement_unit='г')
+        create_recipes(cls.author, 3)
+        cls.recipes = [recipe.pk for recipe in Recipe.objects.order_by('pk')]
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe_id=pk, ingredient=cls.salt, amount=5)
+            for pk in cls.recipes)
+
+    def setUp(self):
+        caches['default'].clear()
+        self.client = token_client(self.reader)
+
+    def assert_consistent(self):
+        for recipe in Recipe.objects.all():
+            self.assertEqual(recipe.favorites_count,
+                             Favorite.objects.filter(recipe=recipe).count())
+            self.assertEqual(recipe.cart_count, ShoppingCart.objects.filter(
+                recipe=recipe).count())
+        cached = Membership.for_user(self.reader)
+        stored = Membership.from_db(self.reader.pk)
+        self.assertEqual(cached.favorites, stored.favorites)
+        self.assertEqual(cached.shopping_cart, stored.shopping_cart)
+        self.assertEqual(find_drifted(), set())
+
+    def toggle(self, method, path, recipes):
+        if len(recipes) == 1:
+            getattr(self.client, method)(f'/api/recipes/{recipes[0]}/{path}/')
+        else:
+            getattr(self.client, 'post' if method == 'get' else method)(
+                f'/api/recipes/{path}/', {'recipes': recipes},
+                format='json')
+
+    def test_repeated_add_and_remove(self):
+        first, second, third = self.recipes
+        steps = (('get', [first, second]), ('get', [first]),
+                 ('delete', [second]), ('delete', [second]),
+                 ('get', [first, second, third]),
+                 ('delete', [first, second]), ('delete', [first, third]),
+                 ('get', [third]), ('delete', [third]))
+        # SQLite answers without RETURNING, through the row count for one
+        # recipe and a diff of the rows for several; PostgreSQL returns
+        # the rows. SQLite 3.35+ understands RETURNING too.
+        for returning in (False, True):
+            with mock.patch.object(
+                    connection.features, 'can_return_rows_from_bulk_insert',
+                    returning):
+                for path in ('favorite', 'shopping_cart'):
+                    for method, recipes in steps:
+                        with self.subTest(returning=returning, path=path,
+                                          method=method, recipes=recipes):
+                            Membership.for_user(self.reader)
+                            self.toggle(method, path, recipes)
+                            self.assert_consistent()
+
+    def test_pre_delete_sees_the_rows(self):
+        seen = []
+
+        def record(sender, instance, **kwargs):
+            seen.append((instance.recipe_id, sender.objects.filter(
+                user_id=instance.user_id,
+                recipe_id=instance.recipe_id).exists()))
+
+        for model in (Favorite, ShoppingCart):
+            pre_delete.connect(record, sender=model)
+            self.addCleanup(pre_delete.disconnect, record, sender=model)
+        first, second, third = self.recipes
+        self.client.post('/api/recipes/favorite/',
+                         {'recipes': [first, second]}, format='json')
+        self.client.get(f'/api/recipes/{third}/shopping_cart/')
+        self.client.delete('/api/recipes/favorite/',
+                           {'recipes': self.recipes}, format='json')
+        self.client.delete(f'/api/recipes/{third}/shopping_cart/')
+        self.assertEqual(seen, [(first, True), (second, True),
+                                (third, True)])
+
+
+@override_settings(RECIPE_CACHE_ALIAS='default')
+class RecipeFragmentTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.reader = create_user('reader')
+        cls.tag = Tag.objects.create(name='Завтрак', color='#000000',
+                                     slug='breakfast')
+        cls.salt = Ingredient.objects.create(name='Соль',
+                                             measurement_unit='г')
+        create_recipes(cls.author, 1)
+        cls.recipe = Recipe.objects.get()
+        RecipeTag.objects.create(recipe=cls.recipe, tag=cls.tag)
+        RecipeIngredient.objects.create(recipe=cls.recipe,
+                                        ingredient=cls.salt, amount=5)
+        cls.url = f'/api/recipes/{cls.recipe.pk}/'
+
+    def setUp(self):
+        caches['default'].clear()
+
+    def get(self, client=None):
+        response = (client or self.client).get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def edit(self, instance, **fields):
+        with self.captureOnCommitCallbacks(execute=True):
+            for field, value in fields.items():
+                setattr(instance, field, value)
+            instance.save()
+
+    def test_fragment_is_cached(self):
+        data = self.get()
+        self.assertTrue(data['image'].startswith('http://testserver/'))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get(), data)
+
+    def test_edits_invalidate_fragment(self):
+        edits = (
+            (self.recipe, {'name': 'Новое название'},
+             lambda data: data['name']),
+            (self.author, {'first_name': 'Автор'},
+             lambda data: data['author']['first_name']),
+            (self.tag, {'name': 'Ужин'},
+             lambda data: data['tags'][0]['name']),
+            (self.salt, {'name': 'Морская соль'},
+             lambda data: data['ingredients'][0]['name']),
+        )
+        for instance, fields, read in edits:
+            with self.subTest(model=type(instance).__name__):
+                self.get()
+                self.edit(instance, **fields)
+                self.assertEqual(read(self.get()), *fields.values())
+
+    def test_api_edit_invalidates_fragment(self):
+        self.get()
+        client = token_client(self.author)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.patch(self.url, {
+                'tags': [self.tag.pk],
+                'ingredients': [{'id': self.salt.pk, 'amount': 7}],
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get()['ingredients'][0]['amount'], 7)
+
+    def test_user_flags(self):
+        self.assertEqual(self.get()['is_favorited'], False)
+        Favorite.objects.create(user=self.reader, recipe=self.recipe)
+        ShoppingCart.objects.create(user=self.reader, recipe=self.recipe)
+        Subscribe.objects.create(user=self.reader, author=self.author)
+        reader = token_client(self.reader)
+        author = token_client(self.author)
+        for alias in (None, 'default'):
+            with override_settings(MEMBERSHIP_CACHE_ALIAS=alias):
+                for client, flag in ((self.client, False), (reader, True),
+                                     (author, False)):
+                    with self.subTest(alias=alias, flag=flag):
+                        data = self.get(client)
+                        self.assertEqual(
+                            (data['is_favorited'],
+                             data['is_in_shopping_cart'],
+                             data['author']['is_subscribed']),
+                            (flag, flag, flag))
+
+
+class RecipeBulkTest(TestCase):
+    url = '/api/recipes/bulk/'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media = tempfile.mkdtemp()
+        cls.settings = override_settings(MEDIA_ROOT=cls.media)
+        cls.settings.enable()
+        os.makedirs(os.path.join(cls.media, 'recipes'))
+        with open(os.path.join(cls.media, 'recipes', 'image.png'),
+                  'wb') as f:
+            f.write(b'png')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.settings.disable()
+        shutil.rmtree(cls.media, ignore_errors=True)
+        super().tearDownClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_user('admin')
+        cls.admin.is_staff = True
+        cls.admin.save()
+        cls.author = create_user('author')
+        cls.tag = Tag.objects.create(name='Завтрак', color='#000000',
+                                     slug='breakfast')
+        cls.salt = Ingredient.objects.create(name='Соль',
+                                             measurement_unit='г')
+
+    def setUp(self):
+        self.client = token_client(self.admin)
+
+    def line(self, name, **fields):
+        return {'name': name, 'text': 'Текст', 'cooking_time': 10,
+                'image': 'recipes/image.png', 'tags': ['breakfast'],
+                'ingredients': [{'name': 'Соль', 'measurement_unit': 'г',
+                                 'amount': 5}], **fields}
+
+    def post(self, *lines):
+        body = b''.join(
+            line + b'\n' if isinstance(line, bytes)
+            else json.dumps(line).encode() + b'\n' for line in lines)
+        return self.client.generic('POST', self.url, body,
+                                   content_type='application/x-ndjson')
+
+    def export(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return [json.loads(line) for line in b''.join(
+            response.streaming_content).splitlines()]
+
+    def test_export_round_trip(self):
+        response = self.post(self.line('Суп', author='author'),
+                             self.line('Каша'))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json(), {'created': 2, 'errors': []})
+        lines = self.export()
+        self.assertEqual(
+            [(line['name'], line['author'], line['tags'],
+              line['ingredients']) for line in lines],
+            [(name, author, ['breakfast'],
+              [{'name': 'Соль', 'measurement_unit': 'г', 'amount': 5}])
+             for name, author in (('Суп', 'author'), ('Каша', 'admin'))])
+        Recipe.objects.all().delete()
+        response = self.post(*lines)
+        self.assertEqual(response.json(), {'created': 2, 'errors': []})
+        self.assertEqual(
+            dict(Recipe.objects.values_list('name', 'author__username')),
+            {'Суп': 'author', 'Каша': 'admin'})
+        self.assertEqual(
+            User.objects.get(pk=self.author.pk).recipes_count, 1)
+
+    def test_invalid_lines_are_reported(self):
+        response = self.post(self.line('Суп'), b'not json',
+                             self.line('Каша', author='missing'),
+                             self.line('Суп'),
+                             self.line('Блины', tags=['lunch']))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['created'], 1)
+        self.assertEqual(
+            [(error['line'], sorted(error['errors']))
+             for error in response.json()['errors']],
+            [(2, ['non_field_errors']), (3, ['author']), (4, ['name']),
+             (5, ['tags'])])
+        response = self.post(self.line('Суп'))
+        self.assertEqual(response.status_code, 400)
+
+    def test_name_taken_during_import(self):
+        tag_ids = get_tag_ids()
+
+        def take_name():
+            # A concurrent writer saves a recipe after the names of the
+            # chunk were checked.
+            if not Recipe.objects.filter(name='Каша').exists():
+                create_recipes(self.author, 1)
+                Recipe.objects.filter(author=self.author).update(
+                    name='Каша')
+            return tag_ids
+
+        with mock.patch('api.bulk.get_tag_ids', side_effect=take_name):
+            response = self.post(self.line('Суп'), self.line('Каша'))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['created'], 1)
+        self.assertEqual(
+            [(error['line'], list(error['errors']))
+             for error in response.json()['errors']], [(2, ['name'])])
+        self.assertTrue(Recipe.objects.filter(name='Суп').exists())
+
+    def test_admins_only(self):
+        client = token_client(self.author)
+        self.assertEqual(client.get(self.url).status_code, 403)
+        response = self.client.post(self.url, {}, format='json')
+        self.assertEqual(response.status_code, 415)
+
+
+class CounterTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.reader = create_user('reader')
+        create_recipes(cls.author, 2)
+        # bulk_create skips the signals that count the author's recipes.
+        call_command('reconcile_counters', stdout=io.StringIO())
+        cls.recipe, cls.other = Recipe.objects.order_by('pk')
+
+    def setUp(self):
+        self.client = token_client(self.reader)
+
+    def counts(self):
+        recipe = Recipe.objects.get(pk=self.recipe.pk)
+        author = User.objects.get(pk=self.author.pk)
+        return (recipe.favorites_count, recipe.cart_count,
+                author.followers_count)
+
+    def test_toggles_never_go_below_zero(self):
+        for _ in range(2):
+            self.client.get(f'/api/recipes/{self.recipe.pk}/favorite/')
+            self.client.get(f'/api/recipes/{self.recipe.pk}/shopping_cart/')
+            self.client.get(f'/api/users/{self.author.pk}/subscribe/')
+        self.assertEqual(self.counts(), (1, 1, 1))
+        for _ in range(2):
+            self.client.delete(f'/api/recipes/{self.recipe.pk}/favorite/')
+            self.client.delete(
+                f'/api/recipes/{self.recipe.pk}/shopping_cart/')
+            self.client.delete(f'/api/users/{self.author.pk}/subscribe/')
+        self.assertEqual(self.counts(), (0, 0, 0))
+
+    def test_decrement_of_a_drifted_counter_stops_at_zero(self):
+        Favorite.objects.create(user=self.reader, recipe=self.recipe)
+        ShoppingCart.objects.create(user=self.reader, recipe=self.recipe)
+        Subscribe.objects.create(user=self.reader, author=self.author)
+        Recipe.objects.update(favorites_count=0, cart_count=0)
+        User.objects.update(followers_count=0)
+        self.client.delete(f'/api/recipes/{self.recipe.pk}/favorite/')
+        self.client.delete(f'/api/recipes/{self.recipe.pk}/shopping_cart/')
+        self.client.delete(f'/api/users/{self.author.pk}/subscribe/')
+        self.assertEqual(self.counts(), (0, 0, 0))
+
+    def test_deletes_decrement_counters(self):
+        self.client.post('/api/recipes/favorite/',
+                         {'recipes': [self.recipe.pk, self.other.pk]},
+                         format='json')
+        Subscribe.objects.create(user=self.reader, author=self.author)
+        self.assertEqual(
+            User.objects.get(pk=self.author.pk).recipes_count, 2)
+        self.other.delete()
+        self.assertEqual(
+            User.objects.get(pk=self.author.pk).recipes_count, 1)
+        self.reader.delete()
+        self.assertEqual(self.counts(), (0, 0, 0))
+
+    def test_reconcile_repairs_drifted_counters(self):
+        Favorite.objects.create(user=self.reader, recipe=self.recipe)
+        Recipe.objects.filter(pk=self.recipe.pk).update(favorites_count=5)
+        Recipe.objects.filter(pk=self.other.pk).update(cart_count=3)
+        User.objects.filter(pk=self.author.pk).update(recipes_count=0)
+        out = io.StringIO()
+        call_command('reconcile_counters', stdout=out)
+        self.assertIn('recipes.Recipe.favorites_count: fixed 1 rows',
+                      out.getvalue())
+        self.assertIn('recipes.Recipe.cart_count: fixed 1 rows',
+                      out.getvalue())
+        self.assertIn('users.User.recipes_count: fixed 1 rows',
+                      out.getvalue())
+        self.assertEqual(self.counts(), (1, 0, 0))
+        self.assertEqual(Recipe.objects.get(pk=self.other.pk).cart_count, 0)
+        self.assertEqual(
+            User.objects.get(pk=self.author.pk).recipes_count, 2)
+        out = io.StringIO()
+        call_command('reconcile_counters', stdout=out)
+        self.assertNotIn('fixed 1', out.getvalue())
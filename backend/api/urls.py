@@ -1,6 +1,10 @@
+from django.conf import settings
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
+from users.models import Favorite, ShoppingCart
+
+from .async_views import async_view
 from .views import (CartFavoriteViewSet, CustomUserViewSet, IngredientViewSet,
                     RecipeViewSet, SubscribeViewSet, TagViewSet)
 
@@ -10,16 +14,48 @@ router.register('ingredients', IngredientViewSet)
 router.register('tags', TagViewSet)
 router.register('users', CustomUserViewSet, basename='users')
 
+TOGGLE = {'get': 'add', 'delete': 'remove'}
+BATCH = {'post': 'add_many', 'delete': 'remove_many'}
+
 urlpatterns = [
+    # Ahead of the router, whose detail route would match these as a pk.
+    path('recipes/favorite/',
+         CartFavoriteViewSet.as_view(BATCH, model=Favorite),
+         name='favorites-batch'),
+    path('recipes/shopping_cart/',
+         CartFavoriteViewSet.as_view(BATCH, model=ShoppingCart),
+         name='shopping_cart-batch'),
     path('', include(router.urls)),
     path('auth/', include('djoser.urls.authtoken')),
-    path('recipes/<int:pk>/favorite/', CartFavoriteViewSet.as_view(
-        {'get': 'partial_update', 'delete': 'partial_update'}),
-        name='favorites'),
-    path('recipes/<int:pk>/shopping_cart/', CartFavoriteViewSet.as_view(
-        {'get': 'partial_update', 'delete': 'partial_update'}),
-        name='shopping_cart'),
+    path('recipes/<int:pk>/favorite/',
+         CartFavoriteViewSet.as_view(TOGGLE, model=Favorite),
+         name='favorites'),
+    path('recipes/<int:pk>/shopping_cart/',
+         CartFavoriteViewSet.as_view(TOGGLE, model=ShoppingCart),
+         name='shopping_cart'),
     path('users/<int:pk>/subscribe/',
          SubscribeViewSet.as_view({'get': 'create',
                                    'delete': 'destroy'})),
 ]
+
+if settings.API_ASYNC_VIEWS:
+    LIST = {'get': 'list', 'post': 'create'}
+    DETAIL = {'get': 'retrieve', 'put': 'update',
+              'patch': 'partial_update', 'delete': 'destroy'}
+    urlpatterns = [
+        path('recipes/', async_view(RecipeViewSet.as_view(LIST)),
+             name='recipes-list'),
+        path('recipes/<int:pk>/', async_view(RecipeViewSet.as_view(DETAIL)),
+             name='recipes-detail'),
+        path('ingredients/',
+             async_view(IngredientViewSet.as_view({'get': 'list'})),
+             name='ingredient-list'),
+        path('ingredients/<int:pk>/',
+             async_view(IngredientViewSet.as_view({'get': 'retrieve'})),
+             name='ingredient-detail'),
+        path('tags/', async_view(TagViewSet.as_view({'get': 'list'})),
+             name='tag-list'),
+        path('tags/<int:pk>/',
+             async_view(TagViewSet.as_view({'get': 'retrieve'})),
+             name='tag-detail'),
+    ] + urlpatterns
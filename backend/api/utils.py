@@ -0,0 +1,38 @@
+from django.db.models import OuterRef, Prefetch, Subquery
+
+from recipes.models import Recipe
+from users.membership import Membership
+
+RECIPES_LIMIT_PARAM = 'recipes_limit'
+
+
+def get_recipes_limit(request):
+    if request is None:
+        return None
+    try:
+        limit = int(request.query_params.get(RECIPES_LIMIT_PARAM))
+    except (TypeError, ValueError):
+        return None
+    return limit if limit > 0 else None
+
+
+def recipes_preview_prefetch(limit=None):
+    queryset = Recipe.objects.only(
+        'id', 'name', 'image', 'thumbnails_ready', 'cooking_time', 'author'
+    ).order_by('-pub_date', '-id')
+    if limit is not None:
+        newest = Recipe.objects.filter(
+            author=OuterRef('author')
+        ).order_by('-pub_date', '-id').values('pk')[:limit]
+        queryset = queryset.filter(pk__in=Subquery(newest))
+    return Prefetch('recipes', queryset=queryset)
+
+
+def get_membership(request):
+    if request is None:
+        return Membership()
+    membership = getattr(request, '_membership', None)
+    if membership is None:
+        membership = Membership.for_user(request.user)
+        request._membership = membership
+    return membership
@@ -1,46 +1,52 @@
+from functools import partial
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db.models import Exists, OuterRef, Sum
 from django.db.models.query import Prefetch
-from django.http import HttpResponse
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
 from rest_framework import status
 from rest_framework.decorators import action
-from rest_framework.mixins import (CreateModelMixin, DestroyModelMixin,
-                                   UpdateModelMixin)
-from rest_framework.permissions import (IsAuthenticated,
+from rest_framework.exceptions import UnsupportedMediaType, ValidationError
+from rest_framework.mixins import CreateModelMixin, DestroyModelMixin
+from rest_framework.permissions import (IsAdminUser, IsAuthenticated,
                                         IsAuthenticatedOrReadOnly)
+from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.viewsets import (GenericViewSet, ModelViewSet,
                                      ReadOnlyModelViewSet)
 
+from recipes.cache import get_cache
 from recipes.models import Ingredient, Recipe, RecipeIngredient, Tag
-from users.models import Subscribe
+from users.models import ShoppingListItem, Subscribe
+from users.toggles import add_links, remove_links
 
+from .bulk import NDJSON, export_recipes, import_recipes
+from .compiled import RECIPE_VALUES, serialize_recipes
+from .feed import get_feed
 from .filters import IngredientFilter, RecipeFilter
+from .fragments import get_recipe_detail
+from .middleware import serialization
+from .mixins import ReferenceCacheMixin, SerializationTimingMixin
+from .pagination import RecipePagination
 from .permissions import IsAuthorOrReadOnly
-from .serializers import (CartFavoriteSerializer, CustomUserSerializer,
-                          IngredientSerializer, RecipeCreateUpdateSerializer,
-                          RecipeGetSerializer, SubscribeSerializer,
+from .renderers import SHOPPING_CART_RENDERERS, FastJSONRenderer
+from .serializers import (CartFavoriteBatchSerializer, CartFavoriteSerializer,
+                          CustomUserSerializer, IngredientSerializer,
+                          RecipeCreateUpdateSerializer, RecipeGetSerializer,
+                          RecipeListSerializer, SubscribeSerializer,
                           SubscriptionsSerializer, TagSerializer)
+from .utils import get_recipes_limit, recipes_preview_prefetch
 
 User = get_user_model()
 
 
-class CustomUserViewSet(UserViewSet):
+class CustomUserViewSet(SerializationTimingMixin, UserViewSet):
     serializer_class = CustomUserSerializer
 
-    def get_queryset(self):
-        user = self.request.user
-        queryset = User.objects.all()
-        if user.is_anonymous:
-            return queryset
-        return queryset.annotate(
-            is_subscribed=Exists(
-                user.subscriber.filter(author=OuterRef('pk')))
-        )
-
     @action(['get', 'put', 'patch', 'delete'], detail=False,
             permission_classes=[IsAuthenticated])
     def me(self, request, *args, **kwargs):
@@ -52,83 +58,144 @@ class CustomUserViewSet(UserViewSet):
         queryset = self.filter_queryset(self.get_queryset())
         queryset = queryset.filter(
             subscription__user=self.request.user
+        ).prefetch_related(
+            recipes_preview_prefetch(get_recipes_limit(request))
         )
+        context = self.get_serializer_context()
         page = self.paginate_queryset(queryset)
+        with serialization(request):
+            data = SubscriptionsSerializer(
+                queryset if page is None else page, many=True,
+                context=context).data
         if page is not None:
-            serializer = SubscriptionsSerializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-        serializer = SubscriptionsSerializer(queryset, many=True)
-        return Response(serializer.data)
+            return self.get_paginated_response(data)
+        return Response(data)
 
 
-class RecipeViewSet(ModelViewSet):
+class RecipeViewSet(SerializationTimingMixin, ModelViewSet):
     permission_classes = (IsAuthenticatedOrReadOnly, IsAuthorOrReadOnly,)
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
+    pagination_class = RecipePagination
+    renderer_classes = (FastJSONRenderer, BrowsableAPIRenderer)
 
     def get_queryset(self):
-        queryset = (Recipe.objects.all().prefetch_related('tags').
-                    prefetch_related(
-                        Prefetch('recipe_ingredients',
-                                 queryset=RecipeIngredient.objects.
-                                 select_related('ingredient'))))
-        user = self.request.user
-        if user.is_anonymous:
-            return queryset.prefetch_related('author')
-
-        subqueryset = User.objects.annotate(is_subscribed=Exists(
-            Subscribe.objects.filter(user=user,
-                                     author=OuterRef('pk')))).all()
-        queryset = queryset.prefetch_related(
-            Prefetch('author', queryset=subqueryset)
+        return Recipe.objects.select_related('author').prefetch_related(
+            'tags',
+            Prefetch('recipe_ingredients',
+                     queryset=RecipeIngredient.objects.select_related(
+                         'ingredient'))
         )
-        return queryset.annotate(
-            is_in_shopping_cart=Exists(
-                Recipe.objects.filter(
-                    cart_users=user, pk=OuterRef('pk'))),
-            is_favorited=Exists(
-                Recipe.objects.filter(
-                    pk=OuterRef('pk'),
-                    favorited_by=user)))
 
     def get_serializer_class(self):
-        if self.action in ('list', 'retrieve'):
+        if self.action == 'list':
+            return RecipeListSerializer
+        if self.action == 'retrieve':
             return RecipeGetSerializer
         return RecipeCreateUpdateSerializer
 
+    def list(self, request, *args, **kwargs):
+        if not settings.API_FAST_RECIPE_LIST:
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(Recipe.objects.values(*RECIPE_VALUES))
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            return Response(serialize_recipes(list(queryset), request))
+        return self.get_paginated_response(serialize_recipes(page, request))
+
+    def retrieve(self, request, *args, **kwargs):
+        pk = str(kwargs[self.lookup_field])
+        if get_cache('RECIPE_CACHE_ALIAS') is None or not pk.isdigit():
+            return super().retrieve(request, *args, **kwargs)
+        # Reading a recipe needs no object permission, so a cached
+        # fragment is served without loading the instance.
+        return Response(get_recipe_detail(self, request, int(pk)))
+
     @action(permission_classes=[IsAuthenticated], detail=False)
+    def feed(self, request):
+        page = self.paginator.paginate_keyset(
+            request, partial(get_feed, request.user))
+        return self.get_paginated_response(serialize_recipes(page, request))
+
+    @action(methods=['get', 'post'], detail=False,
+            permission_classes=[IsAdminUser])
+    def bulk(self, request):
+        if request.method == 'GET':
+            response = StreamingHttpResponse(export_recipes(),
+                                             content_type=NDJSON)
+            response['Content-Disposition'] = (
+                'attachment; filename="recipes.ndjson"')
+            return response
+        if request.content_type.split(';')[0].strip() != NDJSON:
+            raise UnsupportedMediaType(request.content_type)
+        created, errors = import_recipes(request.stream, request.user)
+        code = status.HTTP_201_CREATED
+        if errors and not created:
+            code = status.HTTP_400_BAD_REQUEST
+        return Response({'created': created, 'errors': errors}, status=code)
+
+    def handle_exception(self, exc):
+        if self.action == 'download_shopping_cart':
+            self.request.accepted_renderer = JSONRenderer()
+            self.request.accepted_media_type = JSONRenderer.media_type
+        return super().handle_exception(exc)
+
+    @action(permission_classes=[IsAuthenticated], detail=False,
+            renderer_classes=SHOPPING_CART_RENDERERS)
     def download_shopping_cart(self, request):
-        user = request.user
-        qs = RecipeIngredient.objects.filter(recipe__cart_users=user)
-        RecipeIngredient.objects.select_related(
-            'recipe', 'ingredient').filter(recipe__cart_users=user)
-        data = qs.values_list('ingredient__name',
-                              'ingredient__measurement_unit'
-                              ).annotate(total=Sum('amount'))
-        ingredients = [f'{name} - {amount}{str(unit)} \n'
-                       for name, unit, amount in data]
-        response = HttpResponse(content_type='text/plain')
-        response['Content-Disposition'] = ('attachment;'
-                                           'filename="Ingredients.txt"')
-        response.writelines(ingredients)
-        return response
-
-
-class UpdateViewSet(UpdateModelMixin, GenericViewSet):
-
-    def update(self, request, *args, **kwargs):
-        response = super().update(request, *args, **kwargs)
-        if request.method == 'DELETE':
-            return Response(status=status.HTTP_204_NO_CONTENT)
+        renderer = request.accepted_renderer
+        ingredients = ShoppingListItem.objects.filter(
+            user=request.user
+        ).values_list(
+            'ingredient__name', 'ingredient__measurement_unit', 'amount'
+        ).order_by('ingredient__name')
+        response = StreamingHttpResponse(
+            renderer.stream(ingredients.iterator()),
+            content_type=renderer.content_type
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="{renderer.get_filename()}"')
         return response
 
 
-class CartFavoriteViewSet(UpdateViewSet):
-    queryset = Recipe.objects.all()
+class CartFavoriteViewSet(SerializationTimingMixin, GenericViewSet):
+    queryset = Recipe.objects.only(
+        'id', 'name', 'image', 'thumbnails_ready', 'cooking_time')
     serializer_class = CartFavoriteSerializer
-
-
-class CreateDestroyViewSet(CreateModelMixin,
+    permission_classes = (IsAuthenticated,)
+    use_replica = False
+    model = None
+
+    def add(self, request, pk):
+        recipe = self.get_object()
+        if not add_links(self.model, request.user, [recipe.pk]):
+            name = self.model._meta.verbose_name.lower()
+            raise ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [
+                f'Рецепт уже был добавлен в {name}!']})
+        return Response(self.get_serializer(recipe).data)
+
+    def remove(self, request, pk):
+        if not remove_links(self.model, request.user, [pk]):
+            # Removing twice is fine, an unknown recipe is not.
+            self.get_object()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    def get_batch(self, request):
+        serializer = CartFavoriteBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data['recipes']
+
+    def add_many(self, request):
+        added = add_links(self.model, request.user, self.get_batch(request))
+        return Response({'added': sorted(added)})
+
+    def remove_many(self, request):
+        removed = remove_links(self.model, request.user,
+                               self.get_batch(request))
+        return Response({'removed': sorted(removed)})
+
+
+class CreateDestroyViewSet(SerializationTimingMixin, CreateModelMixin,
                            DestroyModelMixin, GenericViewSet):
 
     def get_object(self):
@@ -148,17 +215,26 @@ class SubscribeViewSet(CreateDestroyViewSet):
     queryset = Subscribe.objects.all()
     serializer_class = SubscribeSerializer
     permission_classes = (IsAuthenticated,)
+    use_replica = False
 
 
-class TagViewSet(ReadOnlyModelViewSet):
+class TagViewSet(ReferenceCacheMixin, SerializationTimingMixin,
+                 ReadOnlyModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     pagination_class = None
 
 
-class IngredientViewSet(ReadOnlyModelViewSet):
+class IngredientViewSet(ReferenceCacheMixin, SerializationTimingMixin,
+                        ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     filter_backends = (DjangoFilterBackend,)
     filterset_class = IngredientFilter
     pagination_class = None
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.action == 'list' and self.request.query_params.get('name'):
+            return queryset[:settings.INGREDIENT_SEARCH_LIMIT]
+        return queryset
@@ -0,0 +1,26 @@
+from contextvars import ContextVar
+
+REPLICA = 'replica'
+
+replica_reads = ContextVar('replica_reads', default=False)
+
+
+class ReplicaRouter:
+    # Tokens are read right after login, before a replica may catch up.
+    primary_apps = {'authtoken'}
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label in self.primary_apps:
+            return None
+        if replica_reads.get():
+            return REPLICA
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
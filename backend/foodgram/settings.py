@@ -33,7 +33,7 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PAGINATION_CLASS': 'api.pagination.CustomPagination',
     'PAGE_SIZE': 6
@@ -44,6 +44,7 @@ DJOSER = {
     'SERIALIZERS': {
         'current_user': 'api.serializers.CustomUserSerializer',
         'user_create': 'api.serializers.CustomUserCreateSerializer',
+        'token': 'api.serializers.CustomTokenSerializer',
     },
     'PERMISSIONS': {
         'user_list': ['rest_framework.permissions.IsAuthenticatedOrReadOnly'],
@@ -52,6 +53,8 @@ DJOSER = {
 }
 
 MIDDLEWARE = [
+    'api.middleware.InstrumentationMiddleware',
+    'api.middleware.DatabaseMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -80,18 +83,35 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'foodgram.wsgi.application'
+ASGI_APPLICATION = 'foodgram.asgi.application'
+
+API_ASYNC_VIEWS = int(os.environ.get('API_ASYNC_VIEWS', 0))
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': os.environ.get('DB_ENGINE', 'django.db.backends.postgresql'),
         'NAME': os.environ.get('DB_NAME'),
         'USER': os.environ.get('POSTGRES_USER'),
         'PASSWORD': os.environ.get('POSTGRES_PASSWORD'),
         'HOST': os.environ.get('DB_HOST'),
         'PORT': os.environ.get('DB_PORT'),
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        'DISABLE_SERVER_SIDE_CURSORS': bool(int(os.environ.get('DB_DISABLE_SERVER_SIDE_CURSORS', 0))),
     }
 }
 
+if os.environ.get('DB_REPLICA_HOST'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'HOST': os.environ.get('DB_REPLICA_HOST'),
+        'PORT': os.environ.get('DB_REPLICA_PORT', DATABASES['default']['PORT']),
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['foodgram.routers.ReplicaRouter']
+
+DB_CONN_HEALTH_CHECKS = int(os.environ.get('DB_CONN_HEALTH_CHECKS', 0))
+
 AUTH_USER_MODEL = 'users.User'
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -125,4 +145,57 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+INGREDIENT_SEARCH_LIMIT = int(os.environ.get('INGREDIENT_SEARCH_LIMIT', 20))
+CART_FAVORITE_BATCH_LIMIT = int(os.environ.get('CART_FAVORITE_BATCH_LIMIT', 500))
+API_FAST_RECIPE_LIST = bool(int(os.environ.get('API_FAST_RECIPE_LIST', 1)))
+# Recipes of authors with more followers are read from the recipe table
+# instead of being copied into every follower's timeline.
+FEED_FANOUT_LIMIT = int(os.environ.get('FEED_FANOUT_LIMIT', 1000))
+FEED_BACKFILL = int(os.environ.get('FEED_BACKFILL', 20))
+RECIPE_BULK_CHUNK_SIZE = int(os.environ.get('RECIPE_BULK_CHUNK_SIZE', 500))
+
+RECIPE_THUMBNAIL_SIZES = {'small': 240, 'medium': 480}
+RECIPE_THUMBNAIL_FORMAT = os.environ.get('RECIPE_THUMBNAIL_FORMAT', 'webp')
+RECIPE_IMAGE_WORKERS = int(os.environ.get('RECIPE_IMAGE_WORKERS', 2))
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    }
+}
+
+REFERENCE_CACHE_ALIAS = os.environ.get('REFERENCE_CACHE_ALIAS') or None
+REFERENCE_CACHE_TIMEOUT = int(os.environ.get('REFERENCE_CACHE_TIMEOUT', 3600))
+REFERENCE_CACHE_MAX_AGE = int(os.environ.get('REFERENCE_CACHE_MAX_AGE', 60))
+TAG_IDS_LOCAL_TIMEOUT = int(os.environ.get('TAG_IDS_LOCAL_TIMEOUT', 60))
+
+PAGINATION_COUNT_CACHE_ALIAS = os.environ.get('PAGINATION_COUNT_CACHE_ALIAS') or None
+PAGINATION_COUNT_CACHE_TIMEOUT = int(os.environ.get('PAGINATION_COUNT_CACHE_TIMEOUT', 60))
+
+AUTH_TOKEN_CACHE_ALIAS = os.environ.get('AUTH_TOKEN_CACHE_ALIAS') or None
+AUTH_TOKEN_CACHE_TIMEOUT = int(os.environ.get('AUTH_TOKEN_CACHE_TIMEOUT', 300))
+AUTH_SIGNED_TOKENS = int(os.environ.get('AUTH_SIGNED_TOKENS', 0))
+AUTH_SIGNED_TOKEN_MAX_AGE = int(os.environ.get('AUTH_SIGNED_TOKEN_MAX_AGE', 24 * 60 * 60))
+
+MEMBERSHIP_CACHE_ALIAS = os.environ.get('MEMBERSHIP_CACHE_ALIAS') or None
+MEMBERSHIP_CACHE_TIMEOUT = int(os.environ.get('MEMBERSHIP_CACHE_TIMEOUT', 300))
+
+RECIPE_CACHE_ALIAS = os.environ.get('RECIPE_CACHE_ALIAS') or None
+RECIPE_CACHE_TIMEOUT = int(os.environ.get('RECIPE_CACHE_TIMEOUT', 3600))
+
+INSTRUMENTATION_SERVER_TIMING = int(os.environ.get('INSTRUMENTATION_SERVER_TIMING', DEBUG))
+INSTRUMENTATION_PROFILE_THRESHOLD = (
+    float(os.environ['INSTRUMENTATION_PROFILE_THRESHOLD'])
+    if os.environ.get('INSTRUMENTATION_PROFILE_THRESHOLD') else None
+)
+INSTRUMENTATION_PROFILE_SAMPLE_RATE = float(os.environ.get('INSTRUMENTATION_PROFILE_SAMPLE_RATE', 0.01))
+INSTRUMENTATION_PROFILE_DIR = os.environ.get('INSTRUMENTATION_PROFILE_DIR', os.path.join(BASE_DIR, 'profiles'))
+
+SHOPPING_CART_PDF_FONT = os.environ.get(
+    'SHOPPING_CART_PDF_FONT',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
+
 DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
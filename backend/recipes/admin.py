@@ -1,7 +1,9 @@
 from django.contrib import admin
 from django.contrib.auth import get_user_model
-from django.db.models import Count
 
+from users.shopping_list import rebuild_recipes
+
+from .images import discard_thumbnails, schedule_thumbnails
 from .models import Ingredient, Recipe, RecipeIngredient, RecipeTag, Tag
 
 User = get_user_model()
@@ -31,6 +33,22 @@ class RecipeIngredientAdmin(admin.ModelAdmin):
     list_filter = ('recipe', 'ingredient',)
     autocomplete_fields = ('ingredient',)
 
+    # Admin edits are rare, so affected shopping lists are rebuilt instead
+    # of being adjusted by deltas like the API does.
+    def save_model(self, request, obj, form, change):
+        recipe_ids = {obj.recipe_id, form.initial.get('recipe')}
+        super().save_model(request, obj, form, change)
+        rebuild_recipes(recipe_ids - {None})
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        rebuild_recipes([obj.recipe_id])
+
+    def delete_queryset(self, request, queryset):
+        recipe_ids = set(queryset.values_list('recipe_id', flat=True))
+        super().delete_queryset(request, queryset)
+        rebuild_recipes(recipe_ids)
+
 
 class IngredientAdmin(admin.ModelAdmin):
     list_display = ('id', 'name', 'measurement_unit',)
@@ -43,19 +61,27 @@ class TagAdmin(admin.ModelAdmin):
     search_fields = ('slug', 'name',)
 
 class RecipeAdmin(admin.ModelAdmin):
-    list_display = ['name', 'author', 'is_favorited_count']
+    list_display = ['name', 'author', 'favorites_count', 'cart_count']
+    list_select_related = ('author',)
     inlines = (RecipeIngredientInLine, RecipeTagsInLine,)
     list_filter = ('name', 'author', 'tags',)
     search_fields = ('author__username', 'author__email', 'tags__slug')
     autocomplete_fields = ('author',)
 
-    def is_favorited_count(self, obj):
-        return obj.is_favorited_count
-
-    def get_queryset(self, request):
-        queryset = super().get_queryset(request)
-        queryset = queryset.annotate(is_favorited_count=Count('favorited_by'))
-        return queryset
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        if change:
+            rebuild_recipes([form.instance.pk])
+
+    def save_model(self, request, obj, form, change):
+        if 'image' in form.changed_data:
+            obj.thumbnails_ready = False
+            if change:
+                old = form.initial.get('image')
+                discard_thumbnails(getattr(old, 'name', None))
+        super().save_model(request, obj, form, change)
+        if 'image' in form.changed_data:
+            schedule_thumbnails(obj)
 
 
 admin.site.register(Ingredient, IngredientAdmin)
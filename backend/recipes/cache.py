@@ -0,0 +1,91 @@
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+from .models import Tag
+
+VERSION_KEY = 'version:{}'
+TAG_IDS_KEY = 'tag_ids:{}'
+RECIPE_VERSION_KEY = 'version:recipe:{}'
+
+# Holds the tag slug map when no reference cache is configured. Other
+# processes pick up tag changes within TAG_IDS_LOCAL_TIMEOUT seconds.
+local_cache = LocMemCache('recipes.cache', {})
+
+
+def get_cache(setting='REFERENCE_CACHE_ALIAS'):
+    # Every cache of the project is opt-in: its alias setting names an
+    # entry of CACHES, and None turns the cache off.
+    alias = getattr(settings, setting)
+    if alias is None:
+        return None
+    return caches[alias]
+
+
+def get_version(model):
+    cache = get_cache()
+    if cache is None:
+        return None
+    key = VERSION_KEY.format(model._meta.label_lower)
+    version = cache.get(key)
+    if version is None:
+        # Random tokens instead of a counter: a flushed cache must never
+        # hand out a version (and an ETag) that a client already holds.
+        cache.add(key, uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(*models):
+    cache = get_cache()
+    if cache is None:
+        local_cache.clear()
+        return
+    cache.set_many({VERSION_KEY.format(model._meta.label_lower): uuid4().hex
+                    for model in models}, None)
+
+
+def get_tag_ids():
+    version = get_version(Tag)
+    if version is None:
+        cache, key = local_cache, TAG_IDS_KEY.format('local')
+        timeout = settings.TAG_IDS_LOCAL_TIMEOUT
+    else:
+        cache, key = get_cache(), TAG_IDS_KEY.format(version)
+        timeout = settings.REFERENCE_CACHE_TIMEOUT
+    tag_ids = cache.get(key)
+    if tag_ids is None:
+        tag_ids = dict(Tag.objects.values_list('slug', 'id'))
+        cache.set(key, tag_ids, timeout)
+    return tag_ids
+
+
+def get_recipe_version(pk):
+    cache = get_cache('RECIPE_CACHE_ALIAS')
+    key = RECIPE_VERSION_KEY.format(pk)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+
+def bump_recipe_versions(*pks):
+    cache = get_cache('RECIPE_CACHE_ALIAS')
+    if cache is None:
+        return
+    cache.set_many({RECIPE_VERSION_KEY.format(pk): uuid4().hex
+                    for pk in pks}, None)
+
+
+def invalidate_recipes(pks):
+    if get_cache('RECIPE_CACHE_ALIAS') is None:
+        return
+    # Readers pick the version before querying, so a fragment built from
+    # rows this transaction is replacing lands under the old version.
+    pks = set(pks)
+    if pks:
+        transaction.on_commit(lambda: bump_recipe_versions(*pks))
@@ -0,0 +1,100 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import md5
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from PIL import Image
+
+from .models import Recipe
+
+logger = logging.getLogger(__name__)
+
+PIL_FORMATS = {'webp': 'WEBP', 'jpg': 'JPEG'}
+
+executor = ThreadPoolExecutor(
+    max_workers=max(settings.RECIPE_IMAGE_WORKERS, 1),
+    thread_name_prefix='recipe-images'
+)
+
+
+def thumbnail_name(image_name, size, extension):
+    # Keyed by the whole stored name, so a.png and a.jpg, or the same file
+    # name under another upload path, get thumbnails of their own.
+    stem = os.path.splitext(os.path.basename(image_name))[0]
+    digest = md5(image_name.encode()).hexdigest()[:12]
+    return f'recipes/thumbnails/{stem}_{digest}_{size}.{extension}'
+
+
+def thumbnail_names(image_name):
+    return [thumbnail_name(image_name, size, extension)
+            for size in settings.RECIPE_THUMBNAIL_SIZES.values()
+            for extension in PIL_FORMATS]
+
+
+def image_url(image_name, thumbnails_ready, size):
+    if not image_name:
+        return None
+    if not thumbnails_ready:
+        return default_storage.url(image_name)
+    return default_storage.url(thumbnail_name(
+        image_name, settings.RECIPE_THUMBNAIL_SIZES[size],
+        settings.RECIPE_THUMBNAIL_FORMAT))
+
+
+def thumbnail_url(recipe, size):
+    return image_url(recipe.image.name, recipe.thumbnails_ready, size)
+
+
+def make_thumbnails(recipe_id, image_name):
+    try:
+        with default_storage.open(image_name) as source:
+            image = Image.open(source)
+            image.load()
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        for size in settings.RECIPE_THUMBNAIL_SIZES.values():
+            thumbnail = image.copy()
+            thumbnail.thumbnail((size, size))
+            for extension, pil_format in PIL_FORMATS.items():
+                buffer = BytesIO()
+                thumbnail.save(buffer, format=pil_format, quality=85)
+                name = thumbnail_name(image_name, size, extension)
+                default_storage.delete(name)
+                default_storage.save(name, ContentFile(buffer.getvalue()))
+        Recipe.objects.filter(pk=recipe_id, image=image_name).update(
+            thumbnails_ready=True)
+    except Exception:
+        logger.exception('Не удалось создать миниатюры для %s', image_name)
+
+
+def delete_thumbnails(image_name):
+    for name in thumbnail_names(image_name):
+        default_storage.delete(name)
+
+
+def discard_thumbnails(image_name):
+    # After commit, so a rolled back change keeps its thumbnails.
+    if image_name:
+        transaction.on_commit(lambda: delete_thumbnails(image_name))
+
+
+def make_thumbnails_in_worker(recipe_id, image_name):
+    try:
+        make_thumbnails(recipe_id, image_name)
+    finally:
+        connection.close()
+
+
+def schedule_thumbnails(recipe):
+    recipe_id, image_name = recipe.pk, recipe.image.name
+    if not settings.RECIPE_IMAGE_WORKERS:
+        transaction.on_commit(lambda: make_thumbnails(recipe_id, image_name))
+        return
+    transaction.on_commit(
+        lambda: executor.submit(make_thumbnails_in_worker,
+                                recipe_id, image_name))
@@ -0,0 +1,166 @@
+import random
+import time
+from uuid import uuid4
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from recipes.cache import bump_version
+from recipes.models import Ingredient, Recipe, RecipeIngredient, RecipeTag, Tag
+from users.models import Favorite, ShoppingCart, Subscribe
+from users.shopping_list import rebuild
+from users.signals import COUNTERS
+from users.timelines import rebuild as rebuild_timelines
+
+User = get_user_model()
+
+TAGS = (
+    ('Завтрак', '#E26C2D', 'breakfast'),
+    ('Обед', '#49B64E', 'lunch'),
+    ('Ужин', '#8775D2', 'dinner'),
+)
+PASSWORD = 'benchmark-password'
+
+
+class Command(BaseCommand):
+    help = 'Generate a synthetic dataset for benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--recipes', type=int, default=1000)
+        parser.add_argument('--ingredients', type=int, default=1000,
+                            help='Ingredients to create when the catalogue '
+                                 'is empty')
+        parser.add_argument('--ingredients-per-recipe', type=int, default=8)
+        parser.add_argument('--favorites-per-user', type=int, default=20)
+        parser.add_argument('--cart-per-user', type=int, default=5)
+        parser.add_argument('--subscriptions-per-user', type=int,
+                            default=10)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--seed', type=int)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.prefix = uuid4().hex[:8]
+        started = time.monotonic()
+
+        tag_ids = self.get_tags()
+        ingredient_ids = self.get_ingredients(options['ingredients'])
+        if len(ingredient_ids) < options['ingredients_per_recipe']:
+            raise CommandError('Not enough ingredients in the catalogue')
+        user_ids = self.create_users(options['users'])
+        if not user_ids:
+            raise CommandError('At least one user is required')
+        recipe_ids = self.create_recipes(
+            options['recipes'], user_ids, tag_ids, ingredient_ids,
+            options['ingredients_per_recipe'])
+        self.create_links(Favorite, user_ids, recipe_ids, 'recipe_id',
+                          options['favorites_per_user'])
+        self.create_links(ShoppingCart, user_ids, recipe_ids, 'recipe_id',
+                          options['cart_per_user'])
+        self.create_links(Subscribe, user_ids, user_ids, 'author_id',
+                          options['subscriptions_per_user'])
+
+        # bulk_create skips signals, so counters, shopping lists and feed
+        # timelines are rebuilt in one pass.
+        for counter in COUNTERS:
+            with transaction.atomic():
+                counter.reconcile()
+        rebuild()
+        self.stdout.write(f'Timeline entries: {rebuild_timelines()}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated {len(user_ids)} users and {len(recipe_ids)} '
+            f'recipes in {time.monotonic() - started:.1f}s '
+            f'(password: {PASSWORD})'))
+
+    def batches(self, items):
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def get_tags(self):
+        if not Tag.objects.exists():
+            Tag.objects.bulk_create(
+                Tag(name=name, color=color, slug=slug)
+                for name, color, slug in TAGS)
+            bump_version(Tag)
+        return list(Tag.objects.values_list('pk', flat=True))
+
+    def get_ingredients(self, count):
+        if not Ingredient.objects.exists():
+            units = ('г', 'мл', 'шт.', 'ст. л.', 'по вкусу')
+            for batch in self.batches(
+                    Ingredient(name=f'Ингредиент {i}',
+                               measurement_unit=self.random.choice(units))
+                    for i in range(count)):
+                Ingredient.objects.bulk_create(batch)
+            bump_version(Ingredient)
+        return list(Ingredient.objects.values_list('pk', flat=True))
+
+    def create_users(self, count):
+        password = make_password(PASSWORD)
+        user_ids = []
+        for batch in self.batches(range(count)):
+            usernames = [f'{self.prefix}_{i}' for i in batch]
+            User.objects.bulk_create(
+                User(username=username, email=f'{username}@example.com',
+                     first_name='Имя', last_name='Фамилия',
+                     password=password)
+                for username in usernames)
+            user_ids.extend(User.objects.filter(
+                username__in=usernames).values_list('pk', flat=True))
+        self.stdout.write(f'Users: {len(user_ids)}')
+        return user_ids
+
+    def create_recipes(self, count, user_ids, tag_ids, ingredient_ids,
+                       per_recipe):
+        recipe_ids = []
+        for batch in self.batches(range(count)):
+            names = [f'Рецепт {self.prefix} {i}' for i in batch]
+            with transaction.atomic():
+                Recipe.objects.bulk_create(
+                    Recipe(author_id=self.random.choice(user_ids), name=name,
+                           text='Описание рецепта',
+                           cooking_time=self.random.randint(5, 120),
+                           image='recipes/benchmark.png')
+                    for name in names)
+                ids = list(Recipe.objects.filter(
+                    name__in=names).values_list('pk', flat=True))
+                RecipeTag.objects.bulk_create(
+                    RecipeTag(recipe_id=pk, tag_id=tag_id)
+                    for pk in ids
+                    for tag_id in self.random.sample(
+                        tag_ids, self.random.randint(1, len(tag_ids))))
+                RecipeIngredient.objects.bulk_create(
+                    RecipeIngredient(recipe_id=pk, ingredient_id=ingredient,
+                                     amount=self.random.randint(1, 500))
+                    for pk in ids
+                    for ingredient in self.random.sample(
+                        ingredient_ids, per_recipe))
+            recipe_ids.extend(ids)
+            self.stdout.write(f'Recipes: {len(recipe_ids)}')
+        return recipe_ids
+
+    def create_links(self, model, user_ids, target_ids, field, per_user):
+        created = 0
+        for batch in self.batches(user_ids):
+            links = []
+            for user_id in batch:
+                sample = [
+                    target for target in self.random.sample(
+                        target_ids, min(per_user + 1, len(target_ids)))
+                    if field != 'author_id' or target != user_id
+                ][:per_user]
+                links.extend(model(user_id=user_id, **{field: target})
+                             for target in sample)
+            model.objects.bulk_create(links, ignore_conflicts=True)
+            created += len(links)
+        self.stdout.write(f'{model._meta.verbose_name_plural}: {created}')
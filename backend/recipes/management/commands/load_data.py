@@ -1,17 +1,99 @@
 import csv
+import json
+import os
+import time
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 
+from recipes.cache import bump_version
 from recipes.models import Ingredient
 
 
 class Command(BaseCommand):
     help = 'Load ingredients data to DB'
+    formats = ('csv', 'json', 'jsonl')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='ingredients.csv')
+        parser.add_argument('--format', choices=self.formats,
+                            help='File format, detected by extension '
+                                 'if omitted')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Parse the file and report what would '
+                                 'be written without touching the DB')
+
+    def read_rows(self, f, file_format):
+        if file_format == 'csv':
+            for row in csv.reader(f):
+                if row:
+                    yield row[0], row[1]
+        elif file_format == 'json':
+            for item in json.load(f):
+                yield item['name'], item['measurement_unit']
+        else:
+            for line in f:
+                if line.strip():
+                    item = json.loads(line)
+                    yield item['name'], item['measurement_unit']
+
+    def get_format(self, path, file_format):
+        if file_format:
+            return file_format
+        extension = os.path.splitext(path)[1].lstrip('.').lower()
+        if extension == 'ndjson':
+            return 'jsonl'
+        if extension not in self.formats:
+            raise CommandError(f'Unknown file format: {path}')
+        return extension
+
+    def write_batch(self, batch, dry_run):
+        # Rows are keyed by (name, measurement_unit), the unique key of
+        # Ingredient, so existing rows are counted and left as they are.
+        existing = set(Ingredient.objects.filter(
+            name__in={name for name, _ in batch}
+        ).values_list('name', 'measurement_unit'))
+        new = [key for key in batch if key not in existing]
+        if not dry_run:
+            Ingredient.objects.bulk_create(
+                (Ingredient(name=name, measurement_unit=unit)
+                 for name, unit in new), ignore_conflicts=True)
+        return len(new), len(batch) - len(new)
 
     def handle(self, *args, **options):
-        with open('ingredients.csv', encoding='utf-8') as f:
-            reader = csv.reader(f)
-            for row in reader:
-                name, unit = row
-                Ingredient.objects.get_or_create(name=name,
-                                                 measurement_unit=unit)
+        path = options['path']
+        file_format = self.get_format(path, options['format'])
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+        seen = set()
+        batch = []
+        rows = created = existing = 0
+        started = time.monotonic()
+        with open(path, encoding='utf-8') as f:
+            for name, unit in self.read_rows(f, file_format):
+                rows += 1
+                key = name.strip(), unit.strip()
+                if key in seen:
+                    continue
+                seen.add(key)
+                batch.append(key)
+                if len(batch) >= batch_size:
+                    new, old = self.write_batch(batch, dry_run)
+                    created, existing = created + new, existing + old
+                    batch.clear()
+                    self.stdout.write(
+                        f'Rows: {rows} ({self.rate(rows, started)} rows/s)')
+        if batch:
+            new, old = self.write_batch(batch, dry_run)
+            created, existing = created + new, existing + old
+        if not dry_run and created:
+            bump_version(Ingredient)
+        self.stdout.write(self.style.SUCCESS(
+            f'Rows: {rows}, created: {created}, existing: {existing} '
+            f'({self.rate(rows, started)} rows/s)'))
+        if dry_run:
+            self.stdout.write(self.style.WARNING(
+                'Dry run: nothing was written'))
+
+    def rate(self, rows, started):
+        return round(rows / max(time.monotonic() - started, 1e-6))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from recipes.images import make_thumbnails
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Generate missing recipe image thumbnails'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Regenerate the thumbnails of every recipe, '
+                                 'e.g. after their naming changed')
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='')
+        if not options['all']:
+            recipes = recipes.filter(thumbnails_ready=False)
+        recipes = recipes.values_list('pk', 'image')
+        count = 0
+        for pk, image in recipes.iterator():
+            make_thumbnails(pk, image)
+            count += 1
+        self.stdout.write(f'Processed {count} recipes')
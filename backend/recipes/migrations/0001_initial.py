@@ -0,0 +1,86 @@
+# Generated by Django 3.2.10 on 2026-10-17 19:03
+
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Ingredient',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(db_index=True, max_length=256, verbose_name='Название ингредиента')),
+                ('measurement_unit', models.CharField(max_length=50, verbose_name='Единица измерения')),
+            ],
+            options={
+                'verbose_name': 'Ингредиент',
+                'verbose_name_plural': 'Ингредиенты',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Recipe',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200, unique=True, verbose_name='Название')),
+                ('text', models.TextField(max_length=1500, verbose_name='Описание рецепта')),
+                ('cooking_time', models.PositiveSmallIntegerField(validators=[django.core.validators.MinValueValidator(1)], verbose_name='Время приготовления')),
+                ('image', models.ImageField(upload_to='recipes/', verbose_name='Изображение')),
+                ('thumbnails_ready', models.BooleanField(default=False, editable=False, verbose_name='Миниатюры готовы')),
+                ('favorites_count', models.PositiveIntegerField(default=0, editable=False, verbose_name='В избранном')),
+                ('cart_count', models.PositiveIntegerField(default=0, editable=False, verbose_name='В списках покупок')),
+                ('pub_date', models.DateTimeField(auto_now_add=True, verbose_name='Дата публикации')),
+            ],
+            options={
+                'verbose_name': 'Рецепт',
+                'verbose_name_plural': 'Рецепты',
+                'ordering': ['-pub_date'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Tag',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='Тег')),
+                ('color', models.CharField(max_length=7, unique=True, verbose_name='Цвет')),
+                ('slug', models.SlugField(unique=True, verbose_name='Слаг')),
+            ],
+            options={
+                'verbose_name': 'Тег',
+                'verbose_name_plural': 'Теги',
+            },
+        ),
+        migrations.CreateModel(
+            name='RecipeTag',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('recipe', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='recipes.recipe', verbose_name='Рецепт')),
+                ('tag', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='recipes.tag', verbose_name='Тег')),
+            ],
+            options={
+                'verbose_name': 'Тег к рецепту',
+                'verbose_name_plural': 'Теги к рецептам',
+            },
+        ),
+        migrations.CreateModel(
+            name='RecipeIngredient',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.PositiveSmallIntegerField(validators=[django.core.validators.MinValueValidator(1)], verbose_name='Количество ингредиента')),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ingredient_recipes', to='recipes.ingredient', verbose_name='Ингредиент')),
+                ('recipe', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='recipe_ingredients', to='recipes.recipe', verbose_name='Рецепт')),
+            ],
+            options={
+                'verbose_name': 'Информация об ингредиенте в рецепте',
+                'verbose_name_plural': 'Информация об ингредиентах в рецептах',
+            },
+        ),
+    ]
@@ -12,6 +12,12 @@ class Ingredient(models.Model):
                                         verbose_name='Единица измерения')
 
     class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=('name', 'measurement_unit'),
+                name='unique_ingredient',
+            ),
+        ]
         ordering = ['name']
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
@@ -39,7 +45,7 @@ class Tag(models.Model):
 class Recipe(models.Model):
     author = models.ForeignKey(User, verbose_name='Автор',
                                on_delete=models.CASCADE,
-                               related_name='recipes')
+                               related_name='recipes', db_index=False)
     name = models.CharField(max_length=200, unique=True,
                             verbose_name='Название')
     text = models.TextField(max_length=1500, verbose_name='Описание рецепта')
@@ -54,10 +60,26 @@ class Recipe(models.Model):
     )
     image = models.ImageField(upload_to='recipes/',
                               verbose_name='Изображение')
+    thumbnails_ready = models.BooleanField(default=False, editable=False,
+                                           verbose_name='Миниатюры готовы')
+    favorites_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name='В избранном')
+    cart_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name='В списках покупок')
     pub_date = models.DateTimeField(auto_now_add=True,
                                     verbose_name='Дата публикации')
 
     class Meta:
+        # Foreign keys that lead a composite index or unique constraint
+        # are declared with db_index=False, the composite serves their
+        # lookups and cascades.
+        indexes = [
+            models.Index(fields=('-pub_date', '-id'), name='recipe_feed_idx'),
+            models.Index(fields=('-favorites_count', '-pub_date', '-id'),
+                         name='recipe_popular_idx'),
+            models.Index(fields=('author', '-pub_date', '-id'),
+                         name='recipe_author_feed_idx'),
+        ]
         ordering = ['-pub_date']
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
@@ -69,7 +91,8 @@ class Recipe(models.Model):
 class RecipeIngredient(models.Model):
     recipe = models.ForeignKey('Recipe', on_delete=models.CASCADE,
                                verbose_name='Рецепт',
-                               related_name='recipe_ingredients')
+                               related_name='recipe_ingredients',
+                               db_index=False)
     ingredient = models.ForeignKey('Ingredient', on_delete=models.CASCADE,
                                    verbose_name='Ингредиент',
                                    related_name='ingredient_recipes')
@@ -96,9 +119,9 @@ class RecipeIngredient(models.Model):
 
 class RecipeTag(models.Model):
     recipe = models.ForeignKey('Recipe', on_delete=models.CASCADE,
-                               verbose_name='Рецепт')
+                               verbose_name='Рецепт', db_index=False)
     tag = models.ForeignKey('Tag', on_delete=models.CASCADE,
-                            verbose_name='Тег')
+                            verbose_name='Тег', db_index=False)
 
     class Meta:
         constraints = [
@@ -107,6 +130,10 @@ class RecipeTag(models.Model):
                 name='prevent_duplicate_tags',
             ),
         ]
+        indexes = [
+            models.Index(fields=('tag', 'recipe'),
+                         name='recipetag_tag_recipe_idx'),
+        ]
         verbose_name = 'Тег к рецепту'
         verbose_name_plural = 'Теги к рецептам'
 
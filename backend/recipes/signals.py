@@ -0,0 +1,47 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import bump_version, invalidate_recipes
+from .images import discard_thumbnails
+from .models import Ingredient, Recipe, RecipeIngredient, RecipeTag, Tag
+
+
+@receiver(post_delete, sender=Ingredient)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=Tag)
+def reference_changed(sender, **kwargs):
+    bump_version(sender)
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_save, sender=Recipe)
+def recipe_changed(sender, instance, **kwargs):
+    invalidate_recipes([instance.pk])
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    discard_thumbnails(instance.image.name)
+
+
+@receiver(post_delete, sender=RecipeIngredient)
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeTag)
+@receiver(post_save, sender=RecipeTag)
+def recipe_part_changed(sender, instance, **kwargs):
+    invalidate_recipes([instance.recipe_id])
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_changed(sender, instance, created, **kwargs):
+    if not created:
+        invalidate_recipes(RecipeIngredient.objects.filter(
+            ingredient=instance).values_list('recipe_id', flat=True))
+
+
+@receiver(post_save, sender=Tag)
+def tag_changed(sender, instance, created, **kwargs):
+    if not created:
+        invalidate_recipes(RecipeTag.objects.filter(
+            tag=instance).values_list('recipe_id', flat=True))
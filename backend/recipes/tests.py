@@ -0,0 +1,121 @@
+import os
+import shutil
+import tempfile
+from io import BytesIO, StringIO
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from PIL import Image
+
+from .images import image_url, make_thumbnails, thumbnail_name, thumbnail_names
+from .models import Ingredient, Recipe
+
+User = get_user_model()
+
+ROWS = (
+    'пекарский порошок,г\n'
+    'пекарский порошок,ч. л.\n'
+    'стейк семги,шт.\n'
+    'стейк семги,г\n'
+    'соль,г\n'
+)
+
+
+class LoadDataTest(TestCase):
+
+    def setUp(self):
+        f = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False,
+                                        encoding='utf-8')
+        with f:
+            f.write(ROWS)
+        self.path = f.name
+        self.addCleanup(os.remove, self.path)
+
+    def load(self, *args):
+        output = StringIO()
+        call_command('load_data', self.path, *args, stdout=output)
+        return output.getvalue()
+
+    def test_same_name_with_different_units(self):
+        self.assertIn('created: 5, existing: 0', self.load())
+        self.assertEqual(Ingredient.objects.count(), 5)
+
+    def test_reload_counts_existing_rows(self):
+        Ingredient.objects.create(name='соль', measurement_unit='г')
+        self.assertIn('created: 4, existing: 1',
+                      self.load('--batch-size', '2'))
+        self.assertIn('created: 0, existing: 5', self.load())
+        self.assertEqual(Ingredient.objects.count(), 5)
+
+    def test_dry_run(self):
+        self.assertIn('created: 5, existing: 0', self.load('--dry-run'))
+        self.assertFalse(Ingredient.objects.exists())
+
+
+class ThumbnailTest(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media = tempfile.mkdtemp()
+        cls.settings = override_settings(MEDIA_ROOT=cls.media)
+        cls.settings.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.settings.disable()
+        shutil.rmtree(cls.media, ignore_errors=True)
+        super().tearDownClass()
+
+    def create_recipe(self, name='recipes/photo.png'):
+        buffer = BytesIO()
+        Image.new('RGB', (600, 400), 'red').save(buffer, format='PNG')
+        name = default_storage.save(name, ContentFile(buffer.getvalue()))
+        author = User.objects.create(username='cook', email='cook@ya.ru')
+        return Recipe.objects.create(author=author, name='Рецепт',
+                                     text='Текст', cooking_time=10,
+                                     image=name)
+
+    def test_names_differ_by_extension_and_path(self):
+        names = {thumbnail_name(image, 240, 'webp') for image in (
+            'recipes/a.png', 'recipes/a.jpg', 'other/a.png')}
+        self.assertEqual(len(names), 3)
+
+    def test_image_url_falls_back_to_original(self):
+        self.assertIsNone(image_url('', True, 'small'))
+        self.assertEqual(image_url('recipes/a.png', False, 'small'),
+                         '/media/recipes/a.png')
+        self.assertEqual(
+            image_url('recipes/a.png', True, 'small'),
+            '/media/' + thumbnail_name(
+                'recipes/a.png', settings.RECIPE_THUMBNAIL_SIZES['small'],
+                settings.RECIPE_THUMBNAIL_FORMAT))
+
+    def test_make_thumbnails(self):
+        recipe = self.create_recipe()
+        make_thumbnails(recipe.pk, recipe.image.name)
+        recipe.refresh_from_db()
+        self.assertTrue(recipe.thumbnails_ready)
+        for name in thumbnail_names(recipe.image.name):
+            with default_storage.open(name) as f:
+                self.assertLessEqual(max(Image.open(f).size), 480)
+
+    def test_missing_image_leaves_thumbnails_not_ready(self):
+        recipe = self.create_recipe()
+        default_storage.delete(recipe.image.name)
+        with self.assertLogs('recipes.images', 'ERROR'):
+            make_thumbnails(recipe.pk, recipe.image.name)
+        recipe.refresh_from_db()
+        self.assertFalse(recipe.thumbnails_ready)
+
+    def test_deleting_recipe_removes_thumbnails(self):
+        recipe = self.create_recipe()
+        make_thumbnails(recipe.pk, recipe.image.name)
+        names = thumbnail_names(recipe.image.name)
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.delete()
+        self.assertFalse(any(map(default_storage.exists, names)))
@@ -6,4 +6,4 @@ class UsersConfig(AppConfig):
     verbose_name = 'Управление пользователями'
 
     def ready(self):
-        from . import signals
+        from . import checks, signals
@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Tags, Warning, register
+
+
+@register(Tags.caches)
+def check_token_cache(app_configs, **kwargs):
+    alias = settings.AUTH_TOKEN_CACHE_ALIAS
+    if alias is None or not isinstance(caches[alias], LocMemCache):
+        return []
+    return [Warning(
+        f'AUTH_TOKEN_CACHE_ALIAS "{alias}" is a per-process cache.',
+        hint='Logouts, password changes and deactivations reach the other '
+             'worker processes only after AUTH_TOKEN_CACHE_TIMEOUT '
+             'seconds. Point the setting to a shared cache.',
+        id='users.W001',
+    )]
@@ -0,0 +1,63 @@
+from collections import defaultdict
+
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+
+class Counter:
+
+    def __init__(self, model, field, source, relation):
+        self.model = model
+        self.field = field
+        self.source = source
+        self.relation = relation
+
+    def __str__(self):
+        return f'{self.model._meta.label}.{self.field}'
+
+    def change(self, deltas):
+        by_delta = defaultdict(list)
+        for pk, delta in deltas.items():
+            if delta:
+                by_delta[delta].append(pk)
+        for delta, pks in by_delta.items():
+            self.model.objects.filter(pk__in=pks).update(
+                **{self.field: Greatest(F(self.field) + delta, 0)})
+
+    def actual(self):
+        counted = self.source.objects.filter(
+            **{self.relation: OuterRef('pk')}
+        ).order_by().values(self.relation).annotate(
+            total=Count('pk')).values('total')
+        return Coalesce(Subquery(counted), 0)
+
+    def reconcile(self):
+        drifted = self.model.objects.annotate(
+            actual=self.actual()).exclude(**{self.field: F('actual')})
+        return self.model.objects.filter(
+            pk__in=list(drifted.values_list('pk', flat=True))
+        ).update(**{self.field: self.actual()})
+
+    def created(self, sender, instance, created, **kwargs):
+        if created:
+            self.change({getattr(instance, f'{self.relation}_id'): 1})
+
+    def deleted(self, sender, instance, **kwargs):
+        self.change({getattr(instance, f'{self.relation}_id'): -1})
+
+    def m2m_changed(self, sender, instance, action, model, pk_set,
+                    **kwargs):
+        # add() bulk inserts through rows without post_save, while
+        # remove() and clear() go through the collector and post_delete.
+        if action != 'post_add' or not pk_set:
+            return
+        if model is self.model:
+            self.change(dict.fromkeys(pk_set, 1))
+        else:
+            self.change({instance.pk: len(pk_set)})
+
+    def connect(self):
+        post_save.connect(self.created, sender=self.source)
+        post_delete.connect(self.deleted, sender=self.source)
+        m2m_changed.connect(self.m2m_changed, sender=self.source)
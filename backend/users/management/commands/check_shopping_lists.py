@@ -0,0 +1,32 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from users.shopping_list import find_drifted, rebuild
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Compare stored shopping lists with the carts they aggregate'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true',
+                            help='Rebuild the lists that drifted')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        user_ids = list(User.objects.order_by('pk').values_list(
+            'pk', flat=True))
+        drifted = set()
+        for start in range(0, len(user_ids), options['batch_size']):
+            batch = user_ids[start:start + options['batch_size']]
+            drifted.update(find_drifted(batch))
+        if not drifted:
+            self.stdout.write('Shopping lists are consistent')
+            return
+        if not options['fix']:
+            raise CommandError(
+                f'{len(drifted)} shopping lists drifted, users: '
+                f'{", ".join(map(str, sorted(drifted)))}')
+        rebuild(drifted)
+        self.stdout.write(f'Rebuilt {len(drifted)} shopping lists')
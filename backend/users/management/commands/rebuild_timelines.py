@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from users.timelines import rebuild
+
+
+class Command(BaseCommand):
+    help = ('Refill the recipe feed timelines from subscriptions, e.g. '
+            'after changing FEED_FANOUT_LIMIT or FEED_BACKFILL')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Timeline entries: {rebuild()}')
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from users.signals import COUNTERS
+
+
+class Command(BaseCommand):
+    help = 'Recalculate denormalized counters that drifted from the data'
+
+    def handle(self, *args, **options):
+        for counter in COUNTERS:
+            with transaction.atomic():
+                fixed = counter.reconcile()
+            self.stdout.write(f'{counter}: fixed {fixed} rows')
@@ -0,0 +1,47 @@
+from django.conf import settings
+
+from recipes.cache import get_cache
+
+from .models import Favorite, ShoppingCart, Subscribe
+
+
+class Membership:
+    cache_key = 'membership:{}'
+
+    def __init__(self, favorites=(), shopping_cart=(), subscriptions=()):
+        self.favorites = frozenset(favorites)
+        self.shopping_cart = frozenset(shopping_cart)
+        self.subscriptions = frozenset(subscriptions)
+
+    @classmethod
+    def from_db(cls, user_id):
+        return cls(
+            favorites=Favorite.objects.filter(
+                user_id=user_id).values_list('recipe_id', flat=True),
+            shopping_cart=ShoppingCart.objects.filter(
+                user_id=user_id).values_list('recipe_id', flat=True),
+            subscriptions=Subscribe.objects.filter(
+                user_id=user_id).order_by().values_list(
+                'author_id', flat=True),
+        )
+
+    @classmethod
+    def for_user(cls, user):
+        if user.is_anonymous:
+            return cls()
+        cache = get_cache('MEMBERSHIP_CACHE_ALIAS')
+        if cache is None:
+            return cls.from_db(user.pk)
+        key = cls.cache_key.format(user.pk)
+        membership = cache.get(key)
+        if membership is None:
+            membership = cls.from_db(user.pk)
+            cache.set(key, membership, settings.MEMBERSHIP_CACHE_TIMEOUT)
+        return membership
+
+
+def invalidate_membership(*user_ids):
+    cache = get_cache('MEMBERSHIP_CACHE_ALIAS')
+    if cache is None:
+        return
+    cache.delete_many([Membership.cache_key.format(pk) for pk in user_ids])
@@ -51,8 +51,13 @@ class User(AbstractUser):
         'recipes.Recipe', blank=True, through='Favorite',
         verbose_name='Избранное', related_name='favorited_by'
     )
-    recipes_count = models.PositiveSmallIntegerField(
+    recipes_count = models.PositiveIntegerField(
         default=0, verbose_name='Количество рецептов пользователя', blank=True)
+    followers_count = models.PositiveIntegerField(
+        default=0, verbose_name='Количество подписчиков', blank=True)
+    # Signed tokens issued before this moment, in nanoseconds, are revoked.
+    tokens_valid_after = models.BigIntegerField(
+        default=0, editable=False, verbose_name='Токены действительны после')
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name']
@@ -70,11 +75,11 @@ class User(AbstractUser):
 
 class Subscribe(models.Model):
     user = models.ForeignKey(
-        User, on_delete=models.CASCADE,
+        User, on_delete=models.CASCADE, db_index=False,
         verbose_name='Подписчики', related_name='subscriber'
     )
     author = models.ForeignKey(
-        User, on_delete=models.CASCADE,
+        User, on_delete=models.CASCADE, db_index=False,
         verbose_name='Подписки', related_name='subscription'
     )
     created = models.DateField(auto_now_add=True)
@@ -93,6 +98,10 @@ class Subscribe(models.Model):
                 name='prevent_self_subscribe',
             ),
         ]
+        indexes = [
+            models.Index(fields=('author', 'user'),
+                         name='subscribe_author_user_idx'),
+        ]
         ordering = ['-created']
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
@@ -100,11 +109,11 @@ class Subscribe(models.Model):
 
 class Favorite(models.Model):
     user = models.ForeignKey(
-        User, on_delete=models.CASCADE,
+        User, on_delete=models.CASCADE, db_index=False,
         verbose_name='Пользователь'
     )
     recipe = models.ForeignKey(
-        'recipes.Recipe', on_delete=models.CASCADE,
+        'recipes.Recipe', on_delete=models.CASCADE, db_index=False,
         verbose_name='Рецепт'
     )
 
@@ -118,17 +127,21 @@ class Favorite(models.Model):
                 name='prevent_duplicates_in_favorites'
             ),
         ]
+        indexes = [
+            models.Index(fields=('recipe', 'user'),
+                         name='favorite_recipe_user_idx'),
+        ]
         verbose_name = 'Избранное'
         verbose_name_plural = 'Избранное'
 
 
 class ShoppingCart(models.Model):
     user = models.ForeignKey(
-        User, on_delete=models.CASCADE,
+        User, on_delete=models.CASCADE, db_index=False,
         verbose_name='Пользователь'
     )
     recipe = models.ForeignKey(
-        'recipes.Recipe', on_delete=models.CASCADE,
+        'recipes.Recipe', on_delete=models.CASCADE, db_index=False,
         verbose_name='Рецепт'
     )
 
@@ -142,5 +155,67 @@ class ShoppingCart(models.Model):
                 name='prevent_duplicates_in_cart'
             ),
         ]
+        indexes = [
+            models.Index(fields=('recipe', 'user'),
+                         name='shoppingcart_recipe_user_idx'),
+        ]
         verbose_name = 'Список покупок'
         verbose_name_plural = 'Списки покупок'
+
+
+class ShoppingListItem(models.Model):
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, db_index=False,
+        verbose_name='Пользователь', related_name='shopping_list'
+    )
+    ingredient = models.ForeignKey(
+        'recipes.Ingredient', on_delete=models.CASCADE,
+        verbose_name='Ингредиент', related_name='+'
+    )
+    amount = models.PositiveIntegerField(default=0, verbose_name='Количество')
+
+    def __str__(self):
+        return f'{self.ingredient} {self.amount} в списке покупок {self.user}'
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(
+                fields=('user', 'ingredient'),
+                name='unique_shopping_list_item'
+            ),
+        ]
+        verbose_name = 'Позиция списка покупок'
+        verbose_name_plural = 'Позиции списков покупок'
+
+
+class TimelineEntry(models.Model):
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, db_index=False,
+        verbose_name='Пользователь', related_name='timeline'
+    )
+    recipe = models.ForeignKey(
+        'recipes.Recipe', on_delete=models.CASCADE,
+        verbose_name='Рецепт', related_name='+'
+    )
+    author = models.ForeignKey(
+        User, on_delete=models.CASCADE,
+        verbose_name='Автор', related_name='+'
+    )
+    pub_date = models.DateTimeField(verbose_name='Дата публикации')
+
+    def __str__(self):
+        return f'{self.recipe} в ленте {self.user}'
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(
+                fields=('user', 'recipe'),
+                name='unique_timeline_entry'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=('user', '-pub_date', '-recipe'),
+                         name='timeline_feed_idx'),
+        ]
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи лент'
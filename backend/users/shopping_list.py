@@ -0,0 +1,101 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+from django.db.models.functions import Greatest
+
+from recipes.models import RecipeIngredient
+
+from .models import ShoppingCart, ShoppingListItem
+
+BATCH_SIZE = 1000
+
+
+def recipe_amounts(recipe_ids, sign=1):
+    amounts = defaultdict(int)
+    for ingredient_id, amount in RecipeIngredient.objects.filter(
+            recipe_id__in=recipe_ids).values_list('ingredient_id', 'amount'):
+        amounts[ingredient_id] += sign * amount
+    return amounts
+
+
+def cart_users(recipe_id):
+    return list(ShoppingCart.objects.filter(
+        recipe_id=recipe_id).values_list('user_id', flat=True))
+
+
+def change(user_ids, deltas):
+    user_ids = list(user_ids)
+    deltas = {pk: delta for pk, delta in deltas.items() if delta}
+    if not user_ids or not deltas:
+        return
+    added = [pk for pk, delta in deltas.items() if delta > 0]
+    if added:
+        ShoppingListItem.objects.bulk_create(
+            (ShoppingListItem(user_id=user_id, ingredient_id=pk)
+             for user_id in user_ids for pk in added),
+            batch_size=BATCH_SIZE, ignore_conflicts=True)
+    # One UPDATE covers every ingredient; increments are applied by the
+    # database, so concurrent cart changes of the same user do not race.
+    items = ShoppingListItem.objects.filter(
+        user_id__in=user_ids, ingredient_id__in=deltas)
+    items.update(amount=Greatest(F('amount') + Case(
+        *(When(ingredient_id=pk, then=Value(delta))
+          for pk, delta in deltas.items()),
+        output_field=IntegerField()), 0))
+    if len(added) < len(deltas):
+        items.filter(amount=0).delete()
+
+
+def add_recipes(user_id, recipe_ids):
+    change([user_id], recipe_amounts(recipe_ids))
+
+
+def remove_recipes(user_id, recipe_ids):
+    change([user_id], recipe_amounts(recipe_ids, sign=-1))
+
+
+def expected(user_ids=None):
+    carts = ShoppingCart.objects.filter(
+        recipe__recipe_ingredients__isnull=False)
+    if user_ids is not None:
+        carts = carts.filter(user_id__in=user_ids)
+    return carts.values_list(
+        'user_id', 'recipe__recipe_ingredients__ingredient_id'
+    ).annotate(total=Sum('recipe__recipe_ingredients__amount')).order_by()
+
+
+@transaction.atomic
+def rebuild(user_ids=None):
+    items = ShoppingListItem.objects.all()
+    if user_ids is not None:
+        user_ids = list(user_ids)
+        items = items.filter(user_id__in=user_ids)
+    items.delete()
+    batch = []
+    for user_id, ingredient_id, total in expected(user_ids).iterator():
+        batch.append(ShoppingListItem(
+            user_id=user_id, ingredient_id=ingredient_id, amount=total))
+        if len(batch) >= BATCH_SIZE:
+            ShoppingListItem.objects.bulk_create(batch)
+            batch = []
+    ShoppingListItem.objects.bulk_create(batch)
+
+
+def rebuild_recipes(recipe_ids):
+    rebuild(set(ShoppingCart.objects.filter(
+        recipe_id__in=recipe_ids).values_list('user_id', flat=True)))
+
+
+def find_drifted(user_ids=None):
+    stored = ShoppingListItem.objects.all()
+    if user_ids is not None:
+        stored = stored.filter(user_id__in=user_ids)
+    actual = {(user_id, pk): amount for user_id, pk, amount
+              in stored.values_list('user_id', 'ingredient_id', 'amount')}
+    drifted = set()
+    for user_id, pk, total in expected(user_ids).iterator():
+        if actual.pop((user_id, pk), None) != total:
+            drifted.add(user_id)
+    drifted.update(user_id for user_id, _ in actual)
+    return drifted
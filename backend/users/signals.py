@@ -1,12 +1,126 @@
-from django.db.models.signals import post_delete, post_save
+import time
+
+from django.contrib.auth import get_user_model, user_logged_out
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
 from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
 
+from recipes.cache import invalidate_recipes
 from recipes.models import Recipe
 
+from .counters import Counter
+from .membership import invalidate_membership
+from .models import Favorite, ShoppingCart, Subscribe
+from .shopping_list import add_recipes, change, recipe_amounts, remove_recipes
+from .timelines import backfill, fan_out, follower_removed, unfollow
+from .tokens import invalidate_token, invalidate_user, revoke_signed_tokens
+
+User = get_user_model()
+
+AUTHOR_FIELDS = {'email', 'username', 'first_name', 'last_name'}
+
+COUNTERS = (
+    Counter(User, 'recipes_count', Recipe, 'author'),
+    Counter(Recipe, 'favorites_count', Favorite, 'recipe'),
+    Counter(Recipe, 'cart_count', ShoppingCart, 'recipe'),
+    Counter(User, 'followers_count', Subscribe, 'author'),
+)
+
+for counter in COUNTERS:
+    counter.connect()
+
+
+@receiver(post_delete, sender=Subscribe)
+@receiver(post_save, sender=Subscribe)
+@receiver(post_delete, sender=ShoppingCart)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_delete, sender=Favorite)
+@receiver(post_save, sender=Favorite)
+def membership_changed(sender, instance, **kwargs):
+    invalidate_membership(instance.user_id)
+
+
+@receiver(m2m_changed, sender=User.shopping_cart.through)
+@receiver(m2m_changed, sender=User.favorites.through)
+def membership_m2m_changed(sender, instance, action, reverse, pk_set,
+                           **kwargs):
+    if reverse and action == 'pre_clear':
+        invalidate_membership(*sender.objects.filter(
+            recipe=instance).values_list('user_id', flat=True))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        if not reverse:
+            invalidate_membership(instance.pk)
+        elif pk_set:
+            invalidate_membership(*pk_set)
+
+
+@receiver(post_save, sender=ShoppingCart)
+def cart_item_created(sender, instance, created, **kwargs):
+    if created:
+        add_recipes(instance.user_id, [instance.recipe_id])
+
+
+# pre_delete runs before a cascading recipe deletion removes the recipe
+# ingredients that are subtracted here.
+@receiver(pre_delete, sender=ShoppingCart)
+def cart_item_deleted(sender, instance, **kwargs):
+    remove_recipes(instance.user_id, [instance.recipe_id])
+
+
+@receiver(m2m_changed, sender=User.shopping_cart.through)
+def cart_m2m_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # add() bulk inserts through rows without post_save, while remove()
+    # and clear() go through the collector and pre_delete.
+    if action != 'post_add' or not pk_set:
+        return
+    if reverse:
+        change(pk_set, recipe_amounts([instance.pk]))
+    else:
+        add_recipes(instance.pk, pk_set)
+
 
-@receiver(post_delete, sender=Recipe)
 @receiver(post_save, sender=Recipe)
-def recipes_count_changed(sender, instance, **kwargs):
-    author = instance.author
-    author.recipes_count = author.recipes.count()
-    author.save()
+def recipe_published(sender, instance, created, **kwargs):
+    if created:
+        fan_out(instance)
+
+
+@receiver(post_save, sender=Subscribe)
+def subscribed(sender, instance, created, **kwargs):
+    if created:
+        backfill(instance.user_id, instance.author_id)
+
+
+# Connected after the counters above, so followers_count is already
+# decremented when follower_removed reads it.
+@receiver(post_delete, sender=Subscribe)
+def unsubscribed(sender, instance, **kwargs):
+    unfollow(instance.user_id, instance.author_id)
+    follower_removed(instance.author_id)
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    invalidate_token(instance.key)
+
+
+@receiver(post_delete, sender=User)
+@receiver(post_save, sender=User)
+def user_changed(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
+
+
+@receiver(post_save, sender=User)
+def author_changed(sender, instance, created, update_fields, **kwargs):
+    # Logins only touch last_login, which recipe payloads do not show.
+    if created or update_fields and not set(update_fields) & AUTHOR_FIELDS:
+        return
+    invalidate_recipes(Recipe.objects.filter(
+        author=instance).values_list('pk', flat=True))
+
+
+@receiver(user_logged_out)
+def user_logged_out_handler(sender, user, **kwargs):
+    if user is not None:
+        revoke_signed_tokens(user, time.time_ns())
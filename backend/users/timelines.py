@@ -0,0 +1,138 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connections, router, transaction
+
+from recipes.models import Recipe
+
+from .models import Subscribe, TimelineEntry
+
+User = get_user_model()
+
+# Recipes are copied into the timelines of the author's followers when
+# they are published (fan-out on write). Authors with more than
+# FEED_FANOUT_LIMIT followers are skipped and their recipes are merged
+# into the feed when it is read (fan-in), see api.feed. When an author
+# drops back below the limit, their followers' timelines are backfilled.
+
+
+def fans_out(author_id):
+    followers = User.objects.filter(pk=author_id).values_list(
+        'followers_count', flat=True).first()
+    return followers is not None and followers <= settings.FEED_FANOUT_LIMIT
+
+
+def get_connection():
+    return connections[router.db_for_write(TimelineEntry)]
+
+
+def get_columns(connection, model, *names):
+    return [connection.ops.quote_name(model._meta.get_field(name).column)
+            for name in names]
+
+
+def insert_sql(connection, recipes, where):
+    # Copies (follower, recipe) pairs from Subscribe joined to the
+    # ``recipes`` table expression aliased as r.
+    ops = connection.ops
+    subscriber, followed = get_columns(connection, Subscribe,
+                                       'user', 'author')
+    pk, author, pub_date = get_columns(connection, Recipe,
+                                       'id', 'author', 'pub_date')
+    columns = ', '.join(get_columns(connection, TimelineEntry,
+                                    'user', 'recipe', 'author', 'pub_date'))
+    return (
+        f'{ops.insert_statement(ignore_conflicts=True)} '
+        f'{ops.quote_name(TimelineEntry._meta.db_table)} ({columns}) '
+        f'SELECT s.{subscriber}, r.{pk}, r.{author}, r.{pub_date} '
+        f'FROM {ops.quote_name(Subscribe._meta.db_table)} s '
+        f'JOIN {recipes} r ON r.{author} = s.{followed} WHERE {where} '
+        f'{ops.ignore_conflicts_suffix_sql(ignore_conflicts=True)}'
+    ).rstrip()
+
+
+def fan_out(recipe):
+    fan_out_recipes(recipe.author_id, [recipe.pk])
+
+
+def fan_out_recipes(author_id, recipe_ids):
+    # One INSERT ... SELECT, follower ids never leave the database.
+    if not recipe_ids or not fans_out(author_id):
+        return
+    connection = get_connection()
+    pk, = get_columns(connection, Recipe, 'id')
+    placeholders = ', '.join(['%s'] * len(recipe_ids))
+    sql = insert_sql(connection,
+                     connection.ops.quote_name(Recipe._meta.db_table),
+                     f'r.{pk} IN ({placeholders})')
+    with connection.cursor() as cursor:
+        cursor.execute(sql, list(recipe_ids))
+
+
+def backfill(user_id, author_id):
+    if not fans_out(author_id):
+        return
+    recipes = Recipe.objects.filter(author_id=author_id).order_by(
+        '-pub_date', '-id').values_list('pk', 'pub_date')
+    TimelineEntry.objects.bulk_create(
+        (TimelineEntry(user_id=user_id, recipe_id=pk, author_id=author_id,
+                       pub_date=pub_date)
+         for pk, pub_date in recipes[:settings.FEED_BACKFILL]),
+        ignore_conflicts=True)
+
+
+def unfollow(user_id, author_id):
+    TimelineEntry.objects.filter(user_id=user_id, author_id=author_id).delete()
+
+
+def latest_recipes(connection, where=''):
+    # Recipes ranked newest first within each author.
+    pk, author, pub_date = get_columns(connection, Recipe,
+                                       'id', 'author', 'pub_date')
+    return (
+        f'(SELECT {pk}, {author}, {pub_date}, ROW_NUMBER() OVER '
+        f'(PARTITION BY {author} ORDER BY {pub_date} DESC, {pk} DESC) '
+        f'AS recipe_rank '
+        f'FROM {connection.ops.quote_name(Recipe._meta.db_table)}{where})')
+
+
+def follower_removed(author_id):
+    # Runs after the followers_count counter is decremented. Exactly at
+    # the limit the author has just dropped below it, and the recipes
+    # published above it were never copied into any timeline.
+    followers = User.objects.filter(pk=author_id).values_list(
+        'followers_count', flat=True).first()
+    if followers == settings.FEED_FANOUT_LIMIT:
+        transaction.on_commit(lambda: backfill_followers(author_id))
+
+
+def backfill_followers(author_id):
+    # Every follower gets the author's FEED_BACKFILL latest recipes, as
+    # if they had just subscribed.
+    if not fans_out(author_id):
+        return
+    connection = get_connection()
+    author, = get_columns(connection, Recipe, 'author')
+    sql = insert_sql(connection,
+                     latest_recipes(connection, f' WHERE {author} = %s'),
+                     'r.recipe_rank <= %s')
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [author_id, settings.FEED_BACKFILL])
+
+
+@transaction.atomic
+def rebuild():
+    # Every follower gets the FEED_BACKFILL latest recipes of each author
+    # below the fan-out limit, as if they had just subscribed.
+    TimelineEntry.objects.all().delete()
+    connection = get_connection()
+    quote = connection.ops.quote_name
+    author, = get_columns(connection, Recipe, 'author')
+    user_pk, followers = get_columns(connection, User,
+                                     'id', 'followers_count')
+    sql = insert_sql(connection, latest_recipes(connection), (
+        f'r.recipe_rank <= %s AND r.{author} IN (SELECT {user_pk} '
+        f'FROM {quote(User._meta.db_table)} WHERE {followers} <= %s)'))
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [settings.FEED_BACKFILL,
+                             settings.FEED_FANOUT_LIMIT])
+        return cursor.rowcount
@@ -0,0 +1,100 @@
+from django.db import connections, router, transaction
+from django.db.models.signals import m2m_changed, post_delete, pre_delete
+
+from recipes.models import Recipe
+
+# Favorite and ShoppingCart rows are written with a single statement and
+# the signals RelatedManager.add() and remove() would have sent are emitted
+# around it, so counters, memberships and shopping lists stay in sync.
+
+
+def get_links(model, using, user, recipe_ids):
+    return set(model.objects.using(using).filter(
+        user=user, recipe_id__in=recipe_ids
+    ).values_list('recipe_id', flat=True))
+
+
+def execute(model, user, recipe_ids, using, build_sql):
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    recipe_column = quote(model._meta.get_field('recipe').column)
+    sql = build_sql(
+        connection, quote(model._meta.db_table),
+        quote(model._meta.get_field('user').column), recipe_column,
+        ', '.join(['%s'] * len(recipe_ids)))
+    returning = connection.features.can_return_rows_from_bulk_insert
+    if returning:
+        sql += f' RETURNING {recipe_column}'
+    before = None
+    if not returning and len(recipe_ids) > 1:
+        # Without RETURNING (SQLite) the affected ids are the difference
+        # between the rows before and after the statement.
+        before = get_links(model, using, user, recipe_ids)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [user.pk, *recipe_ids])
+        if returning:
+            return {row[0] for row in cursor.fetchall()}
+        rowcount = cursor.rowcount
+    if before is None:
+        return set(recipe_ids) if rowcount else set()
+    return before ^ get_links(model, using, user, recipe_ids)
+
+
+def insert_sql(connection, table, user_column, recipe_column, placeholders):
+    recipes = connection.ops.quote_name(Recipe._meta.db_table)
+    pk = connection.ops.quote_name(Recipe._meta.pk.column)
+    return (
+        f'{connection.ops.insert_statement(ignore_conflicts=True)} {table} '
+        f'({user_column}, {recipe_column}) '
+        f'SELECT %s, {pk} FROM {recipes} WHERE {pk} IN ({placeholders}) '
+        f'{connection.ops.ignore_conflicts_suffix_sql(ignore_conflicts=True)}'
+    ).rstrip()
+
+
+def delete_sql(connection, table, user_column, recipe_column, placeholders):
+    return (f'DELETE FROM {table} WHERE {user_column} = %s '
+            f'AND {recipe_column} IN ({placeholders})')
+
+
+def add_links(model, user, recipe_ids):
+    recipe_ids = sorted(set(recipe_ids))
+    if not recipe_ids:
+        return set()
+    using = router.db_for_write(model)
+    with transaction.atomic(using=using):
+        added = execute(model, user, recipe_ids, using, insert_sql)
+        if added:
+            m2m_changed.send(
+                sender=model, action='post_add', instance=user,
+                reverse=False, model=Recipe, pk_set=added, using=using)
+    return added
+
+
+def remove_links(model, user, recipe_ids):
+    recipe_ids = sorted(set(recipe_ids))
+    if not recipe_ids:
+        return set()
+    using = router.db_for_write(model)
+    with transaction.atomic(using=using):
+        # The rows are locked first, so pre_delete goes out for the rows
+        # the DELETE is about to remove, as the collector would send it.
+        locked = model.objects.using(using).select_for_update().filter(
+            user=user, recipe_id__in=recipe_ids).order_by('recipe_id')
+        instances = [model(user_id=user.pk, recipe_id=recipe_id)
+                     for recipe_id in locked.values_list('recipe_id',
+                                                         flat=True)]
+        if not instances:
+            return set()
+        for instance in instances:
+            pre_delete.send(sender=model, instance=instance, using=using)
+        removed = execute(model, user, [
+            instance.recipe_id for instance in instances], using, delete_sql)
+        for instance in instances:
+            if instance.recipe_id in removed:
+                post_delete.send(sender=model, instance=instance,
+                                 using=using)
+        if removed:
+            m2m_changed.send(
+                sender=model, action='post_remove', instance=user,
+                reverse=False, model=Recipe, pk_set=removed, using=using)
+    return removed
@@ -0,0 +1,117 @@
+import copy
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.db import router
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+from recipes.cache import get_cache
+
+User = get_user_model()
+
+TOKEN_KEY = 'auth:token:{}'
+USER_KEY = 'auth:user:{}'
+SIGNING_SALT = 'users.tokens'
+
+
+def cache_entry(user):
+    # The password hash stays out of the cache, only its fingerprint is
+    # kept; the field is deferred and loads again if a view reads it.
+    cached = copy.copy(user)
+    cached.__dict__.pop('password', None)
+    return cached, password_hash(user)
+
+
+def load_user(user_id):
+    # Returns the user with its password fingerprint. Read from the primary:
+    # a lagging replica would bring back a revoked password or logout.
+    cache = get_cache('AUTH_TOKEN_CACHE_ALIAS')
+    key = USER_KEY.format(user_id)
+    if cache is not None:
+        entry = cache.get(key)
+        if entry is not None:
+            return entry
+    user = User.objects.using(router.db_for_write(User)).filter(
+        pk=user_id).first()
+    if user is None:
+        return None, None
+    entry = cache_entry(user)
+    if cache is not None:
+        cache.set(key, entry, settings.AUTH_TOKEN_CACHE_TIMEOUT)
+    return user, entry[1]
+
+
+def get_user(user_id):
+    return load_user(user_id)[0]
+
+
+def get_token_user_id(key):
+    cache = get_cache('AUTH_TOKEN_CACHE_ALIAS')
+    if cache is None:
+        return None
+    return cache.get(TOKEN_KEY.format(key))
+
+
+def cache_token(key, user):
+    cache = get_cache('AUTH_TOKEN_CACHE_ALIAS')
+    if cache is None:
+        return
+    cache.set_many({TOKEN_KEY.format(key): user.pk,
+                    USER_KEY.format(user.pk): cache_entry(user)},
+                   settings.AUTH_TOKEN_CACHE_TIMEOUT)
+
+
+def invalidate_token(*keys):
+    cache = get_cache('AUTH_TOKEN_CACHE_ALIAS')
+    if cache is None:
+        return
+    cache.delete_many([TOKEN_KEY.format(key) for key in keys])
+
+
+def invalidate_user(*user_ids):
+    cache = get_cache('AUTH_TOKEN_CACHE_ALIAS')
+    if cache is None:
+        return
+    cache.delete_many([USER_KEY.format(pk) for pk in user_ids])
+
+
+def password_hash(user):
+    # Changing the password changes the hash and revokes signed tokens.
+    return salted_hmac(SIGNING_SALT, user.password).hexdigest()[:16]
+
+
+def make_signed_token(user):
+    # The signer timestamp has whole-second precision, too coarse to order
+    # a login against a logout within the same second.
+    return signing.TimestampSigner(salt=SIGNING_SALT).sign_object(
+        {'id': user.pk, 'hash': password_hash(user),
+         'issued': time.time_ns()})
+
+
+def read_signed_token(token):
+    signer = signing.TimestampSigner(salt=SIGNING_SALT)
+    try:
+        payload = signer.unsign_object(
+            token, max_age=settings.AUTH_SIGNED_TOKEN_MAX_AGE)
+    except (signing.BadSignature, TypeError, ValueError):
+        return None
+    if not isinstance(payload, dict) or not isinstance(
+            payload.get('issued'), int):
+        return None
+    user, fingerprint = load_user(payload.get('id'))
+    if user is None or not constant_time_compare(
+            payload.get('hash'), fingerprint):
+        return None
+    if payload['issued'] < user.tokens_valid_after:
+        return None
+    return user
+
+
+def revoke_signed_tokens(user, timestamp):
+    # Tokens issued before the timestamp, in nanoseconds, are rejected.
+    # The cutoff is stored with the user, so every process sees it.
+    User.objects.filter(pk=user.pk, tokens_valid_after__lt=timestamp).update(
+        tokens_valid_after=timestamp)
+    invalidate_user(user.pk)